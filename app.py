@@ -5,37 +5,167 @@
 # db.create_all()
 
 # imports for Flask, the Flask db handler and the tinyRSA library
-from flask import Flask, render_template, url_for, request, redirect
+from flask import Flask, render_template, url_for, request, redirect, jsonify, g
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import sqlite3
+import os
+import queue
+import time
+from concurrent.futures import TimeoutError
 
-import tinyRSA_lib as RSAlib
-from tinyRSA_key import TinyRSA_key as RSAkey
-from tinyRSA_message import TinyRSA_message as RSAmessage
+from tinyRSA_lib import max_nprimes
+from tinyRSA_keypool import TinyRSA_keypool as RSAkeypool
+from tinyRSA_cache import TinyRSA_cache as RSAcache
+import tinyRSA_store as RSAstore
+import tinyRSA_metrics as RSAmetrics
+import tinyRSA_wire as RSAwire
+from tinyRSA_jobs import TinyRSA_jobs as RSAjobs
+from tinyRSA_jobs import new_key, new_keys, batch_operation
 
 # Initialize the app and the database (called rsa)
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///rsa.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('TINYRSA_DATABASE_URI', 'sqlite:///rsa.db')   # the load test runs the app on another database
 db = SQLAlchemy(app)
 
+# Cache of the keys built from the database (id -> TinyRSA_key with n, d and the CRT parameters already computed)
+app.config.setdefault('KEY_CACHE_SIZE', 1024)
+key_cache = RSAcache(app.config['KEY_CACHE_SIZE'])
+
+# Cache of the encrypted and decrypted blocks of each key id, in each process of the pool (textbook RSA gives the same result for the same block, see tinyRSA_jobs.block_cache)
+app.config.setdefault('BLOCK_CACHE_SIZE', 1024)     # number of blocks kept per key id, 0 disables the cache
+
+# Maximum number of items in one request of the JSON API
+app.config.setdefault('API_MAX_ITEMS', 10000)
+
+# Formats of the cipher texts given by the forms and the JSON API : binary strings, or the compact container of tinyRSA_wire as text
+TEXT_FORMATS = ("bits", "hex", "base64")
+
+# Pool of processes doing the key generation, encryption and decryption, so the web workers are never stuck computing
+# Run gunicorn with threads (see the Procfile) so the other requests are served while a worker waits for a result
+app.config.setdefault('WORKER_PROCESSES', None)     # number of processes (number of cores by default, 0 computes inline)
+app.config.setdefault('WORKER_MAX_PENDING', 64)     # above this number of pending jobs the requests are rejected with 429
+app.config.setdefault('WORKER_TIMEOUT', 60)         # seconds a synchronous request waits for its result
+jobs = RSAjobs(app.config['WORKER_PROCESSES'], app.config['WORKER_MAX_PENDING'])
+
+# Pools of pre-generated keys for the popular bitlengths, the other bitlengths are generated on demand
+# The pools are refilled by the pool of processes, never in the web workers
+app.config.setdefault('KEY_POOL_BITLENGTHS', [8, 16, 32, 64, 128, 256, 512])
+app.config.setdefault('KEY_POOL_SIZE', 4)
+key_pool = RSAkeypool(app.config['KEY_POOL_BITLENGTHS'], app.config['KEY_POOL_SIZE'], jobs)
+
+# Instrumentation of the library and of the app, exported on /metrics (see tinyRSA_metrics)
+app.config.setdefault('METRICS_ENABLED', True)
+if app.config['METRICS_ENABLED']:
+    RSAmetrics.enable()
+
 # Create the database scheme
 
 class tinyRSA_scheme(db.Model):
     '''
     This class is used to keep track of the keys so a user to encrypt and decrypt with the same key.
     Consider having a feature with accounts and store keys that belong to someone to that they can reuse them.
-    WARNING the maximum size for integers in SQLite is 2^63. Therefore 31 and 30 are the maximum bit lengths for p and q
-    Consider storing integers as strings and converting with Python
+    The integers are stored as big endian BLOBs (see tinyRSA_store), with the derived values so a key is loaded without any computation.
     '''
+    __tablename__ = 'RSA_scheme'
     id = db.Column(db.Integer, primary_key=True)
-    p = db.Column(db.String(512), unique=False)
-    q = db.Column(db.String(512), unique=False)
-    # n = db.Column(db.String(620), unique=False)
-    e = db.Column(db.String(64), unique=False)
-    # d = db.Column(db.String(620), unique=False)
+    p = db.Column(db.LargeBinary)
+    q = db.Column(db.LargeBinary)
+    n = db.Column(db.LargeBinary)
+    e = db.Column(db.LargeBinary)
+    d = db.Column(db.LargeBinary)
+    dp = db.Column(db.LargeBinary)              # CRT parameters, empty when the primes are not distinct
+    dq = db.Column(db.LargeBinary)
+    qinv = db.Column(db.LargeBinary)
+    extra_primes = db.Column(db.LargeBinary)    # primes after p and q of a multi-prime key, packed with tinyRSA_store.pack_ints
+    extra_crt = db.Column(db.LargeBinary)       # their CRT parameters
 
     def __repr__(self):
         return("<id {}>".format(self.id))
 
+RSA_scheme = tinyRSA_scheme
+
+# Every SQLite connection uses the write-ahead log, so the readers don't wait for the writers and the commits are cheaper
+@event.listens_for(Engine, 'connect')
+def set_wal(connection, record):
+    if isinstance(connection, sqlite3.Connection):
+        RSAstore.enable_wal(connection)
+
+# Duration of the database queries made through SQLAlchemy
+@event.listens_for(Engine, 'before_cursor_execute')
+def query_start(connection, cursor, statement, parameters, context, executemany):
+    if RSAmetrics.enabled:
+        connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def query_end(connection, cursor, statement, parameters, context, executemany):
+    if RSAmetrics.enabled and connection.info.get('query_start'):
+        RSAmetrics.observe("tinyrsa_db_query_seconds", time.perf_counter()-connection.info['query_start'].pop(), statement=statement.split(None, 1)[0].upper())
+
+@app.before_first_request
+def upgrade_schema():
+    '''
+    This function creates the table if needed and migrates the table of an older version (decimal strings) to the BLOB storage.
+    It runs before the first request is served.
+    '''
+    connection = db.engine.raw_connection()
+    try:
+        RSAstore.upgrade(connection)
+    finally:
+        connection.close()
+
+def key_to_row(key):
+    '''
+    This function returns a new row of the database for the key.
+    '''
+    return(RSA_scheme(**RSAstore.key_to_record(key)))
+
+# Drop the cached key when its row changes (only for changes made through the session, bulk query updates bypass these events)
+@event.listens_for(tinyRSA_scheme, 'after_update')
+@event.listens_for(tinyRSA_scheme, 'after_delete')
+def invalidate_key(mapper, connection, target):
+    key_cache.invalidate(target.id)
+
+def load_key(id):
+    '''
+    This function returns the TinyRSA_key stored with id, or None if there is no such key.
+    The key is restored once from the stored values then served from key_cache.
+    '''
+    key = key_cache.get(id)
+    if key==None:
+        row = RSA_scheme.query.get(id)
+        if row==None:
+            return(None)
+        key = RSAstore.record_to_key(row)
+        key_cache.put(id, key)
+    return(key)
+
+# Duration of the requests, by endpoint
+@app.before_request
+def request_start():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def request_end(response):
+    if RSAmetrics.enabled and 'request_start' in g:
+        RSAmetrics.observe("tinyrsa_http_request_seconds", time.perf_counter()-g.request_start, endpoint=request.endpoint or "none", method=request.method, status=response.status_code)
+    return(response)
+
+@app.errorhandler(queue.Full)
+def saturated(error):
+    '''
+    The pool of processes is saturated, ask the client to come back later.
+    '''
+    return(jsonify({"error": "Too many pending jobs, retry later"}), 429, {"Retry-After": "1"})
+
+@app.errorhandler(TimeoutError)
+def timeout(error):
+    '''
+    The result wasn't ready in time, the long jobs should use the asynchronous mode of the JSON API.
+    '''
+    return(jsonify({"error": "The job took too long, use the asynchronous mode (?async=1)"}), 503)
+
 # The default route, loads the home page
 @app.route('/', methods=['POST','GET'])
 def index():
@@ -47,28 +177,39 @@ def index():
             then someone just asked to create new keys. Perform the logic and redirect
     Security checks for request and form name.
 
-    TODO
-            - Retreive the value of the bitlength from the form
+    The form can also give the number of primes of the key (nprimes, 2 by default), only two-prime keys come from the key pool.
     '''
     if request.method=='GET':       # If the request is get just serve the home page
         return(render_template("index.html"))
     elif request.method=='POST':    # If request is post then execute logic
         try:                        # Check for validity of key length
             bitlength = int(request.form["bitlength"])
-            if bitlength<2 or bitlength>1024:
-                return("Invalid bitlength for the key, provide an integer ranging from 2 to 1024")
+            if bitlength<3 or bitlength>1024:
+                return("Invalid bitlength for the key, provide an integer ranging from 3 to 1024", 400)
             # else:
             #     return("Bitlength = {}".format(bitlength))
         except:
-            return("Invalid bitlength for the key, provide an integer ranging from 2 to 1024")
+            return("Invalid bitlength for the key, provide an integer ranging from 3 to 1024", 400)
+        limit = max_nprimes(bitlength)  # largest number of distinct primes a key of this bitlength can have
+        try:                        # Check for validity of the number of primes
+            nprimes = int(request.form.get("nprimes") or 2)
+            if nprimes<2 or nprimes>limit:
+                raise ValueError
+        except ValueError:
+            return("Invalid number of primes for the key, provide an integer ranging from 2 to {} for a bitlength of {}".format(limit, bitlength), 400)
         # Once here we know the bitlength is valid
-        key = RSAkey()
-        key.create_new(bitlength)
-        new_key=RSA_scheme(p=key.p, q=key.q, e=key.e)
+        key = key_pool.take(bitlength) if nprimes==2 else None  # ready key from the pool
+        if key==None:               # or generated on demand by the pool of processes
+            try:
+                key = jobs.run(new_key, bitlength, nprimes, timeout=app.config['WORKER_TIMEOUT'])
+            except ValueError as error:
+                return(str(error), 400)
+        new_row=key_to_row(key)
         try:
-            db.session.add(new_key)
+            db.session.add(new_row)
             db.session.commit()
-            return(render_template("encrypt.html", keys=key, ids=new_key.id))
+            key_cache.put(new_row.id, key)  # the key is already built, no need to load it again for the first encryption
+            return(render_template("encrypt.html", keys=key, ids=new_row.id))
         except:
             return("Failed at generating the keys")
     else:
@@ -94,40 +235,41 @@ def index():
     # else:
     #     return("Bad request")
 
+# Endpoint to monitor the key pools
+@app.route('/pool', methods=['GET'])
+def pool():
+    '''
+    This function returns the depth, hit and miss counts of the key pools as JSON, to help sizing them.
+    '''
+    return(jsonify({str(bitlength): stats for bitlength, stats in key_pool.stats().items()}))
+
+# Endpoint to monitor the key cache
+@app.route('/cache', methods=['GET'])
+def cache():
+    '''
+    This function returns the size, hit, miss and eviction counts of the key cache as JSON.
+    '''
+    return(jsonify(key_cache.stats()))
+
 # Endpoint to encrypt the content of the form
 @app.route('/encrypt/<int:id>', methods=['POST'])
 def encrypt(id):
     '''
     This function encrypts the content of the form using the key associated with id
     '''
-    key=RSA_scheme.query.filter_by(id=str(id)).all()
+    key=load_key(id)
+    if key==None:
+        return("Unknown key", 404)
     message=request.form['plain']
+    cipher_format=request.form.get('format', 'bits')   # binary string, or compact container as hexadecimal or base64 text
+    if cipher_format not in TEXT_FORMATS:
+        return("Unknown cipher format", 400)
 
-    # Perform the encryption algorithm on the plain text
-
-    msg = RSAmessage()
-    msg.add_plain(message)
-    p = key[0].p
-    q = key[0].q
-    e = key[0].e
-    
-    # bitlength = 512
-    #
-    # bin_message = encode_message(message, 2*bitlength) # turn the message in binary
-    # bin_message_blocks = string_to_blocks(bin_message, 2*bitlength) # generator of blocks
-    #
-    # # Encrypt the message
-    #
-    # e = int(key[0].e)
-    # n = int(key[0].n)
-    #
-    # bin_cipher = ""
-    # for bin_block in bin_message_blocks:
-    #     bin_cipher += crypt_block(bin_block, e, n)
-    #
-    # cipher = display_bin_block(bin_cipher)
-    # cipher = ascii_to_hex(cipher)
-    # return(render_template("encrypt.html", keys=key, cipher=cipher))
+    # Perform the encryption algorithm on the plain text (in the pool of processes)
+    status, ciphers = jobs.run(batch_operation, "encrypt", [(key, [message], id)], cipher_format, app.config['BLOCK_CACHE_SIZE'], timeout=app.config['WORKER_TIMEOUT'])[0]
+    if status=="error":
+        return(ciphers, 400)
+    return(render_template("encrypt.html", keys=key, ids=id, plain=message, cipher=ciphers[0], format=cipher_format))
 
 # Endpoint to decrypt the content of the form
 @app.route('/decrypt/<int:id>', methods=['POST'])
@@ -135,33 +277,180 @@ def decrypt(id):
     '''
     This function decrypts the content of the form using the keys associated with id
     '''
-    key=RSA_scheme.query.filter_by(id=str(id)).all()
+    key=load_key(id)
+    if key==None:
+        return("Unknown key", 404)
     cipher=request.form['cipher']
 
-    # Perform the decryption algorithm on the message
+    # Perform the decryption algorithm on the cipher text (in the pool of processes), any format of cipher text is accepted
+    status, plains = jobs.run(batch_operation, "decrypt", [(key, [cipher], id)], "bits", app.config['BLOCK_CACHE_SIZE'], timeout=app.config['WORKER_TIMEOUT'])[0]
+    if status=="error":
+        return(plains, 400)
+    return(render_template("encrypt.html", keys=key, ids=id, plain=plains[0], cipher=cipher, format=RSAwire.detect_format(cipher)))
+
+def key_to_json(id, key):
+    '''
+    This function returns the public and private values of a key as a dictionary (integers as strings because they can be larger than JSON numbers).
+    '''
+    return({"id": id, "p": str(key.p), "q": str(key.q), "extra_primes": [str(prime) for prime in key.extra_primes], "n": str(key.n), "e": str(key.e), "d": str(key.d)})
+
+def read_items(field):
+    '''
+    This function reads the list of items {"id": key id, field: text} of a JSON API request.
+    Returns the list of items, or None if the request is invalid.
+    '''
+    body = request.get_json(silent=True)
+    items = body.get("items") if isinstance(body, dict) else None
+    if not isinstance(items, list) or len(items)>app.config['API_MAX_ITEMS']:
+        return(None)
+    for item in items:
+        if not (isinstance(item, dict) and isinstance(item.get("id"), int) and isinstance(item.get(field), str)):
+            return(None)
+    return(items)
+
+def run_batch(items, field, result_field, operation, cipher_format="bits"):
+    '''
+    This function groups the items by key id, loads each key once and sends all the texts to the pool of processes in a single job (see tinyRSA_jobs.batch_operation).
+    operation is "encrypt" or "decrypt", the cipher texts are written in cipher_format.
+    Returns the JSON response : the list of results in the order of the items (an item with an unknown key or an invalid text gets an error instead),
+    or the id of the job with ?async=1 (the results are then given by /jobs/<id>).
+    '''
+    groups = {}                 # key id -> indexes of the items using this key
+    for index, item in enumerate(items):
+        groups.setdefault(item["id"], []).append(index)
+
+    results = [None]*len(items)
+    work = []                   # (indexes, key, texts) of the groups to compute
+    for id, indexes in groups.items():
+        key = load_key(id)
+        if key==None:
+            for index in indexes:
+                results[index] = {"id": id, "error": "Unknown key"}
+        else:
+            work.append((indexes, key, [items[index][field] for index in indexes]))
 
-    # Encode the message
+    def assemble(outputs):
+        '''
+        Put the outputs of the job back in the order of the items.
+        '''
+        for (indexes, key, texts), (status, output) in zip(work, outputs):
+            for position, index in enumerate(indexes):
+                id = items[index]["id"]
+                results[index] = {"id": id, result_field: output[position]} if status=="ok" else {"id": id, "error": output}
+        return({"results": results})
 
-    bitlength = 512
+    arguments = (batch_operation, operation, [(key, texts, items[indexes[0]]["id"]) for indexes, key, texts in work], cipher_format, app.config['BLOCK_CACHE_SIZE'])
+    if request.args.get("async"):
+        return(jsonify({"job": jobs.submit(*arguments, then=assemble), "status": "pending"}), 202)
+    return(jsonify(jobs.run(*arguments, then=assemble, timeout=app.config['WORKER_TIMEOUT'])))
 
-    cipher = hex_to_ascii(cipher)
+# Endpoint of the JSON API to encrypt many messages at once
+@app.route('/api/encrypt', methods=['POST'])
+def api_encrypt():
+    '''
+    This function encrypts a list of messages, the body is {"items": [{"id": key id, "plain": text}, ...], "format": "bits", "hex" or "base64" (optional)}
+    Returns {"results": [{"id": key id, "cipher": cipher text}, ...]} in the same order, the cipher texts are binary strings unless another format is asked.
+    With ?async=1, returns {"job": job id} right away and the results are given by /jobs/<job id>.
+    '''
+    items = read_items("plain")
+    if items==None:
+        return(jsonify({"error": "Expected {{\"items\": [{{\"id\": int, \"plain\": str}}, ...]}} with at most {} items".format(app.config['API_MAX_ITEMS'])}), 400)
+    cipher_format = request.get_json().get("format", "bits")
+    if cipher_format not in TEXT_FORMATS:
+        return(jsonify({"error": "Unknown cipher format, expected one of {}".format(", ".join(TEXT_FORMATS))}), 400)
+    return(run_batch(items, "plain", "cipher", "encrypt", cipher_format))
 
-    bin_cipher = encode_message(cipher, 2*bitlength) # turn the message in binary
-    bin_cipher_blocks = string_to_blocks(bin_cipher, 2*bitlength) # generator of blocks
+# Endpoint of the JSON API to decrypt many messages at once
+@app.route('/api/decrypt', methods=['POST'])
+def api_decrypt():
+    '''
+    This function decrypts a list of messages, the body is {"items": [{"id": key id, "cipher": cipher text}, ...]}, each cipher text being a binary string or a hexadecimal or base64 container
+    Returns {"results": [{"id": key id, "plain": text}, ...]} in the same order.
+    With ?async=1, returns {"job": job id} right away and the results are given by /jobs/<job id>.
+    '''
+    items = read_items("cipher")
+    if items==None:
+        return(jsonify({"error": "Expected {{\"items\": [{{\"id\": int, \"cipher\": str}}, ...]}} with at most {} items".format(app.config['API_MAX_ITEMS'])}), 400)
+    return(run_batch(items, "cipher", "plain", "decrypt"))
 
-    # Decrypt the message
+# Endpoint of the JSON API to generate many keys at once
+@app.route('/api/keys', methods=['POST'])
+def api_keys():
+    '''
+    This function generates keys, the body is {"bitlengths": [bitlength, ...]} (one key per bitlength, between 3 and 1024).
+    The body can also have "nprimes" (2 by default) to generate multi-prime keys, up to the number of distinct primes the smallest bitlength allows (see tinyRSA_lib.max_nprimes).
+    The keys are stored with batched commits and returned as {"keys": [{"id", "p", "q", "n", "e", "d"}, ...]}.
+    '''
+    body = request.get_json(silent=True)
+    bitlengths = body.get("bitlengths") if isinstance(body, dict) else None
+    if not (isinstance(bitlengths, list) and len(bitlengths)<=app.config['API_MAX_ITEMS'] and all(isinstance(bitlength, int) and 3<=bitlength<=1024 for bitlength in bitlengths)):
+        return(jsonify({"error": "Expected {{\"bitlengths\": [int, ...]}} with integers ranging from 3 to 1024 and at most {} items".format(app.config['API_MAX_ITEMS'])}), 400)
+
+    nprimes = body.get("nprimes", 2)
+    limit = min((max_nprimes(bitlength) for bitlength in set(bitlengths)), default=2)     # largest number of distinct primes a key of each bitlength can have
+    if not (isinstance(nprimes, int) and 2<=nprimes<=limit):
+        return(jsonify({"error": "Expected \"nprimes\" to be an integer ranging from 2 to {} for these bitlengths".format(limit)}), 400)
 
-    d = int(key[0].d)
-    n = int(key[0].n)
+    keys = [key_pool.take(bitlength) if nprimes==2 else None for bitlength in bitlengths]  # ready keys from the pool
+    missing = [bitlength for bitlength, key in zip(bitlengths, keys) if key==None]      # the others are generated by the pool of processes
+
+    def store(generated):
+        '''
+        Store all the keys with batched commits (see tinyRSA_store.insert_keys).
+        '''
+        generated = iter(generated)
+        complete = [key if key!=None else next(generated) for key in keys]
+        connection = db.engine.raw_connection()
+        try:
+            with RSAmetrics.timer("tinyrsa_db_query_seconds", statement="INSERT"):
+                ids = RSAstore.insert_keys(connection, complete)
+        finally:
+            connection.close()
+        for id, key in zip(ids, complete):
+            key_cache.put(id, key)
+        return({"keys": [key_to_json(id, key) for id, key in zip(ids, complete)]})
 
-    bin_plain = ""
-    for bin_block in bin_cipher_blocks:
-        bin_plain += crypt_block(bin_block, d, n)
+    if request.args.get("async"):
+        return(jsonify({"job": jobs.submit(new_keys, missing, nprimes, then=store), "status": "pending"}), 202)
+    try:
+        return(jsonify(jobs.run(new_keys, missing, nprimes, then=store, timeout=app.config['WORKER_TIMEOUT'])))
+    except ValueError as error:
+        return(jsonify({"error": str(error)}), 400)
 
-    plain = display_bin_block(bin_plain)
-    plain = hex_to_ascii(ascii_to_hex(plain))
-    # return(plain)
-    return(render_template("encrypt.html", keys=key, plain=plain))
+# Endpoint to follow the asynchronous jobs
+@app.route('/jobs/<id>', methods=['GET'])
+def job_status(id):
+    '''
+    This function returns the status of a job of the JSON API : {"id", "status"} with status "pending", "running", "done" (with "result") or "failed" (with "error").
+    '''
+    status = jobs.status(id)
+    if status==None:
+        return(jsonify({"error": "Unknown job"}), 404)
+    return(jsonify(status))
+
+# Endpoint to monitor the pool of processes
+@app.route('/jobs', methods=['GET'])
+def job_stats():
+    '''
+    This function returns the number of processes, pending, submitted and rejected jobs as JSON.
+    '''
+    return(jsonify(jobs.stats()))
+
+# Endpoint for the Prometheus scraper
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    '''
+    This function returns the metrics of the library and of the app in the Prometheus text format, with the state of the key pools, the key cache and the pool of processes.
+    The metrics of each gunicorn worker are separate, so each worker has to be scraped.
+    '''
+    for bitlength, stats in key_pool.stats().items():
+        for name, value in stats.items():
+            RSAmetrics.set_gauge("tinyrsa_key_pool_" + name, value, bitlength=bitlength)
+    for name, value in key_cache.stats().items():
+        RSAmetrics.set_gauge("tinyrsa_key_cache_" + name, value)
+    for name, value in jobs.stats().items():
+        RSAmetrics.set_gauge("tinyrsa_jobs_" + name, value)
+    return(RSAmetrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
 
 if __name__=="__main__":
     app.run(debug=True)
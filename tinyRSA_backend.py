@@ -0,0 +1,153 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the arithmetic backends used by TinyRSA for the operations on big integers
+# All the backends give exactly the same results (always Python int), they only differ in speed :
+#       - python    (the hand-written loops of the original TinyRSA, kept as a reference)
+#       - stdlib    (math.gcd and the builtin pow, default)
+#       - gmpy2     (GMP through the gmpy2 package, only available if it is installed)
+#
+# The backend is chosen at import time : gmpy2 if it is installed, stdlib otherwise.
+# The choice can be forced with the environment variable TINYRSA_BACKEND (python, stdlib, gmpy2 or auto) or changed later with set_backend.
+#
+# List of functions :
+#       - available_backends        (list the backends that can be used)
+#       - load_backend              (create a backend from its name)
+#       - set_backend               (change the backend used by TinyRSA)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+import math
+import os
+
+class PythonBackend():
+    """
+    Reference backend with the hand-written Euclidian algorithms, it is the slowest.
+    """
+    name = "python"
+
+    def gcd(self, a, b):
+        """
+        Computes the gcd of a and b using the euclidian algorithm
+        """
+        while b!=0:
+            a, b = b, a%b   # gcd(a, b) = gcd(b, a%b)
+        return(abs(a))
+
+    def invert(self, a, b):
+        """
+        Computes the multiplicative inverse of a mod b using the extended Euclidian algorithm, raises ValueError if a and b are not coprime.
+        For more information https://brilliant.org/wiki/extended-euclidean-algorithm/
+        """
+        b2 = b          # we need a trace of b to rectify the last value of x
+        a = a%b
+        x, u = 0, 1     # initialize the sequence
+        while a!=0:
+            q, r = b//a, b%a
+            b, a, x, u = a, r, u, x-u*q
+        if b!=1:
+            raise ValueError("base is not invertible for the given modulus")
+        return(x%b2)
+
+    def powmod(self, base, exponent, modulus):
+        """
+        Computes base^exponent mod modulus.
+        """
+        return(pow(base, exponent, modulus))
+
+class StdlibBackend():
+    """
+    Backend based on the standard library, math.gcd and pow(a, -1, b) are implemented in C.
+    """
+    name = "stdlib"
+
+    def gcd(self, a, b):
+        return(math.gcd(a, b))
+
+    def invert(self, a, b):
+        return(pow(a, -1, b))   # raises ValueError if a and b are not coprime
+
+    def powmod(self, base, exponent, modulus):
+        return(pow(base, exponent, modulus))
+
+class Gmpy2Backend():
+    """
+    Backend based on GMP through the gmpy2 package, much faster for large integers.
+    The results are converted back to Python int so the rest of TinyRSA doesn't see the difference.
+    """
+    name = "gmpy2"
+
+    def __init__(self):
+        import gmpy2        # raises ImportError if gmpy2 is not installed
+        self.gmpy2 = gmpy2
+
+    def gcd(self, a, b):
+        return(int(self.gmpy2.gcd(a, b)))
+
+    def invert(self, a, b):
+        try:
+            return(int(self.gmpy2.invert(a, b)))
+        except ZeroDivisionError:
+            raise ValueError("base is not invertible for the given modulus")
+
+    def powmod(self, base, exponent, modulus):
+        return(int(self.gmpy2.powmod(base, exponent, modulus)))
+
+BACKENDS = {
+    "python": PythonBackend,
+    "stdlib": StdlibBackend,
+    "gmpy2": Gmpy2Backend,
+}
+
+# START available_backends FUNCTION
+
+def available_backends():
+    """
+    Returns the list of the names of the backends that can be used (the optional ones need their package to be installed).
+    """
+    names = []
+    for name, backend_class in BACKENDS.items():
+        try:
+            backend_class()
+        except ImportError:
+            continue
+        names.append(name)
+    return(names)
+
+# END available_backends FUNCTION
+
+# START load_backend FUNCTION
+
+def load_backend(name=None):
+    """
+    Returns a backend object from its name.
+    If name is None the environment variable TINYRSA_BACKEND is used, "auto" (or no value) picks gmpy2 if it is installed and stdlib otherwise.
+    """
+    if name==None:
+        name = os.environ.get("TINYRSA_BACKEND", "auto")
+    if name=="auto":
+        try:
+            return(Gmpy2Backend())
+        except ImportError:
+            return(StdlibBackend())
+    if name not in BACKENDS:
+        raise ValueError("Unknown arithmetic backend {}, choose from {}".format(name, ", ".join(["auto"] + list(BACKENDS))))
+    return(BACKENDS[name]())
+
+# END load_backend FUNCTION
+
+backend = load_backend()    # backend used by TinyRSA
+
+# START set_backend FUNCTION
+
+def set_backend(name):
+    """
+    Change the backend used by TinyRSA and return the previous one.
+    """
+    global backend
+    previous = backend
+    backend = load_backend(name)
+    return(previous)
+
+# END set_backend FUNCTION
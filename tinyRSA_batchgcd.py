@@ -0,0 +1,179 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the batch GCD tool to find the keys of the database that share a prime with another key
+# If two moduli n1 = p*q1 and n2 = p*q2 share p, then gcd(n1, n2) = p and both keys are broken
+# Checking every pair is O(k^2), the batch GCD of Bernstein does it in quasi-linear time with a product tree and a remainder tree :
+#       - the product tree multiplies the moduli two by two up to the product P of all the moduli
+#       - the remainder tree reduces P modulo the square of each node down to the leaves, giving P mod n^2 for each modulus n
+#       - gcd((P mod n^2)/n, n) is the product of the primes that n shares with the other moduli
+# For more information https://facthacks.cr.yp.to/batchgcd.html
+#
+# To work on key sets larger than the memory, the moduli are streamed out of the database into chunk files on disk.
+# Each chunk gets its own product and remainder trees in memory, the other chunks only contribute through their product (streamed from disk).
+# With k chunks this adds O(k^2) multiplications of chunk-sized numbers, with a single chunk it is the plain batch GCD.
+#
+# Run it with python3 tinyRSA_batchgcd.py [database] [--chunk-size N] [--workdir DIR]
+#
+# List of functions :
+#       - write_int                 (write an integer to a binary file)
+#       - read_ints                 (read the integers written by write_int)
+#       - stream_moduli             (read the moduli of the keys stored in the database)
+#       - product_tree              (compute the product tree of a list of integers)
+#       - remainder_tree            (reduce a number down a product tree)
+#       - batch_gcd                 (find the moduli sharing a factor with another one)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+import argparse
+import math
+import os
+import sqlite3
+import tempfile
+
+from tinyRSA_store import blob_to_int
+
+CHUNK_SIZE = 65536      # number of moduli held in memory at once
+
+# START write_int FUNCTION
+
+def write_int(stream, value):
+    """
+    Write the positive integer value to the binary stream as its length in bytes (8 bytes) followed by its big endian bytes.
+    """
+    nbytes = (value.bit_length()+7)//8
+    stream.write(nbytes.to_bytes(8, "big"))
+    stream.write(value.to_bytes(nbytes, "big"))
+
+# END write_int FUNCTION
+
+# START read_ints FUNCTION
+
+def read_ints(stream):
+    """
+    Generator returning the integers written to the binary stream by write_int, one at a time.
+    """
+    while True:
+        header = stream.read(8)
+        if not header:
+            return
+        yield int.from_bytes(stream.read(int.from_bytes(header, "big")), "big")
+
+# END read_ints FUNCTION
+
+# START stream_moduli FUNCTION
+
+def stream_moduli(database="rsa.db"):
+    """
+    Generator returning (id, n) for each key of the RSA_scheme table of the SQLite database, without loading the whole table.
+    n is read from its column when the table has one and it is set, otherwise it is computed as p*q (the integers are BLOBs, or decimal strings in an older database).
+    """
+    connection = sqlite3.connect(database)
+    try:
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(RSA_scheme)")]
+        query = "SELECT id, p, q, {} FROM RSA_scheme ORDER BY id".format("n" if "n" in columns else "NULL")
+        for id, p, q, n in connection.execute(query):
+            if n:
+                yield id, blob_to_int(n)
+            elif p and q:
+                yield id, blob_to_int(p)*blob_to_int(q)
+    finally:
+        connection.close()
+
+# END stream_moduli FUNCTION
+
+# START product_tree FUNCTION
+
+def product_tree(values):
+    """
+    Returns the product tree of values as a list of levels : the first level is values, each next level holds the products of the pairs of the previous one (an odd last value is carried up) and the last level holds the product of all the values.
+    """
+    tree = [list(values)]
+    while len(tree[-1])>1:
+        level = tree[-1]
+        tree.append([level[i]*level[i+1] if i+1<len(level) else level[i] for i in range(0, len(level), 2)])
+    return(tree)
+
+# END product_tree FUNCTION
+
+# START remainder_tree FUNCTION
+
+def remainder_tree(root, tree):
+    """
+    Reduce root modulo the square of each node of the product tree, from the top down to the leaves, and return the list of root mod leaf^2 for each leaf.
+    Reducing modulo the parent first keeps the numbers small, this is what makes the algorithm quasi-linear.
+    """
+    remainders = [root]
+    for level in reversed(tree):
+        remainders = [remainders[i//2] % (level[i]*level[i]) for i in range(len(level))]
+    return(remainders)
+
+# END remainder_tree FUNCTION
+
+# START batch_gcd FUNCTION
+
+def batch_gcd(moduli, chunk_size=CHUNK_SIZE, workdir=None):
+    """
+    Generator returning (id, n, g) for each modulus n of moduli (an iterable of (id, n) pairs, for example stream_moduli) that shares a factor with another modulus.
+    g is the product of the shared primes : a prime of n, or n itself when both of its primes are shared (or when the same modulus appears twice).
+
+    The moduli are written to chunk files of chunk_size moduli in workdir (a temporary directory by default), so only one chunk is in memory at a time.
+    """
+    with tempfile.TemporaryDirectory(dir=workdir) as directory:
+        # First pass : split the moduli in chunks on disk and store the product of each chunk
+        chunks = []
+        products_path = os.path.join(directory, "products")
+        with open(products_path, "wb") as products:
+            ids, values = [], []
+            def flush():
+                path = os.path.join(directory, "chunk{}".format(len(chunks)))
+                with open(path, "wb") as chunk:
+                    for id, value in zip(ids, values):
+                        write_int(chunk, id)
+                        write_int(chunk, value)
+                chunks.append(path)
+                write_int(products, product_tree(values)[-1][0])
+            for id, n in moduli:
+                ids.append(id)
+                values.append(n)
+                if len(values)==chunk_size:
+                    flush()
+                    ids, values = [], []
+            if values:
+                flush()
+
+        # Second pass : for each chunk, reduce the product of all the moduli down the tree of the chunk
+        for index, path in enumerate(chunks):
+            with open(path, "rb") as chunk:
+                numbers = list(read_ints(chunk))
+            ids, values = numbers[0::2], numbers[1::2]
+            tree = product_tree(values)
+            square = tree[-1][0]**2
+            root = tree[-1][0]      # product of all the moduli mod the square of the product of the chunk
+            with open(products_path, "rb") as products:
+                for other, product in enumerate(read_ints(products)):
+                    if other!=index:
+                        root = root*product % square
+            for id, n, remainder in zip(ids, values, remainder_tree(root, tree)):
+                g = math.gcd(remainder//n, n)
+                if g!=1:
+                    yield id, n, g
+
+# END batch_gcd FUNCTION
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the keys of the database sharing a prime with another key")
+    parser.add_argument("database", nargs="?", default="rsa.db")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="number of moduli held in memory at once")
+    parser.add_argument("--workdir", default=None, help="directory for the temporary chunk files")
+    options = parser.parse_args()
+
+    found = 0
+    for id, n, g in batch_gcd(stream_moduli(options.database), options.chunk_size, options.workdir):
+        found += 1
+        if g==n:
+            print("key {} : both primes are shared (or the modulus is duplicated), n = {}".format(id, n))
+        else:
+            print("key {} : shared prime {}, other prime {}".format(id, g, n//g))
+    print("{} weak key(s) found".format(found))
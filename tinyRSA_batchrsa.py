@@ -0,0 +1,172 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the batch RSA of Fiat, to decrypt several blocks of keys sharing the same modulus n with different public exponents
+# choose_exponent picks e among a few small primes, so the same primes can give a key for each of these exponents (see shared_keys).
+# For blocks c1, ..., cb encrypted with the pairwise coprime exponents e1, ..., eb and E = e1*...*eb :
+#       - A = c1^(E/e1) * ... * cb^(E/eb) mod n                 (small exponents)
+#       - M = A^(1/E) = m1 * ... * mb mod n                     (the only full size exponentiation, done with the CRT)
+#       - xi = 1 mod ei and xi = 0 mod ej (j != i)              (CRT on the exponents)
+#       - mi = M^xi / (ci^((xi-1)/ei) * prod(cj^(xi/ej), j != i))   (small exponents and one inverse)
+# so b blocks cost one private key operation and a few exponentiations with exponents of the size of E.
+# For more information : A. Fiat, Batch RSA, Crypto 1989 (https://link.springer.com/chapter/10.1007/0-387-34805-0_17)
+#
+# List of functions :
+#       - shared_keys               (build the keys sharing the primes of a key, one per valid exponent)
+#       - exponent_coefficients     (compute the xi of a list of exponents)
+#       - root_key                  (build the key computing E-th roots mod n)
+#       - fiat_decrypt              (decrypt one block of each exponent at once)
+#       - decrypt_group             (decrypt messages whose keys share a modulus, batching their blocks)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+import tinyRSA_lib as RSAlib
+import tinyRSA_metrics as RSAmetrics
+from tinyRSA_key import TinyRSA_key as RSAkey
+from tinyRSA_message import cipher_to_blocks, blocks_to_bytes
+
+EXPONENTS = (3, 5, 17, 257, 65537)      # candidates of TinyRSA_key.choose_exponent
+
+# START shared_keys FUNCTION
+
+def shared_keys(key, exponents=EXPONENTS):
+    """
+    Returns the list of keys with the primes of key and each exponent of exponents that is valid for them (coprime with lambda(n)).
+    All the keys have the same modulus n, the blocks encrypted with them can be decrypted together with fiat_decrypt.
+    """
+    lowest_multiple = key.carmichael()
+    keys = []
+    for e in exponents:
+        if RSAlib.gcd(e, lowest_multiple)==1:
+            shared = RSAkey()
+            shared.create_from(key.p, key.q, e, key.extra_primes)
+            keys.append(shared)
+    return(keys)
+
+# END shared_keys FUNCTION
+
+# START exponent_coefficients FUNCTION
+
+def exponent_coefficients(exponents):
+    """
+    Returns the list of the xi of the exponents (pairwise coprime) : xi = 1 mod ei and xi = 0 mod ej for j != i, with 0 < xi < E.
+    Raises ValueError if the exponents aren't pairwise coprime.
+    """
+    product = 1
+    for e in exponents:
+        if RSAlib.gcd(e, product)!=1:
+            raise ValueError("The exponents of a batch have to be pairwise coprime")
+        product *= e
+    return([(product//e) * RSAlib.multiplicative_inverse((product//e) % e, e) for e in exponents])
+
+# END exponent_coefficients FUNCTION
+
+# START root_key FUNCTION
+
+def root_key(key, product):
+    """
+    Returns a key with the primes of key and the private exponent 1/product mod lambda(n) : its private operation computes the product-th root of a block mod n (with the CRT).
+    product has to be coprime with lambda(n), which is the case of a product of valid public exponents.
+    """
+    root = RSAkey()
+    root.restore(key.p, key.q, product, key.n, RSAlib.multiplicative_inverse(product, key.carmichael()), extra_primes=key.extra_primes)
+    root.compute_crt()
+    return(root)
+
+# END root_key FUNCTION
+
+# START fiat_decrypt FUNCTION
+
+def fiat_decrypt(root, pairs, coefficients=None):
+    """
+    Decrypt the blocks of pairs, a list of (e, c) with pairwise coprime exponents e, and return the list of the plain blocks in the same order.
+    root is the root_key of the product of the exponents, coefficients their exponent_coefficients (computed if not given).
+    Each c has to be invertible mod n (it is the case of every block but 0 unless the key is broken), see decrypt_group.
+    """
+    n = root.n
+    product = root.e
+    if coefficients==None:
+        coefficients = exponent_coefficients([e for e, c in pairs])
+
+    # product of the blocks raised to E/e, then one E-th root
+    A = 1
+    for e, c in pairs:
+        A = A * RSAlib.powmod(c, product//e, n) % n
+    M = root.private_operation(A)
+
+    # split M = m1*...*mb with the CRT on the exponents
+    plains = []
+    for i, (e, c) in enumerate(pairs):
+        x = coefficients[i]
+        denominator = RSAlib.powmod(c, (x-1)//e, n)
+        for j, (other, block) in enumerate(pairs):
+            if j!=i:
+                denominator = denominator * RSAlib.powmod(block, x//other, n) % n
+        plains.append(RSAlib.powmod(M, x, n) * RSAlib.multiplicative_inverse(denominator, n) % n)
+    return(plains)
+
+# END fiat_decrypt FUNCTION
+
+# START decrypt_group FUNCTION
+
+def decrypt_group(messages, crt=True):
+    """
+    Decrypt a list of TinyRSA_message (cipher texts and keys already added), exactly as calling decrypt on each one, and return the number of full size exponentiations done.
+
+    The blocks are collected automatically : the messages whose keys share a modulus (with different exponents) are grouped,
+    and their blocks are decrypted in batches of one block per exponent with fiat_decrypt (one private key operation per batch instead of one per block).
+    The blocks that can't be batched (the exponent has no partner left, or the block isn't invertible mod n) are decrypted one by one.
+    Raises ValueError if a message has no key or an invalid cipher text.
+    """
+    blocks = []                 # cipher blocks of each message
+    plains = []                 # plain blocks of each message
+    groups = {}                 # n -> {e -> [(message index, block index), ...]}
+    keys = {}                   # (n, e) -> key
+    exponentiations = 0
+    for index, message in enumerate(messages):
+        key = message.key
+        if key==None or key.get_bitlength()==None or key.d==None:
+            raise ValueError("Couldn't decrypt, the key of message {} is empty.".format(index))
+        message_blocks = cipher_to_blocks(message.cipher, key.get_bitlength())
+        blocks.append(message_blocks)
+        plains.append([None]*len(message_blocks))
+        keys.setdefault((key.n, key.e), key)
+        queue = groups.setdefault(key.n, {}).setdefault(key.e, [])
+        for position, block in enumerate(message_blocks):
+            if block>1 and RSAlib.gcd(block, key.n)==1:
+                queue.append((index, position))
+            else:               # 0 and 1 are their own roots, a block sharing a factor with n can't be batched
+                plains[index][position] = key.private_operation(block, crt)
+                exponentiations += 1
+
+    roots = {}                  # (n, exponents) -> (root key, coefficients)
+    for n, queues in groups.items():
+        depth = max(len(queue) for queue in queues.values())
+        for t in range(depth):
+            batch = [(e, queue[t]) for e, queue in queues.items() if t<len(queue)]
+            if len(batch)==1:
+                e, (index, position) = batch[0]
+                plains[index][position] = keys[(n, e)].private_operation(blocks[index][position], crt)
+            else:
+                exponents = tuple(e for e, place in batch)
+                if (n, exponents) not in roots:
+                    product = 1
+                    for e in exponents:
+                        product *= e
+                    roots[(n, exponents)] = (root_key(keys[(n, exponents[0])], product), exponent_coefficients(exponents))
+                root, coefficients = roots[(n, exponents)]
+                results = fiat_decrypt(root, [(e, blocks[index][position]) for e, (index, position) in batch], coefficients)
+                for (e, (index, position)), plain in zip(batch, results):
+                    plains[index][position] = plain
+            exponentiations += 1
+
+    RSAmetrics.increment("tinyrsa_blocks_total", sum(len(message_blocks) for message_blocks in blocks), operation="decrypt")
+    for message, message_plains in zip(messages, plains):
+        bit_length = message.key.get_bitlength()
+        mask = (1 << (bit_length-1)) - 1        # remove the leading zero of each block (see TinyRSA_message.encrypt)
+        message.plain_bytes = blocks_to_bytes([plain & mask for plain in message_plains], bit_length-1)
+        message.plain = message.plain_bytes.decode("latin-1")
+    return(exponentiations)
+
+# END decrypt_group FUNCTION
@@ -0,0 +1,820 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains small benchmarks to compare the different code paths of TinyRSA
+# Run it with python3 tinyRSA_bench.py <name of the benchmark>
+#
+# It also contains the benchmark suite, a reproducible run (seeded randomness) over a grid of key bitlengths and message sizes
+#       python3 tinyRSA_bench.py suite --output results.json                        (save the results)
+#       python3 tinyRSA_bench.py suite --baseline results.json --tolerance 0.3      (fail if a case is more than 30% slower than the baseline)
+#
+# List of functions :
+#       - time_call                 (time a function call)
+#       - bench_crt                 (compare decryption with and without the CRT)
+#       - legacy_encrypt            (reference encryption with the former binary string pipeline)
+#       - legacy_decrypt            (reference decryption with the former binary string pipeline)
+#       - bench_codec               (compare the integer block codec with the binary string pipeline)
+#       - bench_parallel            (measure how the parallel mode scales with the number of processes)
+#       - bench_backends            (check that all the arithmetic backends give the same results and compare their speed)
+#       - bench_break               (measure the time to break a key by factoring its modulus versus the bitlength)
+#       - bench_multiprime          (compare key generation and decryption of keys with 2, 3 and 4 primes)
+#       - bench_store               (compare loading and inserting keys with the decimal strings and the BLOB storage)
+#       - bench_vector              (compare the scalar path and the vectorized engine of the tiny keys)
+#       - legacy_is_prime           (reference primality test with 10 random Miller-Rabin rounds)
+#       - prime_candidates          (draw the candidates tested by prime_with_bitlength)
+#       - bench_primality           (compare the tiered primality test with the reference one on the candidates of prime_with_bitlength)
+#       - bench_wire                (compare the size and the decoding time of the binary strings and of the cipher container)
+#       - bench_keygen              (compare the latency of the serial and of the racing parallel key generation)
+#       - bench_startup             (compare the import time of the command line tool and of the web app)
+#       - bench_keyring             (compare the memory per key of a list of TinyRSA_key and of a TinyRSA_keyring)
+#       - bench_batchrsa            (compare decrypting blocks one by one and with the batch RSA of Fiat)
+#       - bench_blockcache          (compare encrypting and decrypting repetitive messages with and without the cache of the blocks)
+#       - percentile                (compute a percentile of a list of measurements)
+#       - measure                   (time a function several times and summarize the measurements)
+#       - run_suite                 (run the benchmark suite over a grid of bitlengths and message sizes)
+#       - compare_to_baseline       (find the cases of the suite that are slower than a saved baseline)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from math import isqrt
+
+import tinyRSA_backend as RSAbackend
+import tinyRSA_lib as RSAlib
+import tinyRSA_factor as RSAfactor
+import tinyRSA_store as RSAstore
+from tinyRSA_key import TinyRSA_key as RSAkey
+from tinyRSA_message import TinyRSA_message as RSAmessage
+
+# START time_call FUNCTION
+
+def time_call(function, *args, repeat=5, **kwargs):
+    """
+    Call function(*args, **kwargs) repeat times and return the best time in seconds (the best time is the least noisy measurement).
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        if best==None or elapsed<best:
+            best = elapsed
+    return(best)
+
+# END time_call FUNCTION
+
+# START bench_crt FUNCTION
+
+def bench_crt(bitlengths=(256, 512, 1024), length=1024):
+    """
+    Decrypt the same message with the plain path pow(c, d, n) and with the CRT path and print the speedup.
+    The bitlengths are the bitlengths of the primes (the key is twice as long).
+    Both paths are checked to give the same plain text.
+    """
+    print("{:>10} {:>12} {:>12} {:>8}".format("key bits", "plain (s)", "crt (s)", "speedup"))
+    for bitlength in bitlengths:
+        key = RSAkey()
+        key.create_new(bitlength)
+        msg = RSAmessage()
+        msg.add_key(key)
+        msg.add_plain("~"*length)
+        msg.encrypt()
+
+        msg.decrypt(crt=False)
+        plain = msg.plain
+        msg.decrypt(crt=True)
+        if msg.plain!=plain:
+            raise ValueError("CRT decryption doesn't match the plain decryption")
+
+        time_plain = time_call(msg.decrypt, crt=False)
+        time_crt = time_call(msg.decrypt, crt=True)
+        print("{:>10} {:>12.6f} {:>12.6f} {:>7.2f}x".format(key.get_bitlength(), time_plain, time_crt, time_plain/time_crt))
+
+# END bench_crt FUNCTION
+
+# START legacy_encrypt FUNCTION
+
+def legacy_encrypt(plain, key):
+    """
+    Reference implementation of the encryption as it was done before the integer block codec : every character is turned into a string of 8 characters '0' and '1'.
+    It is only kept to check the compatibility and to measure the gain of the codec.
+    """
+    bit_length = key.get_bitlength()
+    plain_bin = ''.join('{:08b}'.format(ord(c)) for c in plain)
+    blocks = ['0'+plain_bin[i:i+bit_length-1] for i in range(0, len(plain_bin), bit_length-1)]
+    blocks[-1] = blocks[-1] + '0'*(bit_length-len(blocks[-1]))
+    return(''.join(["{:b}".format(pow(int(blocks[i], 2), key.e, key.n)).zfill(bit_length) for i in range(len(blocks))]))
+
+# END legacy_encrypt FUNCTION
+
+# START legacy_decrypt FUNCTION
+
+def legacy_decrypt(cipher, key):
+    """
+    Reference implementation of the decryption as it was done before the integer block codec (see legacy_encrypt).
+    """
+    bit_length = key.get_bitlength()
+    blocks = [cipher[i:i+bit_length] for i in range(0, len(cipher), bit_length)]
+    blocks[-1] = blocks[-1] + '0'*(bit_length-len(blocks[-1]))
+    plain_bin = ''.join(["{:b}".format(pow(int(blocks[i], 2), key.d, key.n)).zfill(bit_length)[1:] for i in range(len(blocks))])
+    plains = [plain_bin[i:i+8] for i in range(0, len(plain_bin), 8)]
+    plains[-1] = plains[-1] + '0'*(8-len(plains[-1]))
+    return(''.join([chr(int(plains[i], 2)) for i in range(len(plains))]))
+
+# END legacy_decrypt FUNCTION
+
+# START bench_codec FUNCTION
+
+def bench_codec(bitlengths=(8, 64, 512), length=100000):
+    """
+    Encrypt and decrypt the same message with the binary string pipeline (legacy_encrypt and legacy_decrypt) and with TinyRSA_message.
+    Print the time and the peak memory (measured with tracemalloc) of both paths and check that they give the same output.
+    The bitlengths are the bitlengths of the primes (the key is twice as long).
+    """
+    plain = "".join(chr(32 + i%95) for i in range(length))
+    print("{:>10} {:>10} {:>12} {:>12} {:>14} {:>14}".format("key bits", "operation", "legacy (s)", "codec (s)", "legacy (KiB)", "codec (KiB)"))
+    for bitlength in bitlengths:
+        key = RSAkey()
+        key.create_new(bitlength)
+        msg = RSAmessage()
+        msg.add_key(key)
+        msg.add_plain(plain)
+
+        msg.encrypt()
+        cipher = legacy_encrypt(plain, key)
+        if msg.cipher!=cipher:
+            raise ValueError("The codec doesn't give the same cipher text as the binary string pipeline")
+        msg.decrypt(crt=False)
+        if msg.plain!=legacy_decrypt(cipher, key):
+            raise ValueError("The codec doesn't give the same plain text as the binary string pipeline")
+
+        for operation, legacy, codec in (("encrypt", lambda: legacy_encrypt(plain, key), msg.encrypt),
+                                         ("decrypt", lambda: legacy_decrypt(cipher, key), lambda: msg.decrypt(crt=False))):
+            results = []
+            for function in (legacy, codec):
+                tracemalloc.start()
+                function()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results += [time_call(function, repeat=3), peak/1024]
+            print("{:>10} {:>10} {:>12.4f} {:>12.4f} {:>14.1f} {:>14.1f}".format(key.get_bitlength(), operation, results[0], results[2], results[1], results[3]))
+
+# END bench_codec FUNCTION
+
+# START bench_parallel FUNCTION
+
+def bench_parallel(bitlengths=(512, 1024), length=16384, processes=None):
+    """
+    Encrypt and decrypt the same message serially and with 1, 2, 4, ... processes up to the number of cores and print the speedup.
+    The bitlengths are the bitlengths of the primes (the default makes keys of 1024 and 2048 bits).
+    The time includes starting the processes of the pool.
+    """
+    if processes==None:
+        cores = os.cpu_count() or 1
+        processes = sorted(set([2**i for i in range(cores.bit_length()) if 2**i<=cores] + [cores]))
+    plain = "".join(chr(32 + i%95) for i in range(length))
+    print("{:>10} {:>10} {:>10} {:>10} {:>8}".format("key bits", "operation", "processes", "time (s)", "speedup"))
+    for bitlength in bitlengths:
+        key = RSAkey()
+        key.create_new(bitlength)
+        msg = RSAmessage()                  # message used to encrypt
+        msg.add_key(key)
+        msg.add_plain(plain)
+        msg.encrypt()
+        cipher = msg.cipher
+        reverse = RSAmessage()              # message used to decrypt
+        reverse.add_key(key)
+        reverse.add_cipher(cipher)
+        reverse.decrypt()
+        decrypted = reverse.plain
+
+        for operation, function in (("encrypt", msg.encrypt), ("decrypt", reverse.decrypt)):
+            serial = time_call(function, repeat=1)
+            print("{:>10} {:>10} {:>10} {:>10.4f} {:>7.2f}x".format(key.get_bitlength(), operation, "serial", serial, 1))
+            for count in processes:
+                elapsed = time_call(function, repeat=1, parallel=True, processes=count)
+                print("{:>10} {:>10} {:>10} {:>10.4f} {:>7.2f}x".format(key.get_bitlength(), operation, count, elapsed, serial/elapsed))
+        if msg.cipher!=cipher or reverse.plain!=decrypted:
+            raise ValueError("The parallel mode doesn't give the same output as the serial mode")
+
+# END bench_parallel FUNCTION
+
+# START bench_backends FUNCTION
+
+def bench_backends(bitlengths=(64, 512, 1024), count=200, seed=2019):
+    """
+    Run the same seeded workload (gcd, multiplicative_inverse, powmod, is_prime_fast, prime_with_bitlength and a key generation) with each available arithmetic backend.
+    Raise an error if the backends don't give identical results and print the time taken by each backend.
+    """
+    def workload(bitlength):
+        random.seed(seed)
+        values = [random.getrandbits(bitlength) | 1 for i in range(count)]
+        modulus = RSAlib.prime_with_bitlength(bitlength)
+        results = []
+        results.append([RSAlib.gcd(a, b) for a, b in zip(values, values[1:])])
+        results.append([RSAlib.multiplicative_inverse(a % modulus or 1, modulus) for a in values])
+        results.append([RSAlib.powmod(a, b, modulus) for a, b in zip(values, values[1:])])
+        results.append([RSAlib.is_prime_fast(a) for a in values])
+        key = RSAkey()
+        key.create_new(bitlength//2)
+        results.append([key.p, key.q, key.e, key.d, key.dp, key.dq, key.qinv, key.private_operation(12345 % key.n)])
+        return(results)
+
+    names = RSAbackend.available_backends()
+    print("available backends : {}".format(", ".join(names)))
+    print("{:>10} {:>10} {:>12}".format("bits", "backend", "time (s)"))
+    previous = RSAbackend.backend
+    try:
+        for bitlength in bitlengths:
+            reference = None
+            for name in names:
+                RSAbackend.set_backend(name)
+                start = time.perf_counter()
+                results = workload(bitlength)
+                elapsed = time.perf_counter() - start
+                if reference==None:
+                    reference = results
+                elif results!=reference:
+                    raise ValueError("The backend {} doesn't give the same results as the backend {}".format(name, names[0]))
+                print("{:>10} {:>10} {:>12.4f}".format(bitlength, name, elapsed))
+    finally:
+        RSAbackend.backend = previous
+
+# END bench_backends FUNCTION
+
+# START bench_break FUNCTION
+
+def bench_break(bitlengths=(16, 24, 32, 40, 48, 56, 64, 72, 80), count=3, processes=None, seed=2019):
+    """
+    Generate count keys for each bitlength (the length of n, the primes are half as long) and measure the time to break them with tinyRSA_factor.break_key.
+    The time of Pollard's rho grows like n^(1/4), so it doubles about every 4 bits of key.
+    """
+    random.seed(seed)
+    print("{:>10} {:>12} {:>12} {:>12}".format("key bits", "min (s)", "median (s)", "max (s)"))
+    for bits in bitlengths:
+        times = []
+        for i in range(count):
+            key = RSAkey()
+            key.create_new(max(3, bits//2))
+            start = time.perf_counter()
+            broken = RSAfactor.break_key(key.n, key.e, processes, seed+i)
+            times.append(time.perf_counter() - start)
+            if broken.d!=key.d:
+                raise ValueError("The broken key doesn't have the same private exponent")
+        print("{:>10} {:>12.4f} {:>12.4f} {:>12.4f}".format(bits, min(times), percentile(times, 0.5), max(times)))
+
+# END bench_break FUNCTION
+
+# START bench_multiprime FUNCTION
+
+def bench_multiprime(bitlengths=(2048, 4096), nprimes=(2, 3, 4), keys=2, length=2048, seed=2019):
+    """
+    For each length of public key and each number of primes, generate keys and decrypt a message with the CRT.
+    Print the average key generation time and the decryption throughput (bytes of plain text per second).
+    """
+    random.seed(seed)
+    plain = "".join(chr(32 + i%95) for i in range(length))
+    print("{:>10} {:>8} {:>14} {:>18}".format("key bits", "primes", "keygen (s)", "decrypt (B/s)"))
+    for bits in bitlengths:
+        for count in nprimes:
+            keygen, decrypt = 0, 0
+            for i in range(keys):
+                key = RSAkey()
+                keygen += time_call(key.create_new, bits//2, count, repeat=1)
+                msg = RSAmessage()
+                msg.add_key(key)
+                msg.add_plain(plain)
+                msg.encrypt()
+                decrypt += time_call(msg.decrypt, repeat=1)
+                if msg.plain[:length]!=plain:
+                    raise ValueError("The multi-prime key doesn't decrypt correctly")
+            print("{:>10} {:>8} {:>14.4f} {:>18.1f}".format(bits, count, keygen/keys, length*keys/decrypt))
+
+# END bench_multiprime FUNCTION
+
+# START bench_store FUNCTION
+
+def bench_store(bitlengths=(256, 512, 1024), keys=20, inserts=2000, seed=2019):
+    """
+    For each bitlength, compare the time to load a key from the decimal strings of the former storage (parsing and create_from) and from the BLOB storage (record_to_key).
+    Then compare inserting keys into a temporary SQLite database with one commit per key and with the batched commits of insert_keys.
+    """
+    import sqlite3
+    import tempfile
+    random.seed(seed)
+    print("{:>10} {:>18} {:>18} {:>10}".format("bitlength", "strings (s/key)", "blobs (s/key)", "speedup"))
+    for bitlength in bitlengths:
+        generated = []
+        for i in range(keys):
+            key = RSAkey()
+            key.create_new(bitlength)
+            generated.append(key)
+        strings = [(str(key.p), str(key.q), str(key.e)) for key in generated]
+        records = [RSAstore.key_to_record(key) for key in generated]
+        def load_strings():
+            for p, q, e in strings:
+                RSAkey().create_from(int(p), int(q), int(e))
+        def load_blobs():
+            for record in records:
+                RSAstore.record_to_key(record)
+        before, after = time_call(load_strings)/keys, time_call(load_blobs)/keys
+        print("{:>10} {:>18.6f} {:>18.6f} {:>9.1f}x".format(bitlength, before, after, before/after))
+
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, "bench.db"))
+        RSAstore.enable_wal(connection)
+        RSAstore.upgrade(connection)
+        batch = [generated[i%keys] for i in range(inserts)]
+        single = time_call(RSAstore.insert_keys, connection, batch, 1, repeat=1)
+        batched = time_call(RSAstore.insert_keys, connection, batch, repeat=1)
+        connection.close()
+    print("insert {} keys : {:.4f}s with a commit per key, {:.4f}s with batched commits ({:.1f}x)".format(inserts, single, batched, single/batched))
+
+# END bench_store FUNCTION
+
+# START bench_vector FUNCTION
+
+def bench_vector(bitlengths=(4, 8, 12, 16), length=1000000, seed=2019):
+    """
+    For each bitlength (of the primes, the keys are at most 32 bits long), encrypt and decrypt a long message with the scalar path and with the vectorized engine.
+    Check that both give the same cipher and plain texts and print the throughput (bytes of plain text per second).
+    """
+    import tinyRSA_vector as RSAvector
+    if not RSAvector.available():
+        print("numpy is not installed, the vectorized engine is not available")
+        return
+    random.seed(seed)
+    plain = "".join(chr(32 + random.randrange(95)) for i in range(length))
+    print("{:>10} {:>20} {:>20} {:>20} {:>20}".format("key bits", "scalar enc (B/s)", "vector enc (B/s)", "scalar dec (B/s)", "vector dec (B/s)"))
+    for bitlength in bitlengths:
+        key = RSAkey()
+        key.create_new(bitlength)
+        results = {}
+        for vector in (False, True):
+            msg = RSAmessage()
+            msg.add_key(key)
+            msg.add_plain(plain)
+            encrypt = time_call(msg.encrypt, vector=vector, repeat=1)
+            decrypt = time_call(msg.decrypt, vector=vector, repeat=1)
+            results[vector] = (encrypt, decrypt, msg.cipher, msg.plain_bytes)
+        if results[False][2:]!=results[True][2:]:
+            raise ValueError("The vectorized engine doesn't give the same results")
+        print("{:>10} {:>20.1f} {:>20.1f} {:>20.1f} {:>20.1f}".format(key.get_bitlength(), length/results[False][0], length/results[True][0], length/results[False][1], length/results[True][1]))
+
+# END bench_vector FUNCTION
+
+# START legacy_is_prime FUNCTION
+
+def legacy_is_prime(n):
+    """
+    Reference implementation of is_prime_fast as it was before the tiered test : s found by trial powers of 2 and 10 rounds of Miller-Rabin with random bases.
+    It is only kept to measure the gain of the tiered test (it keeps its early return after the first base reaching n-1).
+    """
+    if not isinstance(n, int) or n<2:
+        return(False)
+    s=0
+    while (n-1)%pow(2, s+1)==0:
+        s+=1
+    d=(n-1)//pow(2, s)
+    for i in range(10):
+        a=random.randint(2, n-1)
+        witness=RSAlib.powmod(a, d, n)
+        if not (witness==1 or witness==n-1):
+            for j in range(s-1):
+                witness=RSAlib.powmod(witness, 2, n)
+                if (witness==n-1):
+                    return(True)
+            return(False)
+    return(True)
+
+# END legacy_is_prime FUNCTION
+
+# START prime_candidates FUNCTION
+
+def prime_candidates(l, count):
+    """
+    Returns count candidates of bitlength l drawn exactly as prime_with_bitlength draws the numbers it gives to is_prime_fast (sieved windows or trial division survivors).
+    Most of them are composite, which is the case the primality test has to reject quickly.
+    """
+    start = isqrt(pow(2, 2*l-3))*2+1
+    stop = pow(2, l)
+    window = max(64, 2*l)
+    candidates = []
+    while len(candidates)<count:
+        if stop>RSAlib.PRIME_TABLE_LIMIT and stop-start>4*window:
+            candidates.extend(RSAlib.sieve_window(random.randrange(start, stop-2*window, 2), window))
+        else:
+            p = random.randrange(start, stop, 2)
+            if RSAlib.passes_trial_division(p):
+                candidates.append(p)
+    return(candidates[:count])
+
+# END prime_candidates FUNCTION
+
+# START bench_primality FUNCTION
+
+def bench_primality(bitlengths=(16, 32, 64, 80, 128, 256, 512, 1024), count=2000, seed=2019):
+    """
+    For each bitlength, time the reference test and the tiered is_prime_fast on the same candidates of prime_with_bitlength and on primes of that bitlength.
+    Check that both agree on every candidate and print the time per candidate.
+    """
+    random.seed(seed)
+    print("{:>10} {:>8} {:>18} {:>18} {:>10} {:>18} {:>18} {:>10}".format("bitlength", "primes", "legacy (s/cand)", "tiered (s/cand)", "speedup", "legacy (s/prime)", "tiered (s/prime)", "speedup"))
+    for l in bitlengths:
+        candidates = prime_candidates(l, max(10, count*64//l))
+        legacy = [legacy_is_prime(n) for n in candidates]
+        tiered = [RSAlib.is_prime_fast(n) for n in candidates]
+        if legacy!=tiered:
+            raise ValueError("The primality tests disagree on a candidate of bitlength {}".format(l))
+        primes = [n for n, prime in zip(candidates, tiered) if prime][:50] or [RSAlib.prime_with_bitlength(l)]
+        times = []
+        for values in (candidates, primes):
+            times.append(time_call(lambda: [legacy_is_prime(n) for n in values], repeat=3)/len(values))
+            times.append(time_call(lambda: [RSAlib.is_prime_fast(n) for n in values], repeat=3)/len(values))
+        print("{:>10} {:>8} {:>18.8f} {:>18.8f} {:>9.1f}x {:>18.8f} {:>18.8f} {:>9.1f}x".format(l, sum(tiered), times[0], times[1], times[0]/times[1], times[2], times[3], times[2]/times[3]))
+
+# END bench_primality FUNCTION
+
+# START bench_wire FUNCTION
+
+def bench_wire(bitlengths=(16, 64, 256, 1024), length=100000, seed=2019):
+    """
+    For each bitlength, encrypt a message in every format of cipher text (see tinyRSA_message.encode_cipher).
+    Print the size of each cipher text and the time to read its blocks back (cipher_to_blocks), which is the cost added to every decryption.
+    """
+    import tinyRSA_message
+    import tinyRSA_wire as RSAwire
+    random.seed(seed)
+    plain = "".join(chr(32 + random.randrange(95)) for i in range(length))
+    print("{:>10} {:>8} {:>12} {:>14}".format("key bits", "format", "size (B)", "decode (ms)"))
+    for bitlength in bitlengths:
+        key = RSAkey()
+        key.create_new(bitlength)
+        bit_length = key.get_bitlength()
+        reference = None
+        for cipher_format in RSAwire.FORMATS:
+            cipher = tinyRSA_message.encrypt_batch(key, [plain], vector=False, cipher_format=cipher_format)[0]
+            duration = time_call(tinyRSA_message.cipher_to_blocks, cipher, bit_length)
+            blocks = tinyRSA_message.cipher_to_blocks(cipher, bit_length)
+            if reference==None:
+                reference = blocks
+            elif blocks!=reference:
+                raise ValueError("The {} format doesn't give the same blocks".format(cipher_format))
+            print("{:>10} {:>8} {:>12} {:>14.3f}".format(bit_length, cipher_format, len(cipher), 1000*duration))
+
+# END bench_wire FUNCTION
+
+# START bench_keygen FUNCTION
+
+def bench_keygen(bitlengths=(2048, 4096), keys=10, processes=None, seed=2019):
+    """
+    For each length of public key, generate keys with the serial search and with the racing parallel search (see tinyRSA_lib.race_primes).
+    Print the median, the 90th percentile and the spread (standard deviation over mean) of the generation times, the parallel times include starting the processes.
+    """
+    random.seed(seed)
+    processes = processes or os.cpu_count() or 1
+    print("{} processes".format(processes))
+    print("{:>10} {:>10} {:>10} {:>10} {:>10}".format("key bits", "mode", "p50 (s)", "p90 (s)", "spread"))
+    for bits in bitlengths:
+        for parallel in (False, True):
+            times = [time_call(RSAkey().create_new, bits//2, parallel=parallel, processes=processes, repeat=1) for i in range(keys)]
+            mean = sum(times)/len(times)
+            deviation = (sum((duration-mean)**2 for duration in times)/len(times))**0.5
+            print("{:>10} {:>10} {:>10.3f} {:>10.3f} {:>10.2f}".format(bits, "parallel" if parallel else "serial", percentile(times, 0.5), percentile(times, 0.9), deviation/mean))
+
+# END bench_keygen FUNCTION
+
+# START bench_startup FUNCTION
+
+WEB_MODULES = ("flask", "flask_sqlalchemy", "sqlalchemy", "werkzeug", "jinja2")
+
+def bench_startup(modules=("tinyRSA_cli", "app"), repeat=5):
+    """
+    For each module, import it in a new Python process and print the best time of the import (measured inside the process, so the start of the interpreter isn't counted).
+    Also check which modules of the web stack each import loads : the command line tool (tinyRSA_cli) shouldn't load any.
+    """
+    import subprocess
+    script = ("import sys, time; start = time.perf_counter(); import {}; "
+              "print(time.perf_counter()-start); print(','.join(sorted(set(name.split('.')[0] for name in sys.modules) & set({!r}))))")
+    print("{:>14} {:>14}   {}".format("module", "import (ms)", "web modules loaded"))
+    for module in modules:
+        best, web = None, ""
+        for i in range(repeat):
+            process = subprocess.run([sys.executable, "-c", script.format(module, WEB_MODULES)], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+            if process.returncode!=0:
+                break
+            duration, web = (process.stdout.split("\n") + [""])[:2]
+            best = float(duration) if best==None else min(best, float(duration))
+        if best==None:
+            print("{:>14} {:>14}   {}".format(module, "failed", process.stderr.strip().splitlines()[-1] if process.stderr.strip() else ""))
+        else:
+            print("{:>14} {:>14.1f}   {}".format(module, 1000*best, web or "none"))
+
+# END bench_startup FUNCTION
+
+# START bench_keyring FUNCTION
+
+def bench_keyring(bitlengths=(8, 16, 32), keys=100000, seed=2019):
+    """
+    For each bitlength of the primes, generate keys into a TinyRSA_keyring, then measure with tracemalloc the memory of the same keys as a list of TinyRSA_key and as a ring.
+    Also check that a ring saved and loaded back gives the same keys and print the time to read all the keys of the ring.
+    """
+    import tempfile
+    from tinyRSA_keyring import TinyRSA_keyring as RSAkeyring
+    random.seed(seed)
+    print("{:>10} {:>10} {:>16} {:>16} {:>14}".format("key bits", "keys", "list (B/key)", "ring (B/key)", "read (us/key)"))
+    for bitlength in bitlengths:
+        ring = RSAkeyring()
+        ring.generate(keys, bitlength)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ring.bin")
+            ring.save(path)
+
+            tracemalloc.start()
+            loaded = RSAkeyring.load(path)
+            ring_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        key_list = list(loaded)             # every key as a TinyRSA_key, with its CRT parameters
+        read = time.perf_counter() - start
+        list_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        if any(key.n!=ring.public_key(id)[0] or key.d!=ring.d[id] for id, key in enumerate(key_list)):
+            raise ValueError("The key ring doesn't give the same keys after save and load")
+        print("{:>10} {:>10} {:>16.1f} {:>16.1f} {:>14.2f}".format(2*bitlength, keys, list_memory/keys, ring_memory/keys, 1e6*read/keys))
+
+# END bench_keyring FUNCTION
+
+# START bench_batchrsa FUNCTION
+
+def bench_batchrsa(bitlengths=(1024, 2048, 4096), batches=20, length=4096, seed=2019):
+    """
+    For each length of public key, build the keys sharing its modulus (see tinyRSA_batchrsa.shared_keys) and measure the throughput (blocks per second) of :
+            - the private operation with the CRT, block by block
+            - fiat_decrypt on batches of one block per exponent, for 2 exponents up to all of them (the smallest exponents first)
+    Then check decrypt_group on messages of length characters, one per key, against decrypting each message.
+    """
+    import tinyRSA_batchrsa as RSAbatchrsa
+    random.seed(seed)
+    print("{:>10} {:>24} {:>14} {:>10}".format("key bits", "exponents", "blocks/s", "speedup"))
+    for bits in bitlengths:
+        key = RSAkey()
+        key.create_new(bits//2)
+        keys = RSAbatchrsa.shared_keys(key)
+        blocks = [[shared.public_operation(random.randrange(2, shared.n)) for i in range(batches)] for shared in keys]
+
+        single = time_call(lambda: [shared.private_operation(block) for shared, column in zip(keys, blocks) for block in column], repeat=1)
+        reference = len(keys)*batches/single
+        print("{:>10} {:>24} {:>14.1f} {:>10}".format(bits, "one by one", reference, ""))
+        for size in range(2, len(keys)+1):
+            exponents = [shared.e for shared in keys[:size]]
+            product = 1
+            for e in exponents:
+                product *= e
+            root = RSAbatchrsa.root_key(key, product)
+            coefficients = RSAbatchrsa.exponent_coefficients(exponents)
+            batch = lambda: [RSAbatchrsa.fiat_decrypt(root, list(zip(exponents, row)), coefficients) for row in zip(*blocks[:size])]
+            results = batch()
+            if any(plain!=shared.private_operation(block) for row, cipher_row in zip(results, zip(*blocks[:size])) for plain, shared, block in zip(row, keys, cipher_row)):
+                raise ValueError("The batch RSA doesn't give the same blocks")
+            throughput = size*batches/time_call(batch, repeat=1)
+            print("{:>10} {:>24} {:>14.1f} {:>10.2f}".format(bits, ",".join(str(e) for e in exponents), throughput, throughput/reference))
+
+        plain = "".join(chr(32 + random.randrange(95)) for i in range(length))
+        messages, expected = [], []
+        for shared in keys:
+            message = RSAmessage()
+            message.add_key(shared)
+            message.add_plain(plain)
+            message.encrypt()
+            messages.append(message)
+            copy = RSAmessage()
+            copy.add_key(shared)
+            copy.add_cipher(message.cipher)
+            copy.decrypt()
+            expected.append(copy.plain)
+        RSAbatchrsa.decrypt_group(messages)
+        if [message.plain for message in messages]!=expected:
+            raise ValueError("decrypt_group doesn't give the same plain texts")
+
+# END bench_batchrsa FUNCTION
+
+# START bench_blockcache FUNCTION
+
+def bench_blockcache(bitlengths=(1024, 2048), length=20000, seed=2019):
+    """
+    For each length of public key, encrypt and decrypt messages of length characters without cache, then with a TinyRSA_cache of the blocks :
+            - "~"*length (the message of the demo of tinyRSA_message, every block is the same up to the alignment of the bytes)
+            - random text (no block repeats, this measures the overhead of the lookups)
+    The message is handled twice with the same cache, the second time is the case of two requests with the same key id in the app.
+    Print the time of each pass (encryption and decryption) and the hit rate of the cache.
+    """
+    from tinyRSA_cache import TinyRSA_cache as RSAcache
+    random.seed(seed)
+    texts = {"repeated": "~"*length, "random": "".join(chr(32 + random.randrange(95)) for i in range(length))}
+    print("{:>10} {:>10} {:>14} {:>14} {:>14} {:>10}".format("key bits", "text", "no cache (s)", "1st pass (s)", "2nd pass (s)", "hit rate"))
+    for bits in bitlengths:
+        key = RSAkey()
+        key.create_new(bits//2)
+        for name, plain in texts.items():
+            def round_trip(cache):
+                msg = RSAmessage()
+                msg.add_key(key)
+                msg.add_plain(plain)
+                msg.encrypt(cache=cache)
+                msg.decrypt(cache=cache)
+                if msg.plain[:length]!=plain:
+                    raise ValueError("The cache of the blocks changes the results")
+            cache = RSAcache(4096)
+            reference = time_call(round_trip, None, repeat=1)
+            first = time_call(round_trip, cache, repeat=1)
+            second = time_call(round_trip, cache, repeat=1)
+            print("{:>10} {:>10} {:>14.4f} {:>14.4f} {:>14.4f} {:>10.2f}".format(bits, name, reference, first, second, cache.stats()["hit_rate"]))
+
+# END bench_blockcache FUNCTION
+
+# START percentile FUNCTION
+
+def percentile(values, fraction):
+    """
+    Returns the percentile of values at fraction (between 0 and 1) with linear interpolation between the closest ranks.
+    """
+    values = sorted(values)
+    position = (len(values)-1)*fraction
+    lower = int(position)
+    upper = min(lower+1, len(values)-1)
+    return(values[lower] + (values[upper]-values[lower])*(position-lower))
+
+# END percentile FUNCTION
+
+# START measure FUNCTION
+
+def measure(function, repeat, work=1):
+    """
+    Call function repeat times and return a dictionary summarizing the measurements :
+            - p50, p90, p99, min, max and mean of the times (seconds)
+            - throughput (work per second, work being the amount of work done by one call, 1 call by default)
+            - peak_memory (bytes allocated at the peak of an extra call, measured with tracemalloc)
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()         # separate call because tracemalloc slows down the execution
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    mean = sum(times)/len(times)
+    return({"repeat": repeat,
+            "p50": percentile(times, 0.5),
+            "p90": percentile(times, 0.9),
+            "p99": percentile(times, 0.99),
+            "min": min(times),
+            "max": max(times),
+            "mean": mean,
+            "throughput": work/mean if mean else None,
+            "peak_memory": peak})
+
+# END measure FUNCTION
+
+# START run_suite FUNCTION
+
+SUITE_BITLENGTHS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+SUITE_SIZES = (64, 4096)
+
+def run_suite(bitlengths=SUITE_BITLENGTHS, sizes=SUITE_SIZES, seed=2019, repeat=None, verbose=True):
+    """
+    Run the benchmark suite and return a dictionary {"meta": {...}, "results": {case name: measurements (see measure)}}.
+    For each key bitlength (the length of n, the primes are half as long) the cases are :
+            - prime/<bits>                  prime_with_bitlength for one of the primes
+            - is_prime/<bits>               is_prime_fast on a prime of the key (the slowest case, all the passes are done)
+            - keygen/<bits>                 TinyRSA_key.create_new
+            - encrypt/<bits>/<size>         TinyRSA_message.encrypt of a message of size characters (throughput in bytes per second)
+            - decrypt/<bits>/<size>         TinyRSA_message.decrypt of the same message
+    The random generator is seeded before each case so two runs do the same work.
+    By default the number of repetitions decreases with the bitlength so the largest keys don't take forever.
+    """
+    results = {}
+    def run(name, function, count, work=1):
+        random.seed("{}/{}".format(seed, name))
+        results[name] = measure(function, count, work)
+        if verbose:
+            print("{:<24} p50 {:>10.6f} s   p99 {:>10.6f} s   {:>12.1f} /s   {:>10} B".format(name, results[name]["p50"], results[name]["p99"], results[name]["throughput"], results[name]["peak_memory"]))
+
+    for bits in bitlengths:
+        count = repeat or max(3, min(50, 2**20//bits**2))
+        half = max(2, bits//2)
+        run("prime/{}".format(bits), lambda: RSAlib.prime_with_bitlength(half), count)
+
+        random.seed("{}/key/{}".format(seed, bits))
+        key = RSAkey()
+        key.create_new(half)
+        run("is_prime/{}".format(bits), lambda: RSAlib.is_prime_fast(key.p), count)
+        run("keygen/{}".format(bits), lambda: RSAkey().create_new(half), count)
+
+        for size in sizes:
+            msg = RSAmessage()
+            msg.add_key(key)
+            msg.add_plain("".join(chr(32 + i%95) for i in range(size)))
+            run("encrypt/{}/{}".format(bits, size), msg.encrypt, count, size)
+            run("decrypt/{}/{}".format(bits, size), msg.decrypt, count, size)
+
+    meta = {"seed": seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": RSAbackend.backend.name,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    return({"meta": meta, "results": results})
+
+# END run_suite FUNCTION
+
+# START compare_to_baseline FUNCTION
+
+def compare_to_baseline(results, baseline, tolerance=0.25, statistic="p50", floor=0.0001):
+    """
+    Compare the results of run_suite with a baseline (same format) and return the list of regressions (name, baseline value, new value).
+    A case is a regression if its statistic (p50 by default) is more than tolerance (25% by default) slower than in the baseline.
+    Slowdowns smaller than floor seconds are ignored because they are in the noise of the measurements.
+    Cases that are only in one of the two runs are ignored.
+    """
+    regressions = []
+    for name, measurements in results["results"].items():
+        reference = baseline["results"].get(name)
+        if reference==None:
+            continue
+        if measurements[statistic] > reference[statistic]*(1+tolerance) and measurements[statistic]-reference[statistic] > floor:
+            regressions.append((name, reference[statistic], measurements[statistic]))
+    return(regressions)
+
+# END compare_to_baseline FUNCTION
+
+def suite(arguments):
+    """
+    Command line entry point of the benchmark suite (see the top of the file).
+    """
+    parser = argparse.ArgumentParser(prog="tinyRSA_bench.py suite", description="Run the TinyRSA benchmark suite")
+    parser.add_argument("--bitlengths", default=",".join(map(str, SUITE_BITLENGTHS)), help="comma separated key bitlengths")
+    parser.add_argument("--sizes", default=",".join(map(str, SUITE_SIZES)), help="comma separated message sizes")
+    parser.add_argument("--seed", type=int, default=2019)
+    parser.add_argument("--repeat", type=int, default=None, help="number of repetitions of each case (depends on the bitlength by default)")
+    parser.add_argument("--output", help="save the results as JSON in this file")
+    parser.add_argument("--baseline", help="compare with the results saved in this file and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown compared to the baseline (0.25 is 25%%)")
+    parser.add_argument("--floor", type=float, default=0.0001, help="slowdowns smaller than this number of seconds are ignored")
+    options = parser.parse_args(arguments)
+
+    results = run_suite([int(bits) for bits in options.bitlengths.split(",")], [int(size) for size in options.sizes.split(",")], options.seed, options.repeat)
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            regressions = compare_to_baseline(results, json.load(baseline), options.tolerance, floor=options.floor)
+        for name, before, after in regressions:
+            print("REGRESSION {:<24} {:>10.6f} s -> {:>10.6f} s ({:+.0f}%)".format(name, before, after, 100*(after/before-1)))
+        if regressions:
+            raise SystemExit("{} case(s) slower than the baseline by more than {:.0f}%".format(len(regressions), 100*options.tolerance))
+        print("No regression compared to {}".format(options.baseline))
+
+BENCHMARKS = {
+    "crt": bench_crt,
+    "codec": bench_codec,
+    "parallel": bench_parallel,
+    "backends": bench_backends,
+    "break": bench_break,
+    "multiprime": bench_multiprime,
+    "store": bench_store,
+    "vector": bench_vector,
+    "primality": bench_primality,
+    "wire": bench_wire,
+    "keygen": bench_keygen,
+    "startup": bench_startup,
+    "keyring": bench_keyring,
+    "batchrsa": bench_batchrsa,
+    "blockcache": bench_blockcache,
+}
+
+if __name__ == "__main__":
+    if sys.argv[1:2]==["suite"]:
+        suite(sys.argv[2:])
+        raise SystemExit(0)
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise SystemExit("Unknown benchmark {}, choose from {}".format(name, ", ".join(BENCHMARKS)))
+        print("== {} ==".format(name))
+        BENCHMARKS[name]()
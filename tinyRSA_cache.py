@@ -0,0 +1,98 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains a size-bounded LRU (least recently used) cache
+# When the cache is full, adding a new entry evicts the entry that hasn't been used for the longest time
+#
+# List of attributes :
+#       - maxsize           (maximum number of entries)
+#       - hits              (number of lookups that found an entry)
+#       - misses            (number of lookups that didn't find an entry)
+#       - evictions         (number of entries removed to make room for new ones)
+#
+# List of methods :
+#       - __init__          (constructor of the class)
+#       - get               (look for an entry)
+#       - put               (add or replace an entry)
+#       - invalidate        (remove an entry)
+#       - clear             (remove all the entries)
+#       - stats             (get the size, hit, miss and eviction counts)
+
+import threading
+from collections import OrderedDict
+
+class TinyRSA_cache():
+    """
+    This class is a thread-safe LRU cache with a maximum number of entries and hit/miss/eviction statistics.
+    """
+
+    def __init__(self, maxsize=128):
+        """
+        The constructor creates an empty cache that can hold up to maxsize entries.
+        """
+        if not (isinstance(maxsize, int) and maxsize>0):
+            raise ValueError("Invalid size for the cache, should be an integer strickly greater than 0")
+
+        self.maxsize = maxsize
+        self.entries = OrderedDict()    # the most recently used entries are at the end
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return(len(self.entries))
+
+    def get(self, key, default=None):
+        """
+        This method returns the value stored for key (and marks it as the most recently used) or default if there is none.
+        """
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return(default)
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return(value)
+
+    def put(self, key, value):
+        """
+        This method stores value for key, evicting the least recently used entry if the cache is full.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.entries[key] = value
+            if len(self.entries)>self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        This method removes the entry stored for key, if there is one.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """
+        This method removes all the entries (the statistics are kept).
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        This method returns a dictionary with the size, maxsize, hits, misses, evictions and hit rate of the cache.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return({"size": len(self.entries),
+                    "maxsize": self.maxsize,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": self.hits/lookups if lookups else 0.0})
@@ -0,0 +1,209 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the command line tool of TinyRSA, to run large batches of jobs offline without the web app
+# The jobs are read as JSON lines (one JSON object per line) from a file or from the standard input and each result is written as a JSON line to the standard output, in the same order :
+#       {"op": "keygen", "bitlength": 512, "nprimes": 2}                    -> {"key": key}
+#       {"op": "encrypt", "key": key, "plain": "hello", "format": "bits"}   -> {"cipher": cipher text}
+#       {"op": "decrypt", "key": key, "cipher": cipher text}                -> {"plain": "hello"}
+#       {"op": "factor", "n": "3233", "e": "17"}                            -> {"p": "53", "q": "61", "extra_primes": [], "key": key} (key only if e is given)
+# A key is {"p", "q", "extra_primes", "n", "e", "d"} with the integers as strings (as given by the JSON API of the app), only n and e are needed to encrypt.
+# The "id" of a job is copied to its result. A job that fails gives {"error": message} and the next jobs still run.
+#
+#       python3 tinyRSA_cli.py jobs.jsonl --jobs 4 > results.jsonl
+#
+# It only imports the library (never Flask or SQLAlchemy) so it starts quickly, see bench_startup in tinyRSA_bench.
+# With --jobs N the jobs are run by N processes, otherwise in the current process.
+#
+# List of functions :
+#       - parse_int                 (read an integer given as a JSON number or string)
+#       - key_to_json               (write a key as a JSON object)
+#       - json_to_key               (build a key from a JSON object, with a cache)
+#       - run_job                   (run one job and return its result)
+#       - run_line                  (run the job of one JSON line and return the JSON line of its result)
+#       - run                       (run all the jobs of a stream of JSON lines)
+#       - main                      (command line interface)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+import argparse
+import json
+import sys
+
+from tinyRSA_key import TinyRSA_key as RSAkey
+from tinyRSA_cache import TinyRSA_cache as RSAcache
+from tinyRSA_message import encrypt_batch, decrypt_batch
+import tinyRSA_factor as RSAfactor
+
+KEY_CACHE_SIZE = 256    # number of keys kept built, the jobs of a batch often share the same keys
+CHUNK_SIZE = 16         # number of lines sent at once to each process with --jobs
+
+key_cache = RSAcache(KEY_CACHE_SIZE)
+
+# START parse_int FUNCTION
+
+def parse_int(value, name):
+    """
+    Returns the integer value (a JSON number or a decimal string), raises ValueError naming the field name otherwise.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("Invalid {}, expected an integer".format(name))
+    try:
+        return(int(value))
+    except ValueError:
+        raise ValueError("Invalid {}, expected an integer".format(name))
+
+# END parse_int FUNCTION
+
+# START key_to_json FUNCTION
+
+def key_to_json(key):
+    """
+    Returns the values of key as a dictionary with the integers as strings (they can be larger than JSON numbers).
+    """
+    return({"p": str(key.p), "q": str(key.q), "extra_primes": [str(prime) for prime in key.extra_primes], "n": str(key.n), "e": str(key.e), "d": str(key.d)})
+
+# END key_to_json FUNCTION
+
+# START json_to_key FUNCTION
+
+def json_to_key(values):
+    """
+    Returns the TinyRSA_key of the JSON object values : built with create_from if the primes are given, or a public key (n and e only) otherwise.
+    The keys are kept in an LRU cache so a key used by many jobs is only built (and checked) once.
+    """
+    if not isinstance(values, dict):
+        raise ValueError("Invalid key, expected an object")
+    if values.get("p")!=None and values.get("q")!=None:
+        entry = ("private", parse_int(values["p"], "p"), parse_int(values["q"], "q"), parse_int(values.get("e"), "e"),
+                 tuple(parse_int(prime, "extra_primes") for prime in values.get("extra_primes") or ()))
+    else:
+        entry = ("public", parse_int(values.get("n"), "n"), parse_int(values.get("e"), "e"))
+    key = key_cache.get(entry)
+    if key==None:
+        key = RSAkey()
+        if entry[0]=="private":
+            key.create_from(entry[1], entry[2], entry[3], entry[4])
+        else:
+            key.restore(None, None, entry[2], entry[1], None)
+        key_cache.put(entry, key)
+    return(key)
+
+# END json_to_key FUNCTION
+
+# START run_job FUNCTION
+
+def run_job(job, processes=None):
+    """
+    Run one job (a dictionary, see the beginning of the file) and return its result as a dictionary.
+    processes is the number of processes used to factor a modulus (by default the number of cores).
+    Raises ValueError if the job is invalid.
+    """
+    if not isinstance(job, dict):
+        raise ValueError("Invalid job, expected an object")
+    operation = job.get("op")
+    if operation=="keygen":
+        key = RSAkey()
+        key.create_new(parse_int(job.get("bitlength", 512), "bitlength"), parse_int(job.get("nprimes", 2), "nprimes"))
+        return({"key": key_to_json(key)})
+    if operation=="encrypt":
+        if not isinstance(job.get("plain"), str):
+            raise ValueError("Invalid plain text, expected a string")
+        return({"cipher": encrypt_batch(json_to_key(job.get("key")), [job["plain"]], cipher_format=job.get("format", "bits"))[0]})
+    if operation=="decrypt":
+        key = json_to_key(job.get("key"))
+        if key.d==None:
+            raise ValueError("Couldn't decrypt, the key has no private exponent (give p and q)")
+        if not isinstance(job.get("cipher"), str):
+            raise ValueError("Invalid cipher text, expected a string")
+        return({"plain": decrypt_batch(key, [job["cipher"]])[0]})
+    if operation=="factor":
+        n = parse_int(job.get("n"), "n")
+        primes = RSAfactor.factor_primes(n, processes)
+        result = {"p": str(primes[0]), "q": str(primes[1]), "extra_primes": [str(prime) for prime in primes[2:]]}
+        if job.get("e")!=None:
+            key = RSAkey()
+            key.create_from(primes[0], primes[1], parse_int(job["e"], "e"), primes[2:])
+            result["key"] = key_to_json(key)
+        return(result)
+    raise ValueError("Unknown operation {}, choose keygen, encrypt, decrypt or factor".format(operation))
+
+# END run_job FUNCTION
+
+# START run_line FUNCTION
+
+def run_line(line, processes=None):
+    """
+    Run the job of a JSON line and return (JSON line of its result without the end of line, True if the job failed), or None for an empty line.
+    The errors are returned as {"error": message} so one invalid job doesn't stop the batch.
+    """
+    line = line.strip()
+    if not line:
+        return(None)
+    try:
+        job = json.loads(line)
+    except ValueError:
+        return(json.dumps({"error": "Invalid JSON line"}), True)
+    result = {"id": job["id"]} if isinstance(job, dict) and "id" in job else {}
+    try:
+        result.update(run_job(job, processes))
+    except (TypeError, ValueError) as error:
+        result["error"] = str(error)
+    return(json.dumps(result), "error" in result)
+
+# END run_line FUNCTION
+
+# START run FUNCTION
+
+def run(lines, output, jobs=1):
+    """
+    Run the jobs of the iterable of JSON lines and write their results to output (a text file-like object), in the same order.
+    With jobs greater than 1 the lines are sent CHUNK_SIZE at a time to a pool of jobs processes, the input is still read as a stream.
+    Returns the number of jobs that failed.
+    """
+    failed = 0
+    if jobs<=1:
+        results = (run_line(line) for line in lines)
+        pool = None
+    else:
+        import multiprocessing  # only imported when the parallel mode is used
+        from functools import partial
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(partial(run_line, processes=1), lines, CHUNK_SIZE)   # a process of the pool can't start its own pool to factor
+    try:
+        for result in results:
+            if result!=None:
+                output.write(result[0] + "\n")
+                failed += result[1]
+    finally:
+        if pool!=None:
+            pool.terminate()
+    return(failed)
+
+# END run FUNCTION
+
+# START main FUNCTION
+
+def main(argv=None):
+    """
+    Command line interface, returns the exit code (1 if a job failed).
+    """
+    parser = argparse.ArgumentParser(description="Run TinyRSA jobs (keygen, encrypt, decrypt, factor) given as JSON lines, the results are written as JSON lines to the standard output.")
+    parser.add_argument("input", nargs="?", default="-", help="file of JSON lines (the standard input by default)")
+    parser.add_argument("--jobs", type=int, default=1, help="number of processes running the jobs")
+    args = parser.parse_args(argv)
+    if args.jobs<1:
+        parser.error("--jobs should be at least 1")
+
+    if args.input=="-":
+        failed = run(sys.stdin, sys.stdout, args.jobs)
+    else:
+        with open(args.input) as infile:
+            failed = run(infile, sys.stdout, args.jobs)
+    return(1 if failed else 0)
+
+# END main FUNCTION
+
+if __name__ == "__main__":
+    sys.exit(main())
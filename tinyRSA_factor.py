@@ -0,0 +1,217 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the functions to break small TinyRSA keys by factoring the public modulus n
+# Once n = p*q is factored, the private exponent d is recovered with TinyRSA_key.create_from(p, q, e)
+# A multi-prime modulus is factored recursively and its other primes are given to create_from as extra_primes
+#
+# The package multiprocessing is required for the parallel search
+#
+# List of functions :
+#       - trial_division            (look for a small factor with the table of small primes)
+#       - pollard_rho_brent         (Pollard's rho algorithm with Brent's cycle detection)
+#       - pollard_pm1               (Pollard's p-1 algorithm)
+#       - find_factor               (run one of the methods, used by the processes of the pool)
+#       - factor_modulus            (factor n = p*q, racing several methods and seeds on a pool of processes)
+#       - factor_primes             (factor n into all its primes, for multi-prime moduli)
+#       - break_key                 (recover the full key from the public key n and e)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+import math
+import os
+import random
+
+import tinyRSA_lib as RSAlib
+from tinyRSA_key import TinyRSA_key as RSAkey
+
+# START trial_division FUNCTION
+
+def trial_division(n, primes=RSAlib.SMALL_PRIMES):
+    """
+    Returns the smallest factor of n in the list primes, or None if there is none (the factor can be n itself if n is a small prime).
+    """
+    for prime in primes:
+        if n%prime==0:
+            return(prime)
+    return(None)
+
+# END trial_division FUNCTION
+
+# START pollard_rho_brent FUNCTION
+
+def pollard_rho_brent(n, seed=None, batch=128):
+    """
+    Returns a non trivial factor of n using Pollard's rho algorithm with Brent's cycle detection, or None if this try failed (start again with another seed).
+    The pseudo random sequence is x -> x^2+c mod n, with the starting point and c drawn from seed.
+    The differences are multiplied together batch at a time so there is only one gcd per batch.
+    Complexity is about O(n^(1/4)) which is what makes small keys break.
+
+    For more information https://en.wikipedia.org/wiki/Pollard%27s_rho_algorithm
+    """
+    if n%2==0:
+        return(2)
+    rng = random.Random(seed)
+    y, c = rng.randrange(1, n), rng.randrange(1, n)
+    g, r, q = 1, 1, 1
+    while g==1:
+        x = y                   # x is the value at the last power of 2 (Brent's cycle detection)
+        for i in range(r):
+            y = (y*y+c)%n
+        k = 0
+        while k<r and g==1:
+            ys = y              # keep the start of the batch to backtrack if the gcd of the batch is n
+            for i in range(min(batch, r-k)):
+                y = (y*y+c)%n
+                q = q*abs(x-y)%n
+            g = math.gcd(q, n)
+            k += batch
+        r *= 2
+    if g==n:                    # the batch went past the factor, backtrack one step at a time
+        g = 1
+        while g==1:
+            ys = (ys*ys+c)%n
+            g = math.gcd(abs(x-ys), n)
+    if g==n:
+        return(None)
+    return(g)
+
+# END pollard_rho_brent FUNCTION
+
+# START pollard_pm1 FUNCTION
+
+def pollard_pm1(n, bound=100000, base=2):
+    """
+    Returns a non trivial factor of n using Pollard's p-1 algorithm, or None if it failed.
+    It finds the factor p when p-1 only has prime factors (and prime powers) smaller than bound : base is raised to all these prime powers and gcd(base-1, n) reveals p.
+    The primes of prime_with_bitlength are random so this mostly works on small keys, but it is cheap to try.
+
+    For more information https://en.wikipedia.org/wiki/Pollard%27s_p_%E2%88%92_1_algorithm
+    """
+    a = base
+    for index, prime in enumerate(RSAlib.small_primes(bound)):
+        power = prime
+        while power*prime<=bound:   # largest power of the prime below the bound
+            power *= prime
+        a = RSAlib.powmod(a, power, n)
+        if index%1000==999:         # check from time to time so we stop early
+            g = math.gcd(a-1, n)
+            if g==n:
+                return(None)
+            if g>1:
+                return(g)
+    g = math.gcd(a-1, n)
+    if 1<g<n:
+        return(g)
+    return(None)
+
+# END pollard_pm1 FUNCTION
+
+# START find_factor FUNCTION
+
+def find_factor(task):
+    """
+    Run one factoring method and return (method, factor) with factor None if the method failed.
+    task is a tuple (method, n, seed) with method "trial", "pm1" or "rho", it is defined this way so it can be sent to the processes of a pool.
+    The rho method keeps trying new seeds until it succeeds, so it only stops when a factor is found (or when the pool is terminated).
+    """
+    method, n, seed = task
+    if method=="trial":
+        factor = trial_division(n)
+        return(method, factor if factor!=n else None)
+    if method=="pm1":
+        return(method, pollard_pm1(n, base=2+seed))
+    rng = random.Random(seed)
+    while True:
+        factor = pollard_rho_brent(n, rng.getrandbits(64))
+        if factor!=None:
+            return(method, factor)
+
+# END find_factor FUNCTION
+
+# START factor_modulus FUNCTION
+
+def factor_modulus(n, processes=None, seed=None):
+    """
+    Factor the modulus n = p*q of a TinyRSA key and return (p, q) with p <= q.
+    For a multi-prime modulus the two factors are not all prime, see factor_primes.
+
+    Trial division, Pollard p-1 and Pollard rho (with a different seed on each process) are run at the same time on a pool of processes (by default one per core).
+    The first process to find a factor wins and the pool is terminated, which cancels the other ones.
+    With processes=1 the methods are run one after the other in the current process.
+    """
+    if not (isinstance(n, int) and n>3):
+        raise ValueError("Invalid modulus, it should be an integer greater than 3")
+    if RSAlib.is_prime_fast(n):
+        raise ValueError("The modulus is prime, it can't be factored")
+
+    root = math.isqrt(n)
+    if root*root==n:            # p = q, it happens with very small bitlengths
+        return(root, root)
+
+    if processes==None:
+        processes = os.cpu_count() or 1
+    rng = random.Random(seed)
+    tasks = [("trial", n, 0), ("pm1", n, 0)] + [("rho", n, rng.getrandbits(64)) for i in range(max(1, processes))]
+
+    if processes<=1:
+        for task in tasks:
+            method, factor = find_factor(task)
+            if factor!=None:
+                return(tuple(sorted((factor, n//factor))))
+    else:
+        import multiprocessing  # only imported when the parallel mode is used
+        pool = multiprocessing.Pool(processes)
+        try:
+            for method, factor in pool.imap_unordered(find_factor, tasks):
+                if factor!=None:
+                    return(tuple(sorted((factor, n//factor))))
+        finally:
+            pool.terminate()    # cancel the processes that are still searching
+    raise ValueError("Couldn't factor the modulus")
+
+# END factor_modulus FUNCTION
+
+# START factor_primes FUNCTION
+
+def factor_primes(n, processes=None, seed=None):
+    """
+    Factor the modulus n of a TinyRSA key into all its primes and return their sorted list (a prime appears as many times as it divides n).
+    The factors found by factor_modulus are factored again until they are all prime.
+    """
+    rng = random.Random(seed)
+    primes = []
+    factors = [n]
+    while factors:
+        factor = factors.pop()
+        if factor!=n and RSAlib.is_prime_fast(factor):
+            primes.append(factor)
+        else:
+            factors.extend(factor_modulus(factor, processes, rng.getrandbits(64)))
+    return(sorted(primes))
+
+# END factor_primes FUNCTION
+
+# START break_key FUNCTION
+
+def break_key(n, e, processes=None, seed=None):
+    """
+    Recover the full key (including the private exponent d) from the public key n and e by factoring n (see factor_primes).
+    Returns a TinyRSA_key built with create_from, the primes after the two smallest ones are its extra_primes.
+    """
+    primes = factor_primes(n, processes, seed)
+    key = RSAkey()
+    key.create_from(primes[0], primes[1], e, primes[2:])
+    return(key)
+
+# END break_key FUNCTION
+
+if __name__ == "__main__":
+    # Break a freshly generated 64 bits key
+    key = RSAkey()
+    key.create_new(32)
+    key.display()
+    broken = break_key(key.n, key.e)
+    broken.display()
+    print("same private exponent {}".format(broken.d==key.d))
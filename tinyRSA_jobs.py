@@ -0,0 +1,277 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the execution layer that sends the CPU-bound work (key generation, encryption, decryption) to a pool of processes
+# The web workers only wait for the results, so fast requests keep being served while slow ones are computing
+# The number of jobs waiting or running is bounded : when the pool is saturated submit raises queue.Full (the app answers 429)
+# The metrics recorded by the jobs in the processes of the pool are sent back with the results and merged in the registry of the caller (see tinyRSA_metrics)
+# Each process keeps a cache of the encrypted and decrypted blocks for the most recently used key ids, so the blocks repeated across requests are computed once per process
+#
+# List of functions (run in the processes of the pool) :
+#       - new_key                   (generate a new key)
+#       - new_keys                  (generate a list of new keys)
+#       - block_cache               (get the cache of the blocks of a key id in the current process)
+#       - batch_operation           (encrypt or decrypt groups of texts, one key per group)
+#       - run_job                   (run a function and collect its metrics, in the processes of the pool)
+#
+# List of attributes of TinyRSA_jobs :
+#       - processes         (number of processes of the pool, 0 runs the jobs inline)
+#       - max_pending       (maximum number of jobs waiting or running)
+#       - jobs              (dictionary job id -> job, the oldest finished jobs are forgotten after max_jobs)
+#
+# List of methods of TinyRSA_jobs :
+#       - __init__          (constructor of the class)
+#       - submit            (submit a job and return its id)
+#       - run               (submit a job and wait for its result)
+#       - status            (get the status and the result of a job)
+#       - forget            (forget a job once its result has been read)
+#       - stats             (get the number of pending, submitted and rejected jobs)
+#       - shutdown          (stop the pool)
+
+import os
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+
+from tinyRSA_key import TinyRSA_key as RSAkey
+from tinyRSA_message import encrypt_batch, decrypt_batch
+from tinyRSA_cache import TinyRSA_cache as RSAcache
+import tinyRSA_metrics as RSAmetrics
+
+BLOCK_CACHE_KEYS = 32       # number of key ids with a cache of blocks in each process
+block_caches = RSAcache(BLOCK_CACHE_KEYS)   # key id -> (n, TinyRSA_cache of the blocks), one per process
+
+# START new_key FUNCTION
+
+def new_key(bitlength, nprimes=2):
+    """
+    Generate and return a new key (see TinyRSA_key.create_new).
+    """
+    key = RSAkey()
+    key.create_new(bitlength, nprimes)
+    return(key)
+
+# END new_key FUNCTION
+
+# START new_keys FUNCTION
+
+def new_keys(bitlengths, nprimes=2):
+    """
+    Generate and return a list of new keys, one for each bitlength of the list.
+    """
+    return([new_key(bitlength, nprimes) for bitlength in bitlengths])
+
+# END new_keys FUNCTION
+
+# START block_cache FUNCTION
+
+def block_cache(key_id, key, size):
+    """
+    Returns the cache of the blocks (see tinyRSA_message.cached_blocks) of the key key_id in the current process, created with size entries if needed.
+    Returns None (no cache) if size is 0 or the key has no id. The modulus is checked so a key id given to another key never reuses the old blocks.
+    """
+    if not size or not key_id:
+        return(None)
+    entry = block_caches.get(key_id)
+    if entry==None or entry[0]!=key.n:
+        entry = (key.n, RSAcache(size))
+        block_caches.put(key_id, entry)
+    return(entry[1])
+
+# END block_cache FUNCTION
+
+# START batch_operation FUNCTION
+
+def batch_operation(operation, groups, cipher_format="bits", cache_size=0):
+    """
+    Encrypt (operation="encrypt") or decrypt (operation="decrypt") groups of texts, groups being a list of (key, list of texts, key id).
+    The cipher texts are written in cipher_format and the key id is written in (or checked against) the containers (see tinyRSA_message.encode_cipher).
+    With cache_size, the blocks of each key id are cached (cache_size blocks per key id) and reused by the next jobs of the same process (see block_cache).
+    Returns a list with, for each group, ("ok", list of results) or ("error", message) if the texts of the group are invalid.
+    """
+    results = []
+    for key, texts, key_id in groups:
+        cache = block_cache(key_id, key, cache_size)
+        try:
+            if operation=="encrypt":
+                results.append(("ok", encrypt_batch(key, texts, cipher_format=cipher_format, key_id=key_id, cache=cache)))
+            else:
+                results.append(("ok", decrypt_batch(key, texts, key_id=key_id, cache=cache)))
+        except ValueError as error:
+            results.append(("error", str(error)))
+    return(results)
+
+# END batch_operation FUNCTION
+
+# START run_job FUNCTION
+
+def run_job(function, args, metrics=False):
+    """
+    Run function(*args) and return (result, snapshot of the metrics recorded by the call), the snapshot is None if metrics is False.
+    """
+    if not metrics:
+        return(function(*args), None)
+    with RSAmetrics.collect() as registry:
+        result = function(*args)
+    return(result, registry.snapshot())
+
+# END run_job FUNCTION
+
+class TinyRSA_jobs():
+    """
+    This class runs jobs on a shared pool of processes with a bounded number of pending jobs.
+    The pool is created on the first job of each process, so each forked web worker gets its own pool.
+    """
+
+    def __init__(self, processes=None, max_pending=64, max_jobs=1024):
+        """
+        The constructor only stores the settings, the pool is started with the first job.
+        processes is the number of processes (the number of cores by default, 0 runs the jobs inline in the calling thread).
+        """
+        if processes==None:
+            processes = os.cpu_count() or 1
+        if not (isinstance(max_pending, int) and max_pending>0):
+            raise ValueError("Invalid maximum number of pending jobs, should be an integer strickly greater than 0")
+
+        self.processes = processes
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()           # job id -> {"future", "then", "finished" (event set once then is applied), "result", "error"}
+        self.pending = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.finish_lock = threading.Lock() # the then functions are applied one at a time, as soon as their jobs are done
+        self.executor = None
+        self.pid = None
+
+    def _get_executor(self):
+        """
+        Returns the pool of the current process, creating it if needed.
+        """
+        if self.executor==None or self.pid!=os.getpid():
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(self.processes)
+            self.pid = os.getpid()
+        return(self.executor)
+
+    def _done(self, future, job):
+        """
+        Called as soon as the future of job is done : merges its metrics and applies its then function (once), the result or the exception is stored in the job.
+        """
+        with self.lock:
+            self.pending -= 1
+        with self.finish_lock:
+            try:
+                result, snapshot = future.result()
+                if snapshot!=None:  # metrics recorded in the process of the pool
+                    RSAmetrics.registry.merge(snapshot)
+                job["result"] = job["then"](result) if job["then"]!=None else result
+            except Exception as error:
+                job["error"] = error
+            job["finished"].set()
+
+    def submit(self, function, *args, then=None):
+        """
+        This method submits function(*args) to the pool and returns the id of the job.
+        then is an optional function applied (once, in the calling process) to the result as soon as the job is done, even if nobody asks for its result.
+        Raises queue.Full if there are already max_pending jobs waiting or running.
+        """
+        return(self._submit(function, args, then)[0])
+
+    def _submit(self, function, args, then):
+        """
+        Submits the job and returns its id and its record.
+        """
+        with self.lock:
+            if self.pending>=self.max_pending:
+                self.rejected += 1
+                raise queue.Full("Too many pending jobs")
+            self.pending += 1
+            self.submitted += 1
+            if self.processes==0:           # inline mode
+                future = Future()
+            else:
+                try:
+                    future = self._get_executor().submit(run_job, function, args, RSAmetrics.enabled)
+                except:
+                    self.pending -= 1
+                    raise
+            id = uuid.uuid4().hex
+            job = {"future": future, "then": then, "finished": threading.Event(), "result": None, "error": None}
+            self.jobs[id] = job
+            while len(self.jobs)>self.max_jobs:     # forget the oldest jobs
+                self.jobs.popitem(last=False)
+
+        if self.processes==0:
+            try:
+                future.set_result((function(*args), None))     # the metrics are recorded directly
+            except Exception as error:
+                future.set_exception(error)
+        future.add_done_callback(lambda future: self._done(future, job))
+        return(id, job)
+
+    def _result(self, job):
+        """
+        Returns the result stored by _done for a finished job, or raises its exception.
+        """
+        if job["error"]!=None:
+            raise job["error"]
+        return(job["result"])
+
+    def run(self, function, *args, then=None, timeout=None):
+        """
+        This method submits function(*args) and waits for its result (see submit).
+        Raises queue.Full if the pool is saturated and concurrent.futures.TimeoutError if the result isn't ready after timeout seconds.
+        """
+        id, job = self._submit(function, args, then)
+        try:
+            if not job["finished"].wait(timeout):       # wait for the job and its then function
+                raise TimeoutError("The job isn't done after {} seconds".format(timeout))
+            return(self._result(job))
+        finally:
+            with self.lock:
+                self.jobs.pop(id, None)                 # nobody will ask for the status of a synchronous job
+
+    def status(self, id):
+        """
+        This method returns the status of a job as a dictionary {"id", "status"} with status "pending", "running", "done" (with "result") or "failed" (with "error").
+        Returns None if the job is unknown (or forgotten).
+        """
+        job = self.jobs.get(id)
+        if job==None:
+            return(None)
+        if not job["finished"].is_set():              # still computing, or its then function is running
+            return({"id": id, "status": "running" if job["future"].running() or job["future"].done() else "pending"})
+        if job["error"]!=None:
+            return({"id": id, "status": "failed", "error": str(job["error"])})
+        return({"id": id, "status": "done", "result": job["result"]})
+
+    def forget(self, id):
+        """
+        This method forgets the job id (its status is no longer available), for the callers that have read its result.
+        """
+        with self.lock:
+            self.jobs.pop(id, None)
+
+    def stats(self):
+        """
+        This method returns a dictionary with the number of processes, pending jobs, submitted jobs and rejected jobs.
+        """
+        with self.lock:
+            return({"processes": self.processes,
+                    "pending": self.pending,
+                    "max_pending": self.max_pending,
+                    "submitted": self.submitted,
+                    "rejected": self.rejected})
+
+    def shutdown(self):
+        """
+        This method stops the pool once the pending jobs are done.
+        """
+        if self.executor!=None and self.pid==os.getpid():
+            self.executor.shutdown()
+        self.executor = None
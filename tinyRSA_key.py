@@ -17,24 +17,40 @@
 #       - lowest_multiple   (lcm(p-1, q-1) is used to generate the private key)
 #       - e                 (the public exponent, part of the public key)
 #       - d                 (the private exponent, part of the private key)
+#       - dp                (d mod (p-1), CRT parameter of the private key)
+#       - dq                (d mod (q-1), CRT parameter of the private key)
+#       - qinv              (q^-1 mod p, CRT coefficient of the private key)
+#       - extra_primes      (the primes after p and q of a multi-prime key, empty for a two-prime key)
+#       - extra_crt         (the CRT parameters (d mod (r-1), (p*q*...)^-1 mod r) of each extra prime r)
 #
 #
 # List of methods :
 #       - __init__          (constructor of the class)
 #       - create_new        (generating a new key)
 #       - create_from       (generating a key from known values - p, q and e)
+#       - restore           (rebuilding a key from all its stored values, without any computation)
+#       - get_primes        (get the list of all the primes of the key)
+#       - carmichael        (compute the Carmichael function of n from the primes)
 #       - get_bitlength     (get the length in bits of the public key n)
 #       - choose_exponent   (choose a valid exponent for the public key)
+#       - compute_crt       (precompute the Chinese Remainder Theorem parameters)
+#       - has_crt           (check if the CRT parameters can be used)
+#       - public_operation  (modular exponentiation of a block with the public exponent)
+#       - private_operation (modular exponentiation of a block with the private exponent, with or without CRT)
 #       - display           (display the attributes of the class)
 
 import tinyRSA_lib as RSAlib
+import tinyRSA_metrics as RSAmetrics
 
 class TinyRSA_key():
     """
     This class describes an RSA key fitting for the TinyRSA project.
     Everything is public even private keys as the goal is not to do encryption but to pay around with the RSA scheme.
+    The attributes are declared in __slots__, so a key has no __dict__ and takes less memory (many keys are kept at once by the key pools, the caches and tinyRSA_keyring).
     """
 
+    __slots__ = ("p", "q", "n", "e", "d", "dp", "dq", "qinv", "extra_primes", "extra_crt")
+
     def __init__(self):
         """
         The constructor is just to create the class attributes, the actual generation of the keys will happen in the create_new or create_from methods.
@@ -44,6 +60,11 @@ class TinyRSA_key():
         self.n = None       # modulus, part of public key
         self.e = None       # exponent, part of public key
         self.d = None       # private exponent, part of private key
+        self.dp = None      # d mod (p-1), CRT parameter
+        self.dq = None      # d mod (q-1), CRT parameter
+        self.qinv = None    # q^-1 mod p, CRT coefficient
+        self.extra_primes = []  # primes after p and q for a multi-prime key
+        self.extra_crt = []     # (d mod (r-1), (p*q*...)^-1 mod r) for each extra prime r
 
     def display(self):
         """
@@ -55,6 +76,12 @@ class TinyRSA_key():
         print("\tn = {}".format(self.n))
         print("\te = {}".format(self.e))
         print("\td = {}".format(self.d))
+        print("\tdp = {}".format(self.dp))
+        print("\tdq = {}".format(self.dq))
+        print("\tqinv = {}".format(self.qinv))
+        for i in range(len(self.extra_primes)):
+            print("\tr{} = {}".format(i+3, self.extra_primes[i]))
+            print("\td{}, t{} = {}".format(i+3, i+3, self.extra_crt[i] if self.extra_crt else None))
 
     def get_bitlength(self):
         """
@@ -65,48 +92,92 @@ class TinyRSA_key():
         else:
             return(self.n.bit_length())     # return the number of bits necessary to represent the public key in binary, excluding the sign and leading zeros
 
-    def create_new(self, bitlength = 512):
+    def create_new(self, bitlength = 512, nprimes = 2, parallel = False, processes = None):
         """
         This method with generate a new key for the object with prime numbers of specified bitlength. By default the primes are 512 bits long which makes for a 1024 public key length.
+
+        With nprimes greater than 2 the key is a multi-prime key : the public key keeps the same length (2*bitlength) but it is the product of nprimes smaller primes (of about 2*bitlength/nprimes bits).
+        The length of the public key is checked, the primes are drawn large enough for their product to never be one bit short (see tinyRSA_lib.prime_with_bitlength).
+        Smaller primes are much cheaper to generate and the private key operation is faster with the CRT.
+        For more information https://tools.ietf.org/html/rfc8017#section-3
+
+        If parallel is True all the primes are searched at the same time by workers racing on several processes (see tinyRSA_lib.race_primes),
+        processes is the number of processes (by default the number of cores). It makes the generation of large keys faster and its duration more regular.
+        In both modes the primes are distinct (p!=q).
+
+        The duration of the generation is recorded by the instrumentation (see tinyRSA_metrics), by length of the public key.
         """
         # Input check
-        if not (isinstance(bitlength, int) and bitlength > 1):     # The bitlength has to be an integer strickly greater than 1
-            raise ValueError("Invalid bitlength for constructor, should be an integer strickly greater than 1")
+        if not (isinstance(bitlength, int) and bitlength > 2):     # The bitlength has to be an integer strickly greater than 2 (3 is the only prime of 2 bits, so p would be equal to q)
+            raise ValueError("Invalid bitlength for constructor, should be an integer strickly greater than 2")
+        if not (isinstance(nprimes, int) and nprimes>=2):
+            raise ValueError("Invalid number of primes, should be an integer greater than 1")
+        if nprimes>2 and nprimes>RSAlib.max_nprimes(bitlength):  # there have to be enough distinct primes of each length (see tinyRSA_lib.max_nprimes)
+            raise ValueError("Invalid number of primes, should be an integer between 2 and {} for a bitlength of {}".format(RSAlib.max_nprimes(bitlength), bitlength))
 
-        # Generate the primes
-        self.p = RSAlib.prime_with_bitlength(bitlength) # first prime of specified bitlength
-        self.q = RSAlib.prime_with_bitlength(bitlength) # second prime of specified bitlength
+        with RSAmetrics.timer("tinyrsa_keygen_seconds", bitlength=2*bitlength, nprimes=nprimes):
+            # Generate the primes
+            lengths = RSAlib.prime_lengths(bitlength, nprimes)     # split the length of the public key between the primes (bitlength each for two primes)
+            for attempt in range(100):  # the primes have to be distinct (p!=q) and give a modulus of 2*bitlength bits, it can take a few attempts with very small bitlengths
+                if parallel:
+                    primes = RSAlib.race_primes(lengths, processes)
+                else:
+                    primes = []
+                    for draw in range(10*nprimes):      # a prime equal to one already drawn is drawn again
+                        prime = RSAlib.prime_with_bitlength(lengths[len(primes)], nprimes=nprimes)
+                        if prime not in primes:
+                            primes.append(prime)
+                            if len(primes)==nprimes:
+                                break
+                n = 1
+                for prime in primes:
+                    n *= prime
+                if len(set(primes))==nprimes and n.bit_length()==2*bitlength:
+                    break
+            else:
+                raise ValueError("Couldn't find {} distinct primes giving a public key of {} bits, the bitlength is too small".format(nprimes, 2*bitlength))
+            self.p, self.q, self.extra_primes = primes[0], primes[1], primes[2:]
 
-        # Generate the public modulus
-        self.n = self.p * self.q
+            # Public modulus
+            self.n = n
 
-        # Generate the public exponent
-        lowest_multiple = RSAlib.lcm(self.p-1, self.q-1)    # Carmichael function of n
-        self.e = self.choose_exponent(lowest_multiple)      # choose a valid exponent for the public key
+            # Generate the public exponent
+            lowest_multiple = self.carmichael()                 # Carmichael function of n
+            self.e = self.choose_exponent(lowest_multiple)      # choose a valid exponent for the public key
 
-        # Generate the private exponent
-        # d * e = 1 (mod lowest_multiple)
-        self.d = RSAlib.multiplicative_inverse(self.e, lowest_multiple)
+            # Generate the private exponent
+            # d * e = 1 (mod lowest_multiple)
+            self.d = RSAlib.multiplicative_inverse(self.e, lowest_multiple)
 
-    def create_from(self, p, q, e):
+            # Precompute the CRT parameters for faster private key operations
+            self.compute_crt()
+
+    def create_from(self, p, q, e, extra_primes=()):
         """
         This methods allows for the creation of a key from two prime numbers and a public exponent.
+        For a multi-prime key, the primes after p and q are given in extra_primes.
 
         It still performs the check to see if the input is valid to generate a key.
         """
         # Input check
-        if not (isinstance(p, int) and isinstance(q, int) and isinstance(e, int)):
+        extra_primes = list(extra_primes)
+        if not (isinstance(p, int) and isinstance(q, int) and isinstance(e, int) and all(isinstance(r, int) for r in extra_primes)):
             raise ValueError("Invalid input, expecting three integers")
 
-        if RSAlib.is_prime_fast(p) and RSAlib.is_prime_fast(q):               # The input values have to be valid primes
-            lowest_multiple = RSAlib.lcm(p-1, q-1)    # Carmichael function of n
+        if all(RSAlib.is_prime_fast(prime) for prime in [p, q] + extra_primes):   # The input values have to be valid primes
+            lowest_multiple = 1
+            for prime in [p, q] + extra_primes:
+                lowest_multiple = RSAlib.lcm(lowest_multiple, prime-1)   # Carmichael function of n
             if RSAlib.gcd(e, lowest_multiple)==1:               # All input is valid
                 # Store prime numbers
                 self.p = p
                 self.q = q
+                self.extra_primes = extra_primes
 
                 # Generate the public modulus
                 self.n = self.p * self.q
+                for prime in self.extra_primes:
+                    self.n *= prime
 
                 # Generate the public exponent
                 self.e = e
@@ -114,11 +185,39 @@ class TinyRSA_key():
                 # Generate the private exponent
                 # d * e = 1 (mod lowest_multiple)
                 self.d = RSAlib.multiplicative_inverse(self.e, lowest_multiple)
+
+                # Precompute the CRT parameters for faster private key operations
+                self.compute_crt()
             else:   # The exponent is not valid
                 raise ValueError("Invalid exponent")
         else:
             raise ValueError("Numbers not prime, couldn't construct valid RSA key")
 
+    def restore(self, p, q, e, n, d, dp=None, dq=None, qinv=None, extra_primes=(), extra_crt=()):
+        """
+        This method rebuilds a key from all its values, as stored by tinyRSA_store, without checking nor computing anything.
+        The values are trusted : they have been computed by create_new or create_from before being stored.
+        """
+        self.p, self.q, self.n, self.e, self.d = p, q, n, e, d
+        self.dp, self.dq, self.qinv = dp, dq, qinv
+        self.extra_primes = list(extra_primes)
+        self.extra_crt = [tuple(parameters) for parameters in extra_crt]
+
+    def get_primes(self):
+        """
+        This method returns the list of all the primes of the key (p, q then the extra primes of a multi-prime key).
+        """
+        return([self.p, self.q] + self.extra_primes)
+
+    def carmichael(self):
+        """
+        This method returns the Carmichael function of n, lambda(n) = lcm(r1-1, r2-1, ...) over all the primes of the key.
+        """
+        lowest_multiple = 1
+        for prime in self.get_primes():
+            lowest_multiple = RSAlib.lcm(lowest_multiple, prime-1)
+        return(lowest_multiple)
+
     def choose_exponent(self, lowest_multiple):
         """
         This method chooses a valid public exponent for the encryption. This public exponent needs to be coprime with lowest_multiple.
@@ -139,10 +238,78 @@ class TinyRSA_key():
                 return(candidate)
         raise ValueError("Couldn't choose a valid exponent")    # Raise error if no candidate has been returned
 
+    def compute_crt(self):
+        """
+        This method precomputes the parameters used to speed up the private key operation with the Chinese Remainder Theorem (CRT).
+                dp = d mod (p-1)
+                dq = d mod (q-1)
+                qinv = q^-1 mod p
+        With these values the exponentiation mod n is replaced by two exponentiations mod p and mod q with exponents half the size, which is roughly 3 to 4 times faster.
+        For more information https://en.wikipedia.org/wiki/RSA_(cryptosystem)#Using_the_Chinese_remainder_algorithm
+
+        For a multi-prime key, each extra prime r gets the parameters (d mod (r-1), (p*q*...)^-1 mod r) where the product is over the primes before r (see RFC 8017).
+
+        When the primes are not distinct (p = q can happen with very small bitlengths) the CRT doesn't apply and the parameters are left empty.
+        """
+        primes = self.get_primes()
+        if len(set(primes))!=len(primes):  # the primes have to be coprime for the CRT
+            self.dp, self.dq, self.qinv, self.extra_crt = None, None, None, []
+        else:
+            self.dp = self.d % (self.p-1)
+            self.dq = self.d % (self.q-1)
+            self.qinv = RSAlib.multiplicative_inverse(self.q, self.p)
+            self.extra_crt = []
+            product = self.p * self.q
+            for prime in self.extra_primes:
+                self.extra_crt.append((self.d % (prime-1), RSAlib.multiplicative_inverse(product % prime, prime)))
+                product *= prime
+
+    def has_crt(self):
+        """
+        This method returns True if the CRT parameters are set and can be used for the private key operation.
+        """
+        return(self.qinv!=None)
+
+    def public_operation(self, block):
+        """
+        This method computes block^e mod n, it is used to encrypt a block.
+        """
+        return(RSAlib.powmod(block, self.e, self.n))
+
+    def private_operation(self, block, crt=True):
+        """
+        This method computes block^d mod n, it is used to decrypt a block.
+
+        If crt is True (and the CRT parameters are set) the computation uses the Garner recombination :
+                m1 = block^dp mod p
+                m2 = block^dq mod q
+                h = qinv*(m1-m2) mod p
+                m = m2 + h*q
+        which gives exactly the same result as pow(block, d, n).
+        For a multi-prime key the result is then extended to each extra prime r (k-way CRT) :
+                mr = block^dr mod r
+                h = tr*(mr-m) mod r
+                m = m + h*R         (R being the product of the primes before r)
+        """
+        if crt and self.has_crt():
+            m1 = RSAlib.powmod(block, self.dp, self.p)
+            m2 = RSAlib.powmod(block, self.dq, self.q)
+            h = (self.qinv * (m1-m2)) % self.p
+            m = m2 + h*self.q
+            product = self.p * self.q
+            for prime, (exponent, coefficient) in zip(self.extra_primes, self.extra_crt):
+                mr = RSAlib.powmod(block, exponent, prime)
+                h = (coefficient * (mr-m)) % prime
+                m += h*product
+                product *= prime
+            return(m)
+        else:
+            return(RSAlib.powmod(block, self.d, self.n))
+
 if __name__ == "__main__":
     key = TinyRSA_key()
     # Test with small key length
-    key.create_new(2)   # passes
+    key.create_new(3)   # passes (with 2 bits p and q would both be 3)
     # key.create_from(9894860519494359018950038983556792265408393497140033513744905498507262928855218137106359097320402290625573912104853924285745036900920274281585921568010061, 9876580085113473574355754319240040199501850357794438624522130614032584982809613627280949286201557526837926805975995131624348084348838642555149459317777077, 17)
     key.display()
     print("valid inverse {}".format((key.e*key.d)%(RSAlib.lcm(key.p-1, key.q-1))==1))
@@ -0,0 +1,194 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the class to keep pools of pre-generated keys
+# Generating a key with a large bitlength can take seconds, with a pool the keys are generated in the background and a request only has to take one
+# In the app the keys are generated by the pool of processes of tinyRSA_jobs, so the web workers never spend their time generating primes
+# (the pools are filled as soon as the app is loaded, each key is added to its pool as soon as its job is done)
+#
+# List of attributes :
+#       - size              (maximum number of keys kept for each bitlength)
+#       - pools             (dictionary bitlength -> deque of ready keys)
+#       - hits              (dictionary bitlength -> number of keys served from the pool)
+#       - misses            (dictionary bitlength -> number of keys generated on demand)
+#       - jobs              (TinyRSA_jobs generating the keys, None if they are generated by the background thread)
+#       - refills           (dictionary bitlength -> ids of the jobs generating its keys)
+#
+# List of methods :
+#       - __init__          (constructor of the class)
+#       - start             (start filling the pools)
+#       - stop              (stop filling the pools)
+#       - take              (take a ready key of the selected bitlength, if there is one)
+#       - get               (get a key of the selected bitlength)
+#       - stats             (get the depth, hit and miss counts of each pool)
+
+import os
+import queue
+import threading
+from collections import deque
+from functools import partial
+
+from tinyRSA_key import TinyRSA_key as RSAkey
+from tinyRSA_jobs import new_key
+
+class TinyRSA_keypool():
+    """
+    This class keeps a bounded pool of ready keys for a set of bitlengths (the popular ones).
+    The pools are refilled in the background, get takes a key in O(1) and falls back to generating one on demand when the pool is empty.
+
+    With jobs (a TinyRSA_jobs), the keys are generated by its pool of processes : the pools are filled from the construction, each job adds its key as soon as it is done and take submits a job for each key taken.
+    Without jobs (or if jobs runs inline) a background thread generates the keys. Keep in mind that this thread shares the interpreter with the requests, it makes the keys ready in advance but doesn't add computing power.
+    """
+
+    def __init__(self, bitlengths=(), size=4, jobs=None):
+        """
+        The constructor creates an empty pool for each bitlength of the list.
+        With jobs the pools start filling right away, otherwise only from the start method (or the first call to get).
+        """
+        if not (isinstance(size, int) and size>0):
+            raise ValueError("Invalid size for the key pool, should be an integer strickly greater than 0")
+
+        self.size = size
+        self.pools = {bitlength: deque() for bitlength in bitlengths}
+        self.hits = {bitlength: 0 for bitlength in bitlengths}
+        self.misses = {bitlength: 0 for bitlength in bitlengths}
+        self.lock = threading.RLock()       # protects the pools and the counters (reentrant : a job done before submit returns calls _add right away)
+        self.wakeup = threading.Event()     # set when a key has been taken from a pool
+        self.running = False
+        self.thread = None
+        self.pid = None                     # process that started the refills (a forked worker has to start its own)
+        self.jobs = jobs if jobs!=None and jobs.processes!=0 else None
+        self.refills = {}
+        self.submitting = False             # set while _submit_refills is running
+        if self.jobs!=None:
+            self.start()
+
+    def start(self):
+        """
+        This method starts filling the pools : submits the refill jobs, or starts the background thread without jobs.
+        """
+        with self.lock:
+            if self.running and self.pid==os.getpid():
+                return
+            self.running = True
+            if self.pid!=os.getpid():
+                self.refills = {}           # the jobs submitted before a fork belong to the pool of the parent
+            self.pid = os.getpid()
+            if self.jobs!=None:
+                self._submit_refills()
+            else:
+                self.thread = threading.Thread(target=self._refill, name="tinyRSA-keypool", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        """
+        This method stops filling the pools, the background thread stops once it has finished the key it is generating (the refill jobs already submitted are ignored).
+        """
+        self.running = False
+        self.wakeup.set()
+        if self.thread!=None:
+            self.thread.join()
+            self.thread = None
+
+    def _refill(self):
+        """
+        Loop of the background thread : generate a key for the least filled pool, wait for a key to be taken when all pools are full.
+        """
+        while self.running:
+            with self.lock:
+                depths = [(len(pool), bitlength) for bitlength, pool in self.pools.items() if len(pool)<self.size]
+                if not depths:
+                    self.wakeup.clear()
+            if not depths:                  # all pools are full
+                self.wakeup.wait()
+                continue
+            bitlength = min(depths)[1]
+            key = RSAkey()
+            key.create_new(bitlength)       # done without the lock so get is never blocked by the generation
+            with self.lock:
+                self.pools[bitlength].append(key)
+
+    def _add(self, bitlength, key):
+        """
+        Then function of the refill jobs : add the new key to its pool as soon as the job is done, and submit the refills still missing.
+        """
+        with self.lock:
+            if len(self.pools[bitlength])<self.size:
+                self.pools[bitlength].append(key)
+            if self.running and self.pid==os.getpid() and not self.submitting:
+                self._submit_refills(finishing=bitlength)
+
+    def _submit_refills(self, finishing=None):
+        """
+        Submit a job for each key missing in the pools, counting the keys already being generated (called with the lock held).
+        The refills use at most half of the pending jobs of the pool of processes, so the requests are never rejected because of them.
+        finishing is the bitlength of the job whose then function is running (its key is already in the pool but the job isn't finished yet).
+        """
+        self.submitting = True
+        try:
+            self._submit_missing(finishing)
+        finally:
+            self.submitting = False
+
+    def _submit_missing(self, finishing):
+        """
+        Loop of _submit_refills over the pools.
+        """
+        for bitlength, pool in self.pools.items():
+            ids = self.refills.setdefault(bitlength, [])
+            for id in list(ids):            # forget the finished jobs (a failed job is submitted again)
+                status = self.jobs.status(id)
+                if status==None or status["status"] in ("done", "failed"):
+                    ids.remove(id)
+                    self.jobs.forget(id)
+            running = len(ids) - (1 if bitlength==finishing else 0)
+            for i in range(self.size - len(pool) - running):
+                if self.jobs.stats()["pending"]>=self.jobs.max_pending//2:
+                    return
+                try:
+                    ids.append(self.jobs.submit(new_key, bitlength, then=partial(self._add, bitlength)))
+                except queue.Full:
+                    return
+
+    def take(self, bitlength):
+        """
+        This method returns a ready key of the selected bitlength from the pool, or None if there is none (the caller has to generate the key).
+        """
+        if not self.running or self.pid!=os.getpid():
+            self.start()
+
+        key = None
+        with self.lock:
+            pool = self.pools.get(bitlength)
+            if pool:
+                key = pool.popleft()
+                self.hits[bitlength] += 1
+            else:
+                self.misses[bitlength] = self.misses.get(bitlength, 0) + 1
+            if self.jobs!=None and self.running:
+                self._submit_refills()
+        self.wakeup.set()                   # a pool may need to be refilled
+        return(key)
+
+    def get(self, bitlength):
+        """
+        This method returns a key of the selected bitlength, taken from the pool if one is ready and generated on demand otherwise.
+        """
+        key = self.take(bitlength)
+        if key==None:                       # fall back to generating the key on demand
+            key = RSAkey()
+            key.create_new(bitlength)
+        return(key)
+
+    def stats(self):
+        """
+        This method returns a dictionary bitlength -> {"depth", "size", "hits", "misses"} to help sizing the pools.
+        Bitlengths that are not pooled only appear once a key has been asked for them (always a miss).
+        """
+        with self.lock:
+            return({bitlength: {"depth": len(self.pools[bitlength]) if bitlength in self.pools else 0,
+                                "size": self.size if bitlength in self.pools else 0,
+                                "hits": self.hits.get(bitlength, 0),
+                                "misses": self.misses.get(bitlength, 0)}
+                    for bitlength in sorted(set(self.pools) | set(self.misses))})
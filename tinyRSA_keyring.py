@@ -0,0 +1,152 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the class to keep a very large number of tiny keys (for example the keys of an attack sweep) in little memory
+# The values of the keys are stored in arrays of machine words instead of one TinyRSA_key per key :
+#       - p, q and e    array of unsigned 32 bits integers
+#       - d             array of unsigned 64 bits integers
+# so a key takes 20 bytes, n and the CRT parameters are computed when the key is read. Only two-prime keys of at most 64 bits fit (primes of at most 32 bits).
+# The id of a key is its position in the ring, a TinyRSA_key is built for it when it is read (see get).
+#
+# The ring is saved as a flat binary file : a header (magic, version, number of keys) followed by the four arrays, little endian.
+#
+# The package array is required (it is part of the standard library)
+#
+# List of attributes :
+#       - p                 (array of the first primes)
+#       - q                 (array of the second primes)
+#       - e                 (array of the public exponents)
+#       - d                 (array of the private exponents)
+#
+# List of methods :
+#       - __init__          (constructor of the class)
+#       - add               (add a key to the ring)
+#       - generate          (generate many new keys at once)
+#       - get               (build the key of an id)
+#       - public_key        (get n and e of an id without building the key)
+#       - save              (write the ring to a binary file)
+#       - load              (read a ring written by save)
+#       - __len__, __getitem__, __iter__    (number of keys, key of an id, iteration on the keys)
+
+import struct
+import sys
+from array import array
+
+from tinyRSA_key import TinyRSA_key as RSAkey
+
+MAX_PRIME_BITS = 32             # primes stored in 32 bits words, so n and d fit in 64 bits
+MAGIC = b"TRKR"
+VERSION = 1
+HEADER = struct.Struct("<4sBQ")     # magic, version, number of keys
+
+class TinyRSA_keyring():
+    """
+    This class is a compact collection of tiny two-prime keys (modulus of at most 64 bits) stored in arrays of machine words.
+    """
+
+    def __init__(self):
+        """
+        The constructor creates an empty ring.
+        """
+        self.p = array("I")     # unsigned int, 32 bits
+        self.q = array("I")
+        self.e = array("I")
+        self.d = array("Q")     # unsigned long long, 64 bits
+        if self.p.itemsize!=4 or self.d.itemsize!=8:
+            raise ValueError("The arrays of this platform don't have the sizes expected by the key ring")
+
+    def __len__(self):
+        return(len(self.p))
+
+    def __getitem__(self, id):
+        return(self.get(id))
+
+    def __iter__(self):
+        for id in range(len(self)):
+            yield self.get(id)
+
+    def add(self, key):
+        """
+        This method adds a two-prime TinyRSA_key to the ring and returns its id.
+        Raises ValueError if the key has extra primes or primes longer than MAX_PRIME_BITS bits.
+        """
+        if not isinstance(key, RSAkey) or key.p==None or key.d==None:
+            raise ValueError("Invalid input for add, expected a complete TinyRSA_key")
+        if key.extra_primes or max(key.p, key.q).bit_length()>MAX_PRIME_BITS:
+            raise ValueError("Only two-prime keys with primes of at most {} bits fit in the key ring".format(MAX_PRIME_BITS))
+        self.p.append(key.p)
+        self.q.append(key.q)
+        self.e.append(key.e)
+        self.d.append(key.d)
+        return(len(self.p)-1)
+
+    def generate(self, count, bitlength):
+        """
+        This method generates count new keys with primes of bitlength bits (see TinyRSA_key.create_new) and returns the range of their ids.
+        """
+        if not (isinstance(bitlength, int) and 2<bitlength<=MAX_PRIME_BITS):
+            raise ValueError("Invalid bitlength for the key ring, should be an integer ranging from 3 to {}".format(MAX_PRIME_BITS))
+        start = len(self)
+        key = RSAkey()
+        for i in range(count):
+            key.create_new(bitlength)       # the same object is reused, only its values are kept
+            self.add(key)
+        return(range(start, len(self)))
+
+    def get(self, id):
+        """
+        This method returns the TinyRSA_key of id, rebuilt from the stored values (n and the CRT parameters are computed, nothing is checked).
+        Raises IndexError if there is no key with this id.
+        """
+        if not 0<=id<len(self):     # no negative indexes, an id is a position
+            raise IndexError("No key with id {} in the key ring".format(id))
+        p, q, d = self.p[id], self.q[id], self.d[id]
+        key = RSAkey()
+        key.restore(p, q, self.e[id], p*q, d)
+        key.compute_crt()
+        return(key)
+
+    def public_key(self, id):
+        """
+        This method returns (n, e) of the key id without building a TinyRSA_key, for sweeps that only need the public keys.
+        """
+        if not 0<=id<len(self):
+            raise IndexError("No key with id {} in the key ring".format(id))
+        return(self.p[id]*self.q[id], self.e[id])
+
+    def save(self, path):
+        """
+        This method writes the ring to the binary file path : the header then the arrays p, q, e and d, little endian.
+        """
+        with open(path, "wb") as outfile:
+            outfile.write(HEADER.pack(MAGIC, VERSION, len(self)))
+            for values in (self.p, self.q, self.e, self.d):
+                if sys.byteorder=="big":
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(outfile)
+
+    @classmethod
+    def load(cls, path):
+        """
+        This method returns the ring read from the binary file path written by save.
+        Raises ValueError if the file isn't a key ring.
+        """
+        ring = cls()
+        with open(path, "rb") as infile:
+            header = infile.read(HEADER.size)
+            if len(header)!=HEADER.size:
+                raise ValueError("Invalid key ring file, the header is incomplete")
+            magic, version, count = HEADER.unpack(header)
+            if magic!=MAGIC or version!=VERSION:
+                raise ValueError("Invalid key ring file, wrong magic number or version")
+            try:
+                for values in (ring.p, ring.q, ring.e, ring.d):
+                    values.fromfile(infile, count)
+                    if sys.byteorder=="big":
+                        values.byteswap()
+            except (EOFError, ValueError):
+                raise ValueError("Invalid key ring file, it is truncated")
+        return(ring)
+
@@ -8,19 +8,40 @@
 # Essentially these functions are mathematical functions to perform arithmetics
 #
 # The package random is required
+# The operations on big integers go through the arithmetic backend of tinyRSA_backend (stdlib by default, gmpy2 if it is installed)
 #
 # List of functions :
 #       - is_prime_slow             (check if a number is prime)
 #       - is_prime_fast             (check if a number is prime, faster)
+#       - is_strong_probable_prime  (one round of the Miller-Rabin test)
+#       - jacobi                    (compute the Jacobi symbol)
+#       - is_strong_lucas_probable_prime    (strong Lucas test, second half of Baillie-PSW)
+#       - small_primes              (list the primes below a limit with the sieve of Eratosthenes)
+#       - passes_trial_division     (quick check of a candidate against the table of small primes)
+#       - sieve_window              (list the candidates of a window of odd numbers that have no small factor)
+#       - integer_root              (compute the integer k-th root of a number)
+#       - prime_range               (range of the primes drawn for a selected bitlength)
 #       - prime_with_bitlength      (choose a prime with a selected bitlength)
+#       - prime_lengths             (split the length of a public key between its primes)
+#       - count_primes              (count the primes of a range, estimated for large ranges)
+#       - max_nprimes               (largest number of primes of a key of a selected bitlength)
+#       - record_prime              (record the work needed to find a prime in the metrics)
+#       - race_primes               (find several distinct primes at once with workers racing on a pool of processes)
 #       - gcd                       (compute the gcd)
 #       - lcm                       (compute the lcm)
 #       - multiplicative_inverse    (compute the multiplicative inverse of a number mod another)
+#       - powmod                    (compute a modular exponentiation)
 #
 # The beginning of each function can be easily reached by searching for the string "START function name"
 
 
+import os
 import random
+from bisect import bisect_left
+from math import isqrt, log
+
+import tinyRSA_backend as RSAbackend
+import tinyRSA_metrics as RSAmetrics
 
 # START is_prime_slow FUNCTION
 
@@ -45,82 +66,455 @@ def is_prime_slow(n):
 
 # START is_prime_fast FUNCTION
 
-def is_prime_fast(n):
+# Deterministic Miller-Rabin : below each bound, the strong probable prime test to the first bases primes is proven to be exact
+# For more information https://oeis.org/A014233, https://miller-rabin.appspot.com and https://arxiv.org/abs/1509.00864 (Sorenson and Webster)
+DETERMINISTIC_BASES = [
+    (2047, (2,)),
+    (1373653, (2, 3)),
+    (25326001, (2, 3, 5)),
+    (3215031751, (2, 3, 5, 7)),
+    (2152302898747, (2, 3, 5, 7, 11)),
+    (3474749660383, (2, 3, 5, 7, 11, 13)),
+    (341550071728321, (2, 3, 5, 7, 11, 13, 17)),
+    (18446744073709551616, (2, 325, 9375, 28178, 450775, 9780504, 1795265022)),     # 2^64, bases of Jim Sinclair (all smaller than the lower bound)
+    (318665857834031151167461, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)),
+    (3317044064679887385961981, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)),
+]
+# Limit of the deterministic tier, above it Baillie-PSW is used (about 2.5 times faster than the 12 or 13 bases needed up to 3.3*10^24)
+# It can be raised up to DETERMINISTIC_BASES[-1][0] to have a proven answer instead of the (never failed) Baillie-PSW in that range
+DETERMINISTIC_LIMIT = 2**64
+
+def is_prime_fast(n, counter=None, rounds=None):
     """
-    Check if a number is likely to be prime using the Miller-Rabin primality check in a single pass. To have more accuracy, the program would have to have to perform multiple passes
+    Check if a number is prime with a tiered test, each tier being the cheapest exact (or strongest) test for the size of n :
+            - trial division : a single gcd with the product of the small primes discards the numbers with a small factor
+            - n < DETERMINISTIC_LIMIT (2^64, up to 3.3*10^24) : Miller-Rabin with the fixed bases of DETERMINISTIC_BASES, the answer is exact
+            - larger n : Baillie-PSW (Miller-Rabin to base 2 followed by a strong Lucas test), no counterexample is known
+              or, if rounds is set, Miller-Rabin to base 2 followed by rounds random bases (the former behaviour of this function with rounds=10)
 
-    Complexity is in log2(n) for a single pass.
-    Depending on how many passes we want to implement the complexity is likely to change
+    counter is an optional list [rounds], the number of Miller-Rabin and Lucas tests performed is added to counter[0] (used by the instrumentation).
 
     For more information refer to
     https://en.wikipedia.org/wiki/Miller%E2%80%93Rabin_primality_test
+    https://en.wikipedia.org/wiki/Baillie%E2%80%93PSW_primality_test
     """
     if not isinstance(n, int) or n<2:   # Check if n is a integer, if it isn't then it is not a prime
                                         # Also check if n<2 in which case it isn't prime
         return(False)
-    else:
-        # we want to decompose n=d*2^s+1 with d odd
-        s=0
-        while (n-1)%pow(2, s+1)==0: # we want to check for the max value of r
-            s+=1
-        d=(n-1)//pow(2, s)          # d is obtained by a simple division
-
-        # Prepare for multiple loops on a
-        for i in range(10): # do 10 passes in the loop
-
-            a=random.randint(2, n-1)    # if n is prime then a^d=1(mod n) or a^(d*2^r)=-1(mod n) for some 0<=r<=s-1
-                                        # if we can verify this for all values of a then n is likely to be prime (but not necessarily)
-            witness=pow(a, d, n)
-            if not (witness==1 or witness==n-1):
-                for j in range(s-1):    # we have to check if a^(d*2^r)=-1(mod n) for some 0<=r<=s-1 (in which case n is probably prime)
-                    witness=pow(witness, 2, n)
-                    if (witness==n-1):
-                        return(True)
-                return(False)           # otherwise we know for sure that n is composite
-                # If it never got out of the loop then it mean that it never found a root in the Z/nZ among the possible witnesses so we return False
-        # If False never got returned in any pass of the loop then n is very likely to be prime
-        return(True)
+    if n<=TRIAL_LIMIT:                  # small numbers are answered by the table of small primes
+        return(n in TRIAL_PRIMES)
+    if gcd(n, TRIAL_PRODUCT)!=1:        # n has a small factor
+        return(False)
+
+    # we want to decompose n-1=d*2^s with d odd, s is the number of trailing zeros of n-1
+    s=((n-1) & (1-n)).bit_length()-1
+    d=(n-1)>>s
+
+    if n<min(DETERMINISTIC_LIMIT, DETERMINISTIC_BASES[-1][0]):
+        for bound, bases in DETERMINISTIC_BASES:
+            if n<bound:
+                break
+        tests=0
+        for a in bases:
+            tests+=1
+            if not is_strong_probable_prime(n, a, d, s):
+                break
+        else:
+            tests=-tests
+        if counter!=None:
+            counter[0]+=abs(tests)
+        return(tests<0)
+
+    if rounds==None:                    # Baillie-PSW
+        result=is_strong_probable_prime(n, 2, d, s) and is_strong_lucas_probable_prime(n)
+        tests=2
+    else:                               # base 2 then random bases
+        result=is_strong_probable_prime(n, 2, d, s)
+        tests=1
+        for i in range(rounds):
+            if not result:
+                break
+            result=is_strong_probable_prime(n, random.randint(2, n-2), d, s)
+            tests+=1
+    if counter!=None:
+        counter[0]+=tests
+    return(result)
 
 # END is_prime_fast FUNCTION
 
+# START is_strong_probable_prime FUNCTION
+
+def is_strong_probable_prime(n, a, d, s):
+    """
+    One round of Miller-Rabin : returns False if the base a proves that the odd number n is composite, True otherwise (n is a strong probable prime to base a).
+    d and s are such that n-1=d*2^s with d odd.
+    if n is prime then a^d=1(mod n) or a^(d*2^r)=-1(mod n) for some 0<=r<=s-1
+    """
+    witness=powmod(a, d, n)
+    if witness==1 or witness==n-1:
+        return(True)
+    for r in range(s-1):
+        witness=witness*witness%n
+        if witness==n-1:
+            return(True)
+    return(False)
+
+# END is_strong_probable_prime FUNCTION
+
+# START jacobi FUNCTION
+
+def jacobi(a, n):
+    """
+    Computes the Jacobi symbol (a/n) for an odd positive n, it is 0, 1 or -1.
+    For more information https://en.wikipedia.org/wiki/Jacobi_symbol
+    """
+    a%=n
+    result=1
+    while a!=0:
+        while a%2==0:                   # (2/n) = -1 when n = 3 or 5 mod 8
+            a//=2
+            if n%8 in (3, 5):
+                result=-result
+        a, n = n, a                     # quadratic reciprocity
+        if a%4==3 and n%4==3:
+            result=-result
+        a%=n
+    return(result if n==1 else 0)
+
+# END jacobi FUNCTION
+
+# START is_strong_lucas_probable_prime FUNCTION
+
+def is_strong_lucas_probable_prime(n):
+    """
+    Strong Lucas probable prime test with the parameters of Selfridge (method A) : D is the first of 5, -7, 9, -11, ... with (D/n) = -1, P = 1 and Q = (1-D)/4.
+    Returns False if n is composite, True if n is a strong Lucas probable prime. n has to be odd and not too small (it is called after the trial division).
+    For more information https://en.wikipedia.org/wiki/Lucas_pseudoprime#Strong_Lucas_pseudoprimes
+    """
+    root=isqrt(n)
+    if root*root==n:                    # there is no D with (D/n) = -1 for a perfect square
+        return(False)
+    D=5
+    while True:
+        j=jacobi(D, n)
+        if j==-1:
+            break
+        if j==0 and abs(D)!=n:          # D and n share a factor
+            return(False)
+        D=-D-2 if D>0 else -D+2
+    P, Q = 1, (1-D)//4
+
+    # n+1=d*2^s with d odd
+    s=((n+1) & -(n+1)).bit_length()-1
+    d=(n+1)>>s
+
+    # compute U_d, V_d and Q^d mod n from the binary expansion of d
+    U, V, Qk = 1, P, Q%n
+    for bit in bin(d)[3:]:
+        U, V = U*V%n, (V*V-2*Qk)%n      # U_2k = U_k*V_k and V_2k = V_k^2-2*Q^k
+        Qk = Qk*Qk%n
+        if bit=="1":                    # U_2k+1 = (P*U_2k+V_2k)/2 and V_2k+1 = (D*U_2k+P*V_2k)/2
+            U, V = P*U+V, D*U+P*V
+            U = (U+n if U%2 else U)//2%n
+            V = (V+n if V%2 else V)//2%n
+            Qk = Qk*Q%n
+    if U==0 or V==0:
+        return(True)
+    for r in range(s-1):                # V_(d*2^r) = 0 for some 0<=r<s
+        V = (V*V-2*Qk)%n
+        if V==0:
+            return(True)
+        Qk = Qk*Qk%n
+    return(False)
+
+# END is_strong_lucas_probable_prime FUNCTION
+
+# START small_primes FUNCTION
+
+def small_primes(limit):
+    """
+    Returns the list of the primes strictly smaller than limit using the sieve of Eratosthenes.
+    For more information https://en.wikipedia.org/wiki/Sieve_of_Eratosthenes
+    """
+    sieve = bytearray([1])*limit        # sieve[i] is 1 as long as i could be prime
+    sieve[0:2] = bytearray(min(2, limit))
+    for i in range(2, int(limit**0.5)+1):
+        if sieve[i]:                    # cross out all the multiples of the prime i, starting at i^2
+            sieve[i*i::i] = bytearray(len(range(i*i, limit, i)))
+    return([i for i in range(limit) if sieve[i]])
+
+SMALL_PRIMES = small_primes(2048)       # table of small primes used to discard candidates before the Miller-Rabin test
+TRIAL_PRIMES = frozenset(small_primes(256))     # primes checked by the trial division of is_prime_fast
+TRIAL_LIMIT = max(TRIAL_PRIMES)
+TRIAL_PRODUCT = 1
+for prime in TRIAL_PRIMES:
+    TRIAL_PRODUCT *= prime
+
+# END small_primes FUNCTION
+
+# START passes_trial_division FUNCTION
+
+def passes_trial_division(n):
+    """
+    Returns False if n is divisible by one of the SMALL_PRIMES (other than itself), True otherwise.
+    This is much cheaper than a pass of Miller-Rabin and discards most of the composite numbers.
+    """
+    for prime in SMALL_PRIMES:
+        if prime*prime>n:               # no divisor up to sqrt(n) so n is prime
+            return(True)
+        if n%prime==0:
+            return(False)
+    return(True)
+
+# END passes_trial_division FUNCTION
+
+# START sieve_window FUNCTION
+
+def sieve_window(base, size):
+    """
+    Returns the list of the candidates base, base+2, ..., base+2*(size-1) that are not divisible by any of the odd SMALL_PRIMES.
+    base has to be odd and larger than the largest small prime (otherwise the small primes themselves would be discarded).
+
+    Instead of dividing each candidate, the multiples of each small prime are crossed out in the window like in the sieve of Eratosthenes.
+    The candidate base+2i is divisible by the prime p when i = -base/2 (mod p), the first one is at i = -base*(p+1)/2 mod p and the next ones every p.
+    """
+    sieve = bytearray([1])*size
+    for prime in SMALL_PRIMES[1:]:      # 2 is skipped because all the candidates are odd
+        first = (-base*((prime+1)//2))%prime
+        sieve[first::prime] = bytearray(len(range(first, size, prime)))
+    return([base+2*i for i in range(size) if sieve[i]])
+
+# END sieve_window FUNCTION
+
+# START integer_root FUNCTION
+
+def integer_root(n, k):
+    """
+    Returns the integer k-th root of n (the largest x such that x^k <= n), computed exactly with Newton's method (math.isqrt for k=2).
+    """
+    if not (isinstance(n, int) and isinstance(k, int) and n>=0 and k>=1):
+        raise ValueError("Invalid input for integer_root, expected a non negative integer and a positive integer")
+    if k==2:
+        return(isqrt(n))
+    if n<2:
+        return(n)
+    x=1 << -(-n.bit_length()//k)       # 2^ceil(bits/k) is larger than the root
+    while True:
+        y=((k-1)*x + n//pow(x,k-1))//k
+        if y>=x:
+            return(x)
+        x=y
+
+# END integer_root FUNCTION
+
+PRIME_TABLE_LIMIT = pow(2,20)           # the primes below this limit are counted exactly (count_primes) and drawn uniformly (prime_with_bitlength)
+
+# START prime_range FUNCTION
+
+def prime_range(l, nprimes=2):
+    """
+    Returns (start, stop) : prime_with_bitlength draws the primes of bit length l for a modulus of nprimes primes among the odd numbers of [start, stop).
+    """
+    start=integer_root(pow(2,nprimes*l-1),nprimes)//2*2+1     # we want primes larger than start and only odd numbers (hence the +1) multiply by the nprimes-th root of 2 to make sure the public key is of the expected length. For two primes it is int(2^(l-2)*sqrt(2))*2+1 (computed exactly, a float overflows above 1024 bits), we make sure the number is odd
+    stop=pow(2,l)                       # but smaller than stop
+    return(start, stop)
+
+# END prime_range FUNCTION
+
 # START prime_with_bitlength FUNCTION
 
-def prime_with_bitlength(l):
+def prime_with_bitlength(l, generator=random, attempts=None, nprimes=2):
     """
     Will return a random prime of bit length l
     This function implements a monte carlo method of finding prime numbers by choosing random numbers until it has found a prime.
 
     The range of value is adjusted so that multiplying two primes of length l procudes a number of length 2l.
+    For a multi-prime key, nprimes is the number of primes of the modulus : the primes are at least 2^(l-1/nprimes) so the product of nprimes primes is never one bit short.
+
+    The candidates are filtered before running the Miller-Rabin test :
+            - for large ranges, a window of odd numbers starting at a random point is sieved with the SMALL_PRIMES and only the survivors are tested (the next window is drawn if there is no prime in the window)
+            - for small ranges and primes below PRIME_TABLE_LIMIT, random odd numbers are checked with trial division by the SMALL_PRIMES : every prime of the range can be drawn (the first prime of a window can't be one of the last primes of a short range), see max_nprimes
+
+    The random numbers are drawn from generator (the random module, or a random.Random object to get an independent stream).
+    If attempts is set, the search gives up and returns None after attempts windows (or as many odd numbers for small ranges), see race_primes.
+
+    When the instrumentation is enabled, the numbers tried, the Miller-Rabin tests and rounds needed for the prime are recorded (see tinyRSA_metrics).
     """
     # Input check
     if not (isinstance(l, int) and l>=2):
         raise ValueError("Invalid bitlength, it should be an integer strickly greater than 1")
+    if not (isinstance(nprimes, int) and nprimes>=2):
+        raise ValueError("Invalid number of primes, it should be an integer greater than 1")
 
-    count_passes=0
-    start=int(pow(2,l-2)*(2**0.5))*2+1    # we want primes larger than start and only odd numbers (hence the +1) multiply by sqrt to make sure the public key is of the expected length. By doing int(2^(l-2)*sqrt(2))*2+1, we make sure the number is odd
-    stop=pow(2,l)                       # but smaller than stop
-    p=start
-    while not is_prime_fast(p):
-        p=random.randrange(start, stop, 2)  # because primes greater than 2 are odd, we only check for odd numbers (hence step=2)
-                                            # think about optimizing this part (6k+-1)?
-        count_passes+=1
-    return(p)
+    count_passes=0                      # number of Miller-Rabin tests performed
+    count_candidates=0                  # number of odd numbers tried
+    rounds=[0] if RSAmetrics.enabled else None  # number of Miller-Rabin rounds performed
+    start,stop=prime_range(l, nprimes)  # odd numbers large enough for the public key to have the expected length
+    window=max(64, 2*l)                 # number of odd candidates sieved at once, the average gap between primes of length l is about 0.7*l
+    limit=None if attempts==None else attempts*window   # number of odd numbers tried before giving up
+    if stop<=SMALL_PRIMES[-1] and not any(start<=p<stop for p in SMALL_PRIMES):      # tiny range without any prime (large nprimes with a tiny bitlength)
+        raise ValueError("No prime of bitlength {} is large enough for a modulus of {} primes".format(l, nprimes))
+
+    if stop>PRIME_TABLE_LIMIT and stop-start>4*window:
+        while limit==None or count_candidates<limit:
+            base=generator.randrange(start, stop-2*window, 2)  # because start is odd, base is odd too
+            for p in sieve_window(base, window):
+                count_passes+=1
+                if is_prime_fast(p, rounds):
+                    count_candidates+=(p-base)//2+1
+                    record_prime(l, count_candidates, count_passes, rounds)
+                    return(p)
+            count_candidates+=window
+    else:
+        while limit==None or count_candidates<limit:
+            p=generator.randrange(start, stop, 2)  # because primes greater than 2 are odd, we only check for odd numbers (hence step=2)
+            count_candidates+=1
+            if passes_trial_division(p):
+                count_passes+=1
+                if is_prime_fast(p, rounds):
+                    record_prime(l, count_candidates, count_passes, rounds)
+                    return(p)
+    return(None)
 
 # END prime_with_bitlength FUNCTION
 
+# START prime_lengths FUNCTION
+
+def prime_lengths(bitlength, nprimes=2):
+    """
+    Returns the list of the bit lengths of the nprimes primes of a public key of 2*bitlength bits (bitlength each for two primes, the longest first).
+    """
+    return([(2*bitlength)//nprimes + (i < (2*bitlength)%nprimes) for i in range(nprimes)])
+
+# END prime_lengths FUNCTION
+
+# START count_primes FUNCTION
+
+prime_table = None                      # primes below PRIME_TABLE_LIMIT, sieved on the first call
+
+def count_primes(start, stop):
+    """
+    Returns the number of primes in [start, stop) : counted exactly below PRIME_TABLE_LIMIT, estimated with the prime number theorem (a slight underestimate) above.
+    """
+    global prime_table
+    if stop<=PRIME_TABLE_LIMIT:
+        if prime_table==None:
+            prime_table=small_primes(PRIME_TABLE_LIMIT)
+        return(bisect_left(prime_table, stop)-bisect_left(prime_table, start))
+    return(int((stop-start)/log(stop)))
+
+# END count_primes FUNCTION
+
+# START max_nprimes FUNCTION
+
+def max_nprimes(bitlength):
+    """
+    Returns the largest number of primes of a key with a public key of 2*bitlength bits that TinyRSA_key.create_new can generate (1 if there is none).
+    For each bit length of prime (see prime_lengths), the range of prime_with_bitlength has to hold as many distinct primes as the key needs,
+    otherwise the public key would be one bit short or the primes couldn't be distinct.
+    """
+    if not (isinstance(bitlength, int) and bitlength>=2):
+        raise ValueError("Invalid bitlength, it should be an integer strickly greater than 1")
+    best=1
+    for nprimes in range(2, bitlength+1):
+        lengths=prime_lengths(bitlength, nprimes)
+        if any(count_primes(*prime_range(l, nprimes))<lengths.count(l) for l in set(lengths)):
+            break
+        best=nprimes
+    return(best)
+
+# END max_nprimes FUNCTION
+
+# START record_prime FUNCTION
+
+def record_prime(l, candidates, tests, rounds):
+    """
+    Record the work needed to find a prime of bitlength l in the metrics (rounds is None when the instrumentation is disabled).
+    """
+    if rounds!=None:
+        RSAmetrics.increment("tinyrsa_primes_total", bitlength=l)
+        RSAmetrics.observe("tinyrsa_prime_candidates", candidates, RSAmetrics.COUNT_BUCKETS, bitlength=l)
+        RSAmetrics.observe("tinyrsa_prime_tests", tests, RSAmetrics.COUNT_BUCKETS, bitlength=l)
+        RSAmetrics.observe("tinyrsa_prime_rounds", rounds[0], RSAmetrics.COUNT_BUCKETS, bitlength=l)
+
+# END record_prime FUNCTION
+
+# START race_primes FUNCTION
+
+RACE_ATTEMPTS = 1       # windows searched by each task of race_primes, a window of odd numbers almost always contains a prime
+
+def _race_prime(l, seed, attempts, nprimes):
+    """
+    Task of race_primes : search a prime of bitlength l (for a modulus of nprimes primes) in attempts windows, with its own stream of random numbers (the processes forked from the same parent share the state of the random module).
+    This function is defined at the top level of the module so it can be sent to the processes of a pool.
+    """
+    return(prime_with_bitlength(l, random.Random(seed), attempts, nprimes))
+
+def race_primes(lengths, processes=None, pool=None, attempts=RACE_ATTEMPTS):
+    """
+    Returns a list of distinct primes, one of each bitlength of lengths (in the same order), searched at the same time on several processes.
+    They are drawn for a modulus made of all of them (see the nprimes argument of prime_with_bitlength).
+
+    The time to find a prime varies a lot from one search to another, so all the primes are searched at once by processes workers racing on independent streams of candidates :
+            - each task searches attempts windows (see prime_with_bitlength) and returns its prime, or None if it found nothing
+            - the first primes found are kept (a prime already found is ignored, so p!=q), the other tasks are replaced until every length has its prime
+            - the tasks still waiting are cancelled as soon as all the primes are found, the running ones end with their windows
+    Raises ValueError if the primes are still missing after 100 tasks per prime (there aren't enough distinct primes of these lengths).
+    processes is the number of processes to use (by default the number of cores), pool is an optional concurrent.futures.ProcessPoolExecutor to reuse (otherwise a new one is created for the call).
+    """
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait     # only imported when the parallel mode is used
+    lengths = list(lengths)
+    if processes==None:
+        processes = os.cpu_count() or 1
+    workers = max(processes, len(lengths))  # number of tasks kept running, at least one per prime
+    executor = pool if pool!=None else ProcessPoolExecutor(processes)
+    primes = [None]*len(lengths)
+    running = {}                            # future -> bitlength searched
+    budget = 100*len(lengths)               # number of tasks before giving up
+    try:
+        def submit():
+            # search for the missing length with the fewest tasks running
+            missing = [length for length, prime in zip(lengths, primes) if prime==None]
+            length = min(missing, key=lambda length: list(running.values()).count(length))
+            running[executor.submit(_race_prime, length, random.getrandbits(64), attempts, len(lengths))] = length
+
+        for i in range(workers):
+            submit()
+        while None in primes:
+            done, pending = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                length = running.pop(future)
+                prime = future.result()
+                if prime!=None and prime not in primes:
+                    for index, other in enumerate(lengths):
+                        if other==length and primes[index]==None:
+                            primes[index] = prime
+                            break
+            budget -= len(done)
+            if None in primes:
+                if budget<=0:
+                    raise ValueError("Couldn't find {} distinct primes, the bitlength is too small".format(len(lengths)))
+                while len(running)<workers:
+                    submit()
+    finally:
+        for future in running:              # cancel the losers
+            future.cancel()
+        if pool==None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    return(primes)
+
+# END race_primes FUNCTION
+
 # START gcd FUNCTION
 
 def gcd(a, b):
     """
-    Computes the gcd of a and b using the euclidian algorithm
+    Computes the gcd of a and b using the euclidian algorithm (done by the arithmetic backend)
     """
     if not (isinstance(a, int) and isinstance(b, int)):
         raise ValueError("Invalid input for gcd, should be two integers")
 
-    while b!=0:
-        a, b = b, a%b   # gcd(a, b) = gcd(b, a%b)
-                        # keep going until we reach a%b = 0 in which case gcd(a, b) = last remainder > 0
-    return(a)
+    return(RSAbackend.backend.gcd(a, b))
 
 # END gcd FUNCTION
 
@@ -143,7 +537,7 @@ def multiplicative_inverse(a, b):
     """
     This function computes the multiplicative inverse x of a mod b
             a*x=1 (mod b)
-    using the extended Euclidian algorithm
+    using the extended Euclidian algorithm (done by the arithmetic backend)
     For more information https://brilliant.org/wiki/extended-euclidean-algorithm/
 
     In the context of RSA this function is used with a = e (the exponent) and b = lambda(n) (Carmichael's totient function https://en.wikipedia.org/wiki/Carmichael_function) and e is chosen such that gcd(e, lambda(n)) = 1
@@ -153,21 +547,24 @@ def multiplicative_inverse(a, b):
         print("Invalid input for multiplicative inverse")
         raise SystemExit(1)
 
-    b2=b        # we need a trace of b to potentially rectify the last value of x
-    x, u = 0, 1 # initialize the sequence
-    while a!=0: # as long as we haven't reached the gcd (last value before remainder = 0)
-        q, r = b//a, b%a        # Euclidian division
-        m = x-u*q               # sequence of coefficient
-        b, a, x, u = a, r, u, m # Update the values for the next iteration
-    if not b==1:                # At this point if b is not 1 then there is no inverse, the inputs are not coprime and there is probably something wrong with the prime number generation step
+    try:
+        return(RSAbackend.backend.invert(a, b))
+    except ValueError:          # There is no inverse, the inputs are not coprime and there is probably something wrong with the prime number generation step
         print("Couldn't compute inverse, a and b are probably not coprime")
         raise SystemExit(1)
-    if x<0:
-        x+=b2   # rectify the value of x to have a positive number
-    return(x)
 
 # END multiplicative_inverse FUNCTION
 
+# START powmod FUNCTION
+
+def powmod(base, exponent, modulus):
+    """
+    Computes base^exponent mod modulus with the arithmetic backend, this is the operation behind the encryption and the decryption
+    """
+    return(RSAbackend.backend.powmod(base, exponent, modulus))
+
+# END powmod FUNCTION
+
 if __name__ == '__main__':
     print(multiplicative_inverse(17, 43))
     print(is_prime_fast(11990449251145931745564215483884623262016981102977135227921664818241599323747134700686216463266625884413310564264540932840138433670632832957894634174353833))
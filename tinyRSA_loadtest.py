@@ -0,0 +1,365 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the load test of the web app : it replays a trace of key creations, encryptions and decryptions against app.py
+# and reports the latency percentiles (p50, p95, p99) and the throughput of each route and bitlength.
+#
+# The trace is a JSON Lines file, one request per line :
+#       {"op": "keygen", "bitlength": 64}                                   (new key, "nprimes" is optional)
+#       {"op": "encrypt", "bitlength": 64, "size": 200}                     (encrypt a random text of 200 characters, or "text": "hello")
+#       {"op": "decrypt", "bitlength": 64, "size": 200, "items": 10}        (decrypt 10 cipher texts in one request of the JSON API)
+# Optional fields : "route" ("api" for the JSON API, by default, or "form" for the HTML pages) and "at" (time of the request in seconds from the start).
+# The keys and the cipher texts needed by the encryptions and decryptions are prepared before the replay and are not measured.
+#
+# The app is either run in this process with the Flask test client (with a temporary database) or reached over HTTP,
+# for example on a local gunicorn started by the load test itself (--serve) :
+#       python3 tinyRSA_loadtest.py generate trace.jsonl --count 2000 --bitlengths 32,256,512
+#       python3 tinyRSA_loadtest.py run trace.jsonl --concurrency 8 --rate 100
+#       python3 tinyRSA_loadtest.py run trace.jsonl --serve --workers 2 --concurrency 16 --output results.json
+#
+# The rate is open loop : each request is scheduled at a fixed time (from the rate or from "at") and its latency is measured from that time,
+# so a server that falls behind shows its queueing delay instead of slowing the load down (coordinated omission).
+#
+# List of functions :
+#       - generate_trace            (write a random trace)
+#       - read_trace                (read a trace file)
+#       - prepare                   (create the keys and cipher texts needed by the trace)
+#       - build_request             (turn a record of the trace into an HTTP request)
+#       - replay                    (send the requests of the trace and measure them)
+#       - summarize                 (compute the percentiles and throughput of each route and bitlength)
+#       - start_gunicorn            (start the app on a local gunicorn)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from tinyRSA_bench import percentile
+
+class InProcessClient():
+    """
+    Client sending the requests to the app in this process with the Flask test client, each thread gets its own test client.
+    The app is configured with a temporary database (or the given one), so rsa.db is never modified.
+    """
+
+    def __init__(self, database=None):
+        import app as web      # only imported for this client, the HTTP client doesn't need Flask
+        self.directory = None
+        if database==None:
+            self.directory = tempfile.TemporaryDirectory()
+            database = os.path.join(self.directory.name, "loadtest.db")
+        web.app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///" + os.path.abspath(database)
+        self.app = web.app
+        self.local = threading.local()
+
+    def request(self, method, path, json_body=None, form=None):
+        """
+        Send a request and return (status code, body as bytes).
+        """
+        if not hasattr(self.local, "client"):
+            self.local.client = self.app.test_client()
+        response = self.local.client.open(path, method=method, json=json_body, data=form)
+        return(response.status_code, response.get_data())
+
+    def close(self):
+        if self.directory!=None:
+            self.directory.cleanup()
+
+class HttpClient():
+    """
+    Client sending the requests over HTTP to a running app, for example http://127.0.0.1:8000.
+    """
+
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, method, path, json_body=None, form=None):
+        """
+        Send a request and return (status code, body as bytes), the HTTP errors are returned as well.
+        """
+        headers = {}
+        data = None
+        if json_body!=None:
+            data = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif form!=None:
+            data = urllib.parse.urlencode(form).encode("ascii")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        request = urllib.request.Request(self.url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return(response.status, response.read())
+        except urllib.error.HTTPError as error:
+            return(error.code, error.read())
+
+    def close(self):
+        pass
+
+# START generate_trace FUNCTION
+
+def generate_trace(path, count=1000, bitlengths=(32, 256, 512), mix=(("keygen", 1), ("encrypt", 5), ("decrypt", 4)), sizes=(16, 256, 4096), route="api", seed=2019):
+    """
+    Write a random trace of count requests to path : the operation is drawn with the weights of mix, the bitlength and the size of the text uniformly.
+    """
+    rng = random.Random(seed)
+    operations = [operation for operation, weight in mix for i in range(weight)]
+    with open(path, "w") as trace:
+        for i in range(count):
+            record = {"op": rng.choice(operations), "bitlength": rng.choice(bitlengths), "route": route}
+            if record["op"]!="keygen":
+                record["size"] = rng.choice(sizes)
+            trace.write(json.dumps(record) + "\n")
+
+# END generate_trace FUNCTION
+
+# START read_trace FUNCTION
+
+def read_trace(path):
+    """
+    Returns the list of the records of a trace file, raises ValueError on an invalid record.
+    """
+    records = []
+    with open(path) as trace:
+        for number, line in enumerate(trace, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise ValueError("Invalid JSON on line {} of the trace".format(number))
+            if not (isinstance(record, dict) and record.get("op") in ("keygen", "encrypt", "decrypt") and isinstance(record.get("bitlength"), int)):
+                raise ValueError("Invalid record on line {} of the trace, expected {{\"op\": keygen|encrypt|decrypt, \"bitlength\": int, ...}}".format(number))
+            records.append(record)
+    return(records)
+
+# END read_trace FUNCTION
+
+# START prepare FUNCTION
+
+def prepare(client, records, seed=2019):
+    """
+    Create one key for each bitlength used by the encryptions and decryptions of the trace, and the text (and the cipher text for a decryption) of each record.
+    Returns the dictionary (bitlength, nprimes) -> key id, the texts and the cipher texts are added to the records.
+    """
+    rng = random.Random(seed)
+    keys = {}
+    needed = sorted(set((record["bitlength"], record.get("nprimes", 2)) for record in records if record["op"]!="keygen"))
+    for bitlength, nprimes in needed:
+        status, body = client.request("POST", "/api/keys", {"bitlengths": [bitlength], "nprimes": nprimes})
+        if status!=200:
+            raise ValueError("Couldn't create a key of bitlength {} : {} {}".format(bitlength, status, body[:200]))
+        keys[(bitlength, nprimes)] = json.loads(body)["keys"][0]["id"]
+
+    decryptions = {}            # key id -> records to decrypt
+    for record in records:
+        if record["op"]=="keygen":
+            continue
+        if "text" not in record:
+            record["text"] = "".join(chr(32 + rng.randrange(95)) for i in range(record.get("size", 64)))
+        record["id"] = keys[(record["bitlength"], record.get("nprimes", 2))]
+        if record["op"]=="decrypt":
+            decryptions.setdefault(record["id"], []).append(record)
+    for id, group in decryptions.items():
+        for start in range(0, len(group), 1000):
+            batch = group[start:start+1000]
+            status, body = client.request("POST", "/api/encrypt", {"items": [{"id": id, "plain": record["text"]} for record in batch]})
+            if status!=200:
+                raise ValueError("Couldn't prepare the cipher texts : {} {}".format(status, body[:200]))
+            for record, result in zip(batch, json.loads(body)["results"]):
+                record["cipher"] = result["cipher"]
+    return(keys)
+
+# END prepare FUNCTION
+
+# START build_request FUNCTION
+
+def build_request(record):
+    """
+    Returns (route name, method, path, JSON body, form) for a prepared record of the trace.
+    """
+    items = record.get("items", 1)
+    nprimes = record.get("nprimes", 2)
+    if record.get("route", "api")=="form":
+        if record["op"]=="keygen":
+            return("POST /", "POST", "/", None, {"bitlength": str(record["bitlength"]), "nprimes": str(nprimes)})
+        if record["op"]=="encrypt":
+            return("POST /encrypt", "POST", "/encrypt/{}".format(record["id"]), None, {"plain": record["text"]})
+        return("POST /decrypt", "POST", "/decrypt/{}".format(record["id"]), None, {"cipher": record["cipher"]})
+    if record["op"]=="keygen":
+        return("POST /api/keys", "POST", "/api/keys", {"bitlengths": [record["bitlength"]]*items, "nprimes": nprimes}, None)
+    if record["op"]=="encrypt":
+        return("POST /api/encrypt", "POST", "/api/encrypt", {"items": [{"id": record["id"], "plain": record["text"]}]*items}, None)
+    return("POST /api/decrypt", "POST", "/api/decrypt", {"items": [{"id": record["id"], "cipher": record["cipher"]}]*items}, None)
+
+# END build_request FUNCTION
+
+# START replay FUNCTION
+
+def replay(client, records, concurrency=4, rate=None, speed=1.0):
+    """
+    Send the requests of the prepared records with concurrency threads and return the list of measurements (route, bitlength, status, latency in seconds) and the duration of the replay.
+    Each request is scheduled at record["at"]/speed seconds after the start if the records have a time, at i/rate seconds if rate is set, or as soon as a thread is free otherwise.
+    With a schedule, the latency is measured from the scheduled time (see the top of the file).
+    """
+    requests = [(record, build_request(record)) for record in records]
+    start = time.perf_counter() + 0.1
+
+    def schedule(index, record):
+        if "at" in record:
+            return(start + record["at"]/speed)
+        if rate:
+            return(start + index/rate)
+        return(None)
+
+    def send(index):
+        record, (route, method, path, json_body, form) = requests[index]
+        planned = schedule(index, record)
+        if planned!=None:
+            delay = planned - time.perf_counter()
+            if delay>0:
+                time.sleep(delay)
+        sent = time.perf_counter()
+        try:
+            status = client.request(method, path, json_body, form)[0]
+        except Exception:       # connection errors count as failed requests
+            status = 0
+        end = time.perf_counter()
+        return(route, record["bitlength"], status, end - (planned if planned!=None else sent))
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        measurements = list(pool.map(send, range(len(requests))))
+    return(measurements, time.perf_counter() - start)
+
+# END replay FUNCTION
+
+# START summarize FUNCTION
+
+def summarize(measurements, duration):
+    """
+    Returns a dictionary "route bitlength" -> {count, errors, rejected, throughput, p50, p95, p99, max} (latencies in seconds) plus the total.
+    The errors are the 5xx responses and the connection errors, the rejected requests are the 429 responses of a saturated app.
+    """
+    groups = {}
+    for route, bitlength, status, latency in measurements:
+        for name in ("{} {}".format(route, bitlength), "total"):
+            groups.setdefault(name, []).append((status, latency))
+    summary = {}
+    for name, values in groups.items():
+        latencies = [latency for status, latency in values]
+        summary[name] = {"count": len(values),
+                         "errors": sum(1 for status, latency in values if status==0 or status>=500),
+                         "rejected": sum(1 for status, latency in values if status==429),
+                         "throughput": len(values)/duration if duration else None,
+                         "p50": percentile(latencies, 0.5),
+                         "p95": percentile(latencies, 0.95),
+                         "p99": percentile(latencies, 0.99),
+                         "max": max(latencies)}
+    return(summary)
+
+# END summarize FUNCTION
+
+# START start_gunicorn FUNCTION
+
+def start_gunicorn(workers=2, threads=8, database=None):
+    """
+    Start the app on a local gunicorn (on a free port, with a temporary database unless database is set) and return (process, url, temporary directory).
+    """
+    with socket.socket() as probe:      # find a free port
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    directory = None
+    if database==None:
+        directory = tempfile.TemporaryDirectory()
+        database = os.path.join(directory.name, "loadtest.db")
+    environment = dict(os.environ, TINYRSA_DATABASE_URI="sqlite:///" + os.path.abspath(database))
+    process = subprocess.Popen([sys.executable, "-c", "from gunicorn.app.wsgiapp import run; run()", "app:app", "--bind", "127.0.0.1:{}".format(port),
+                                "--workers", str(workers), "--worker-class", "gthread", "--threads", str(threads)],
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=environment)
+    url = "http://127.0.0.1:{}".format(port)
+    for attempt in range(100):          # wait until the server answers
+        if process.poll()!=None:
+            raise ValueError("gunicorn stopped with code {}".format(process.returncode))
+        try:
+            urllib.request.urlopen(url + "/jobs", timeout=1).read()
+            return(process, url, directory)
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.1)
+    process.terminate()
+    raise ValueError("gunicorn didn't start")
+
+# END start_gunicorn FUNCTION
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a trace of requests against the TinyRSA web app")
+    commands = parser.add_subparsers(dest="command")
+    generate = commands.add_parser("generate", help="write a random trace")
+    generate.add_argument("trace")
+    generate.add_argument("--count", type=int, default=1000)
+    generate.add_argument("--bitlengths", default="32,256,512", help="comma separated bitlengths (of the primes, as in the app)")
+    generate.add_argument("--sizes", default="16,256,4096", help="comma separated sizes of the texts")
+    generate.add_argument("--mix", default="keygen=1,encrypt=5,decrypt=4", help="weights of the operations")
+    generate.add_argument("--route", choices=("api", "form"), default="api")
+    generate.add_argument("--seed", type=int, default=2019)
+    run = commands.add_parser("run", help="replay a trace")
+    run.add_argument("trace")
+    run.add_argument("--url", default=None, help="URL of a running app (by default the app is run in this process)")
+    run.add_argument("--serve", action="store_true", help="start the app on a local gunicorn for the test")
+    run.add_argument("--workers", type=int, default=2, help="gunicorn workers (with --serve)")
+    run.add_argument("--threads", type=int, default=8, help="threads per gunicorn worker (with --serve)")
+    run.add_argument("--database", default=None, help="SQLite database of the app (a temporary one by default)")
+    run.add_argument("--concurrency", type=int, default=4, help="number of requests in flight")
+    run.add_argument("--rate", type=float, default=None, help="requests per second (as fast as possible by default)")
+    run.add_argument("--speed", type=float, default=1.0, help="speed factor of the times of the trace")
+    run.add_argument("--seed", type=int, default=2019)
+    run.add_argument("--output", default=None, help="write the results to this JSON file")
+    options = parser.parse_args()
+
+    if options.command=="generate":
+        mix = [(name, int(weight)) for name, weight in (item.split("=") for item in options.mix.split(","))]
+        generate_trace(options.trace, options.count, [int(value) for value in options.bitlengths.split(",")], mix,
+                       [int(value) for value in options.sizes.split(",")], options.route, options.seed)
+    elif options.command=="run":
+        records = read_trace(options.trace)
+        server = None
+        if options.serve:
+            server, url, directory = start_gunicorn(options.workers, options.threads, options.database)
+            client = HttpClient(url)
+        elif options.url:
+            client = HttpClient(options.url)
+        else:
+            client = InProcessClient(options.database)
+        try:
+            prepare(client, records, options.seed)
+            measurements, duration = replay(client, records, options.concurrency, options.rate, options.speed)
+        finally:
+            client.close()
+            if server!=None:
+                server.terminate()
+                server.wait()
+                if directory!=None:
+                    directory.cleanup()
+        summary = summarize(measurements, duration)
+        print("{:<28} {:>7} {:>7} {:>9} {:>10} {:>10} {:>10} {:>10} {:>10}".format("route bitlength", "count", "errors", "rejected", "req/s", "p50 (ms)", "p95 (ms)", "p99 (ms)", "max (ms)"))
+        for name in sorted(summary, key=lambda name: (name=="total", name)):
+            values = summary[name]
+            print("{:<28} {:>7} {:>7} {:>9} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(name, values["count"], values["errors"], values["rejected"], values["throughput"],
+                  1000*values["p50"], 1000*values["p95"], 1000*values["p99"], 1000*values["max"]))
+        if options.output:
+            with open(options.output, "w") as output:
+                json.dump({"trace": options.trace, "concurrency": options.concurrency, "rate": options.rate, "duration": duration, "results": summary}, output, indent=2)
+    else:
+        parser.print_help()
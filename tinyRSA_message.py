@@ -7,11 +7,40 @@
 # This file contains the class to describe a message
 # It is intended to be used with the tinyRSA_key class to be encrypted and decrypted
 #
+# The blocks are handled as integers, the message is converted from bytes to integers with int.from_bytes and back with int.to_bytes
+# The number of blocks and the durations of the encryptions and decryptions are recorded by the instrumentation (see tinyRSA_metrics).
+# Textbook RSA is deterministic (a block always gives the same result), so the repeated blocks are only computed once and a TinyRSA_cache can keep the results across messages (see cached_blocks).
+# Keys of at most 32 bits use the vectorized engine of tinyRSA_vector when numpy is installed, it gives the same results.
+# The layout of the blocks is the following (bit_length being the length of the key) :
+#       - the plain text is split in blocks of bit_length-1 bits, which is the same as having blocks of bit_length with a leading zero
+#       - the last block is padded with zeros to the right to keep the message contiguous
+#       - each cipher block is bit_length bits long
+# The cipher texts are binary strings (string of 0 and 1) by default, they can also be written in the compact container of tinyRSA_wire
+# (as bytes, or as hexadecimal or base64 text) : every function decrypting a cipher text accepts all the formats.
+#
+# List of functions :
+#       - iter_blocks           (split a stream of bytes into integer blocks)
+#       - pack_blocks           (pack integer blocks into a stream of bytes)
+#       - blocks_to_bytes       (pack integer blocks into bytes)
+#       - bits_to_blocks        (split a binary string into integer blocks)
+#       - blocks_to_bits        (pack integer blocks into a binary string)
+#       - encode_cipher         (write cipher blocks in one of the formats of cipher texts)
+#       - cipher_to_blocks      (read the cipher blocks of a cipher text in any format)
+#       - iter_encrypt          (generator encrypting a binary file-like object block by block)
+#       - iter_decrypt          (generator decrypting a binary file-like object block by block)
+#       - encrypt_stream        (encrypt a binary file-like object into another one)
+#       - decrypt_stream        (decrypt a binary file-like object into another one)
+#       - map_blocks            (apply the public or private operation of a key to a list of blocks, possibly on several processes)
+#       - cached_blocks         (apply the operation to the blocks once per distinct block, with an optional cache of the results)
+#       - plain_to_bytes        (convert a plain text to bytes, one byte per character)
+#       - encrypt_batch         (encrypt a list of plain texts with the same key in one pass)
+#       - decrypt_batch         (decrypt a list of cipher texts with the same key in one pass)
+#
 # List of attributes :
 #       - plain                 (plain text)
-#       - plain_hex             (plain text in hex)
-#       - cipher                (cipher text)
-#       - key                   (key to encrypt/decrypt)
+#       - plain_bytes           (plain text as bytes, one byte per character)
+#       - cipher                (cipher text, binary string or container of tinyRSA_wire)
+#       - key                   (key to encrypt/decrypt, None until add_key is called)
 #
 # List of methods :
 #       - add_plain             (initialize the plain text)
@@ -20,8 +49,430 @@
 #       - encrypt               (encrypt the message)
 #       - decrypt               (decrypt the message)
 #       - display               (pretty display of the input)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+import os
+from functools import partial
+from itertools import islice
 
 from tinyRSA_key import TinyRSA_key as RSAkey
+import tinyRSA_vector as RSAvector
+import tinyRSA_wire as RSAwire
+import tinyRSA_metrics as RSAmetrics
+
+CHUNK_SIZE = 65536          # number of bytes read at once by the streaming functions
+PARALLEL_THRESHOLD = 256    # below this number of blocks the parallel mode falls back to serial
+CHUNKS_PER_PROCESS = 4      # number of chunks of blocks sent to each process, more chunks balance the load better but cost more communication
+
+# START iter_blocks FUNCTION
+
+def iter_blocks(chunks, block_bits, count=None):
+    """
+    Generator that splits a stream of bytes into integer blocks of block_bits bits.
+    chunks is an iterable of bytes-like objects (for example [b"hello"]), the bits are read from left to right (big endian).
+    The last block is padded with zeros to the right if the stream doesn't contain a whole number of blocks.
+    If count is set, stop after count blocks.
+
+    The bytes are consumed in pieces of about one block so the integers handled never grow larger than two blocks.
+    """
+    step = block_bits//8 + 1                # number of bytes read at once
+    mask = (1 << block_bits) - 1
+    acc, acc_bits, produced = 0, 0, 0       # bits read but not yet returned
+    for chunk in chunks:
+        view = memoryview(chunk)
+        for i in range(0, len(view), step):
+            piece = view[i:i+step]
+            acc = (acc << 8*len(piece)) | int.from_bytes(piece, "big")
+            acc_bits += 8*len(piece)
+            while acc_bits >= block_bits:   # return all the complete blocks
+                acc_bits -= block_bits
+                yield (acc >> acc_bits) & mask
+                acc &= (1 << acc_bits) - 1
+                produced += 1
+                if produced==count:
+                    return
+    if acc_bits and produced!=count:        # pad the last block to the right
+        yield acc << (block_bits - acc_bits)
+
+# END iter_blocks FUNCTION
+
+# START pack_blocks FUNCTION
+
+def pack_blocks(blocks, block_bits):
+    """
+    Generator that packs integer blocks of block_bits bits into a stream of bytes, this is the inverse of iter_blocks.
+    Each value returned is a bytes object with the bytes that are complete, the last byte is padded with zeros to the right.
+    """
+    acc, acc_bits = 0, 0                    # bits not yet returned
+    for block in blocks:
+        acc = (acc << block_bits) | block
+        acc_bits += block_bits
+        nbytes = acc_bits//8
+        if nbytes:                          # return the complete bytes
+            acc_bits -= 8*nbytes
+            yield (acc >> acc_bits).to_bytes(nbytes, "big")
+            acc &= (1 << acc_bits) - 1
+    if acc_bits:                            # pad the last byte to the right
+        yield (acc << (8 - acc_bits)).to_bytes(1, "big")
+
+# END pack_blocks FUNCTION
+
+# START blocks_to_bytes FUNCTION
+
+def blocks_to_bytes(blocks, block_bits):
+    """
+    Pack integer blocks of block_bits bits into a bytes object.
+    """
+    return(b"".join(pack_blocks(blocks, block_bits)))
+
+# END blocks_to_bytes FUNCTION
+
+# START bits_to_blocks FUNCTION
+
+def bits_to_blocks(bits, block_bits):
+    """
+    Split a binary string (string of 0 and 1) into integer blocks of block_bits bits, the last block is padded with zeros to the right.
+    Returns an iterator on the blocks.
+    """
+    if not bits:
+        return(iter(()))
+    count = -(-len(bits)//block_bits)       # number of blocks (rounded up)
+    nbytes = -(-len(bits)//8)               # number of bytes (rounded up)
+    data = (int(bits, 2) << (8*nbytes - len(bits))).to_bytes(nbytes, "big")
+    return(iter_blocks([data], block_bits, count))
+
+# END bits_to_blocks FUNCTION
+
+# START blocks_to_bits FUNCTION
+
+def blocks_to_bits(blocks, block_bits):
+    """
+    Pack integer blocks of block_bits bits into a binary string (string of 0 and 1).
+    """
+    blocks = list(blocks)
+    data = blocks_to_bytes(blocks, block_bits)
+    if not data:
+        return("")
+    return("{:0{}b}".format(int.from_bytes(data, "big"), 8*len(data))[:len(blocks)*block_bits])
+
+# END blocks_to_bits FUNCTION
+
+# START encode_cipher FUNCTION
+
+def encode_cipher(ciphers, bit_length, cipher_format="bits", key_id=0):
+    """
+    Write the cipher blocks of a key of bit_length bits in cipher_format :
+            - "bits" : binary string (string of 0 and 1), the original format
+            - "binary" : container of tinyRSA_wire (bytes), key_id is written in its header
+            - "hex" or "base64" : the same container as text, for the HTML forms and the JSON API
+    """
+    if cipher_format=="bits":
+        return(blocks_to_bits(ciphers, bit_length))
+    if cipher_format not in RSAwire.FORMATS:
+        raise ValueError("Unknown cipher format {}, choose one of {}.".format(cipher_format, ", ".join(RSAwire.FORMATS)))
+    data = RSAwire.encode_blocks(ciphers, bit_length, key_id)
+    if cipher_format=="binary":
+        return(data)
+    return(RSAwire.to_text(data, cipher_format))
+
+# END encode_cipher FUNCTION
+
+# START cipher_to_blocks FUNCTION
+
+def cipher_to_blocks(cipher, bit_length, key_id=0):
+    """
+    Returns the list of the cipher blocks of cipher, in any of the formats of encode_cipher (the format is detected).
+    Raises ValueError if cipher isn't a valid cipher text or if it has been encrypted with a key of another length,
+    or with another key than key_id when both key_id and the id in the header of the container are set.
+    """
+    cipher_format = RSAwire.detect_format(cipher)
+    if cipher_format=="bits":
+        try:
+            return(list(bits_to_blocks(cipher.strip(), bit_length)))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cipher text, expected a string of 0 and 1.")
+    data = cipher if cipher_format=="binary" else RSAwire.from_text(cipher)
+    header_id, width, count, view = RSAwire.read_header(data)
+    if key_id and header_id and key_id!=header_id:
+        raise ValueError("The cipher text was encrypted with the key {}.".format(header_id))
+    if width!=(bit_length+7)//8:
+        raise ValueError("The cipher text has blocks of {} bytes, it wasn't encrypted with a key of {} bits.".format(width, bit_length))
+    return(list(RSAwire.iter_blocks(data)))
+
+# END cipher_to_blocks FUNCTION
+
+# START iter_encrypt FUNCTION
+
+def iter_encrypt(key, infile, chunk_size=CHUNK_SIZE):
+    """
+    Generator that encrypts the content of a binary file-like object (anything with a read method returning bytes) with key.
+    The input is read chunk_size bytes at a time and the cipher text is returned as ascii encoded bytes of 0 and 1, piece by piece.
+    Joining all the pieces gives exactly the cipher attribute of a TinyRSA_message encrypting the same content, but the memory used doesn't depend on the size of the input.
+    """
+    bit_length = key.get_bitlength()
+    if bit_length==None:
+        raise ValueError("Couldn't encrypt, the key is empty.")
+
+    chunks = iter(lambda: infile.read(chunk_size), b"")     # read the input until the end
+    blocks = iter_blocks(chunks, bit_length-1)              # same layout as TinyRSA_message.encrypt
+    batch = max(1, 8*chunk_size//bit_length)                # number of blocks returned at once
+    while True:
+        ciphers = [key.public_operation(block) for block in islice(blocks, batch)]
+        if not ciphers:
+            return
+        yield "".join(["{:0{}b}".format(cipher, bit_length) for cipher in ciphers]).encode("ascii")
+
+# END iter_encrypt FUNCTION
+
+# START iter_decrypt FUNCTION
+
+def iter_decrypt(key, infile, chunk_size=CHUNK_SIZE, crt=True):
+    """
+    Generator that decrypts the content of a binary file-like object containing a cipher text (ascii encoded 0 and 1, as returned by iter_encrypt) with key.
+    The input is read chunk_size bytes at a time and the plain text is returned as bytes, piece by piece.
+    Joining all the pieces gives exactly the plain_bytes attribute of a TinyRSA_message decrypting the same cipher text.
+    """
+    bit_length = key.get_bitlength()
+    if bit_length==None:
+        raise ValueError("Couldn't decrypt, the key is empty.")
+
+    mask = (1 << (bit_length-1)) - 1        # remove the leading zero of each block (see TinyRSA_message.encrypt)
+
+    def cipher_blocks():
+        """
+        Split the input in blocks of bit_length characters, only the last one can be incomplete (it is padded by bits_to_blocks).
+        """
+        rest = b""
+        for chunk in iter(lambda: infile.read(chunk_size), b""):
+            rest += chunk
+            complete = len(rest) - len(rest)%bit_length
+            if complete:
+                try:
+                    yield from bits_to_blocks(rest[:complete].decode("ascii"), bit_length)
+                except (UnicodeDecodeError, ValueError):
+                    raise ValueError("Invalid cipher text, expected a string of 0 and 1.")
+                rest = rest[complete:]
+        if rest:
+            try:
+                yield from bits_to_blocks(rest.decode("ascii"), bit_length)
+            except (UnicodeDecodeError, ValueError):
+                raise ValueError("Invalid cipher text, expected a string of 0 and 1.")
+
+    plains = (key.private_operation(block, crt) & mask for block in cipher_blocks())
+    pieces = pack_blocks(plains, bit_length-1)
+    batch = max(1, chunk_size*8//bit_length)    # number of blocks returned at once
+    while True:
+        piece = b"".join(islice(pieces, batch))
+        if not piece:
+            return
+        yield piece
+
+# END iter_decrypt FUNCTION
+
+# START encrypt_stream FUNCTION
+
+def encrypt_stream(key, infile, outfile, chunk_size=CHUNK_SIZE):
+    """
+    Encrypt the content of the binary file-like object infile with key and write the cipher text to the binary file-like object outfile (see iter_encrypt).
+    Returns the number of bytes written.
+    """
+    written = 0
+    for piece in iter_encrypt(key, infile, chunk_size):
+        outfile.write(piece)
+        written += len(piece)
+    return(written)
+
+# END encrypt_stream FUNCTION
+
+# START decrypt_stream FUNCTION
+
+def decrypt_stream(key, infile, outfile, chunk_size=CHUNK_SIZE, crt=True):
+    """
+    Decrypt the cipher text in the binary file-like object infile with key and write the plain text to the binary file-like object outfile (see iter_decrypt).
+    Returns the number of bytes written.
+    """
+    written = 0
+    for piece in iter_decrypt(key, infile, chunk_size, crt):
+        outfile.write(piece)
+        written += len(piece)
+    return(written)
+
+# END decrypt_stream FUNCTION
+
+# START map_blocks FUNCTION
+
+def _apply_operation(key, private, crt, blocks):
+    """
+    Apply the public (private=False) or private (private=True) operation of key to each block of the list.
+    This function is defined at the top level of the module so it can be sent to the processes of a pool.
+    """
+    if private:
+        return([key.private_operation(block, crt) for block in blocks])
+    else:
+        return([key.public_operation(block) for block in blocks])
+
+def map_blocks(key, blocks, private=False, crt=True, processes=None, threshold=PARALLEL_THRESHOLD, pool=None):
+    """
+    Apply the public (private=False) or private (private=True) operation of key to each block and return the list of results, in the same order.
+
+    Every block is an independent modular exponentiation so they can be computed on several processes :
+            - processes is the number of processes to use (by default the number of cores), 1 means serial
+            - below threshold blocks the computation stays serial because starting the processes costs more than it saves
+            - pool is an optional concurrent.futures.ProcessPoolExecutor to reuse (otherwise a new one is created for the call)
+    The blocks are split in CHUNKS_PER_PROCESS chunks per process so each process receives a few large tasks instead of many small ones.
+    """
+    blocks = list(blocks)
+    if processes==None:
+        processes = os.cpu_count() or 1
+    if processes<=1 or len(blocks)<threshold:   # serial mode
+        return(_apply_operation(key, private, crt, blocks))
+
+    size = -(-len(blocks)//(processes*CHUNKS_PER_PROCESS))     # size of the chunks (rounded up)
+    chunks = [blocks[i:i+size] for i in range(0, len(blocks), size)]
+    operation = partial(_apply_operation, key, private, crt)
+    if pool==None:
+        from concurrent.futures import ProcessPoolExecutor     # only imported when the parallel mode is used
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(operation, chunks))
+    else:
+        results = list(pool.map(operation, chunks))
+    return([result for chunk in results for result in chunk])  # pool.map keeps the order of the chunks
+
+# END map_blocks FUNCTION
+
+# START cached_blocks FUNCTION
+
+def cached_blocks(key, blocks, private=False, crt=True, parallel=False, processes=None, cache=None):
+    """
+    Apply the public (private=False) or private (private=True) operation of key to each block and return the list of results, in the same order.
+    Without cache every block is computed (with map_blocks if parallel is True).
+
+    With cache, a TinyRSA_cache dedicated to key, each distinct block is only computed once :
+            - a block repeated in the list is looked up once
+            - a block computed before with the same cache (by another message) is taken from the cache
+            - the new results are added to the cache, the least recently used ones are evicted when it is full
+    The cache maps (private, block) to the result, so one cache holds both directions. The blocks found without computing are counted in the metrics (tinyrsa_block_cache_total).
+    The vectorized engine of the tiny keys doesn't go through here, it is faster than the lookups.
+    """
+    if cache==None:
+        if parallel:
+            return(map_blocks(key, blocks, private, crt, processes))
+        return(_apply_operation(key, private, crt, blocks))
+
+    blocks = list(blocks)
+    results = {}                # block -> result, for the distinct blocks
+    missing = []                # distinct blocks not in the cache
+    for block in blocks:
+        if block not in results:
+            result = cache.get((private, block))
+            results[block] = result
+            if result==None:
+                missing.append(block)
+    if parallel:
+        computed = map_blocks(key, missing, private, crt, processes)
+    else:
+        computed = _apply_operation(key, private, crt, missing)
+    for block, result in zip(missing, computed):
+        results[block] = result
+        cache.put((private, block), result)
+    RSAmetrics.increment("tinyrsa_block_cache_total", len(blocks)-len(missing), result="hit")
+    RSAmetrics.increment("tinyrsa_block_cache_total", len(missing), result="miss")
+    return([results[block] for block in blocks])
+
+# END cached_blocks FUNCTION
+
+# START plain_to_bytes FUNCTION
+
+def plain_to_bytes(plain):
+    """
+    Convert a plain text to bytes, one byte per character (latin-1).
+    Raises ValueError if a character is outside of latin-1, it couldn't be given back by the decryption.
+    """
+    try:
+        return(str(plain).encode("latin-1"))
+    except UnicodeEncodeError as error:
+        raise ValueError("Invalid plain text, the character {!r} at position {} can't be encrypted (only latin-1 characters are supported)".format(error.object[error.start], error.start))
+
+# END plain_to_bytes FUNCTION
+
+# START encrypt_batch FUNCTION
+
+def encrypt_batch(key, plains, parallel=False, processes=None, vector=True, cipher_format="bits", key_id=0, cache=None):
+    """
+    Encrypt a list of plain texts with the same key and return the list of cipher texts, exactly as encrypting each one with a TinyRSA_message.
+    The blocks of all the messages go through the key in a single pass (see map_blocks for parallel and processes), which saves the overhead of handling each message separately.
+    With vector, the long messages of a tiny key go through the vectorized engine instead (see tinyRSA_vector).
+    The cipher texts are written in cipher_format, with key_id in the header of the containers (see encode_cipher).
+    With cache (a TinyRSA_cache dedicated to key), the repeated blocks are only encrypted once (see cached_blocks).
+    Raises ValueError if a plain text has characters outside of latin-1 (see plain_to_bytes).
+    """
+    bit_length = key.get_bitlength()
+    if bit_length==None:
+        raise ValueError("Couldn't encrypt, the key is empty.")
+
+    plains = [plain_to_bytes(plain) for plain in plains]
+    count = sum(-(-8*len(plain)//(bit_length-1)) for plain in plains)  # number of blocks
+    RSAmetrics.increment("tinyrsa_blocks_total", count, operation="encrypt")
+    with RSAmetrics.timer("tinyrsa_encrypt_seconds", bitlength=bit_length):
+        if vector and not parallel and cipher_format=="bits" and RSAvector.usable(key, count):
+            return([RSAvector.encrypt_bytes(key, plain) for plain in plains])
+
+        counts, blocks = [], []     # number of blocks of each message and blocks of all the messages
+        for plain in plains:
+            message_blocks = list(iter_blocks([plain], bit_length-1))
+            counts.append(len(message_blocks))
+            blocks.extend(message_blocks)
+
+        ciphers = cached_blocks(key, blocks, parallel=parallel, processes=processes, cache=cache)
+
+        results, start = [], 0      # split the result back into messages
+        for count in counts:
+            results.append(encode_cipher(ciphers[start:start+count], bit_length, cipher_format, key_id))
+            start += count
+        return(results)
+
+# END encrypt_batch FUNCTION
+
+# START decrypt_batch FUNCTION
+
+def decrypt_batch(key, ciphers, crt=True, parallel=False, processes=None, vector=True, key_id=0, cache=None):
+    """
+    Decrypt a list of cipher texts (in any of the formats of encode_cipher) with the same key and return the list of plain texts, exactly as decrypting each one with a TinyRSA_message.
+    The blocks of all the messages go through the key in a single pass (see map_blocks for parallel and processes).
+    With vector, the long binary strings of a tiny key go through the vectorized engine instead (see tinyRSA_vector).
+    With cache (a TinyRSA_cache dedicated to key), the repeated blocks are only decrypted once (see cached_blocks).
+    Raises ValueError if one of the cipher texts isn't valid (key_id is checked against the containers, see cipher_to_blocks).
+    """
+    bit_length = key.get_bitlength()
+    if bit_length==None:
+        raise ValueError("Couldn't decrypt, the key is empty.")
+
+    ciphers = [cipher.strip() if isinstance(cipher, str) else cipher for cipher in ciphers]     # spaces and end of lines around the text are ignored
+    with RSAmetrics.timer("tinyrsa_decrypt_seconds", bitlength=bit_length):
+        strings = all(isinstance(cipher, str) and RSAwire.detect_format(cipher)=="bits" for cipher in ciphers)
+        count = sum(-(-len(cipher)//bit_length) for cipher in ciphers) if strings else None     # number of blocks
+        if vector and not parallel and strings and RSAvector.usable(key, count):
+            RSAmetrics.increment("tinyrsa_blocks_total", count, operation="decrypt")
+            return([RSAvector.decrypt_bits(key, cipher).decode("latin-1") for cipher in ciphers])
+
+        counts, blocks = [], []
+        for cipher in ciphers:
+            message_blocks = cipher_to_blocks(cipher, bit_length, key_id)
+            counts.append(len(message_blocks))
+            blocks.extend(message_blocks)
+        RSAmetrics.increment("tinyrsa_blocks_total", len(blocks), operation="decrypt")
+
+        plains = cached_blocks(key, blocks, True, crt, parallel, processes, cache)
+
+        mask = (1 << (bit_length-1)) - 1    # remove the leading zero of each block (see TinyRSA_message.encrypt)
+        results, start = [], 0
+        for count in counts:
+            results.append(blocks_to_bytes([plain & mask for plain in plains[start:start+count]], bit_length-1).decode("latin-1"))
+            start += count
+        return(results)
+
+# END decrypt_batch FUNCTION
 
 class TinyRSA_message():
     """
@@ -34,18 +485,19 @@ class TinyRSA_message():
         The constructor is just to create the class attributes, the plain or cipher texts and the key have to be added with the add_plain, add_cipher and add_key methods.
         """
         self.plain = None
-        self.plain_bin = None   # useful ?
+        self.plain_bytes = None
         self.cipher = None
-        self.key = RSAkey()     # creates an empty RSA key
+        self.key = None         # no key until add_key is called
 
     def display(self, show_key=False):
         """
         This method displays the attributes of the class
         """
         print("plain text = {}\n".format(self.plain))
-        print("plain bin = {}\n".format(self.plain_bin))
+        print("plain bytes = {}\n".format(self.plain_bytes))
         print("cipher text = {}\n".format(self.cipher))
-        self.key.display()
+        if self.key!=None:
+            self.key.display()
         print("")
 
     def add_plain(self, plain):
@@ -58,19 +510,26 @@ class TinyRSA_message():
         except:
             raise ValueError("Invalid input for add_plain. Couldn't convert message to str.")
 
+        self.plain_bytes = plain_to_bytes(plain)    # one byte per character, raises ValueError for the characters outside of latin-1
         self.plain = plain          # set the plain text
-        self.plain_bin = ''.join('{:08b}'.format(ord(c)) for c in self.plain)   # convert the ascii in binary
 
     def add_cipher(self, cipher):
         """
         This method allows to add a cipher text from a binary string (string of 0 and 1)
+        or from a container of tinyRSA_wire (bytes, or hexadecimal or base64 text)
         This cipher text is intended to be decrypted
         """
-        try:                        # make sure the cipher input is a valid binary string
-            int(cipher, 2)
+        try:                        # make sure the cipher input is a valid binary string or container
+            cipher_format = RSAwire.detect_format(cipher)
+            if cipher_format=="bits":
+                int(cipher, 2)
+            elif cipher_format=="binary":
+                RSAwire.read_header(cipher)
+            else:
+                RSAwire.from_text(cipher)
         except:
-            raise ValueError("Invalut input for add_cipher, expected a string of 0 and 1 (example '0110100001100101011011000110110001101111' for hello).")
-        self.cipher = cipher        # set the attribute
+            raise ValueError("Invalut input for add_cipher, expected a string of 0 and 1 (example '0110100001100101011011000110110001101111' for hello) or a cipher container.")
+        self.cipher = cipher.strip() if isinstance(cipher, str) else cipher    # set the attribute (without the spaces and end of lines around the text)
 
     def add_key(self, key):
         """
@@ -81,49 +540,68 @@ class TinyRSA_message():
             raise ValueError("Invalid input for add_key, expected a TinyRSA_key object.")
         self.key = key                      # set the attribute
 
-    def encrypt(self):
+    def encrypt(self, parallel=False, processes=None, vector=True, cipher_format="bits", key_id=0, cache=None):
         """
         This method will encrypt the plain text with the key and put the result in he cipher attribute.
+        The cipher text is a binary string, or a container of tinyRSA_wire for the other values of cipher_format (see encode_cipher).
+
+        If parallel is True the blocks are encrypted on several processes (see map_blocks), processes is the number of processes (by default the number of cores).
+        If vector is True and the key is at most 32 bits long, the blocks are encrypted all at once with numpy (see tinyRSA_vector), when it is installed.
+        If cache is a TinyRSA_cache dedicated to the key, the repeated blocks are only encrypted once, even across messages (see cached_blocks).
         """
-        bit_length = self.key.get_bitlength()   # get the bitlength of the key
+        bit_length = self.key.get_bitlength() if self.key!=None else None  # get the bitlength of the key
         if bit_length==None:                    # if it is None then the key is not set
             print("Couldn't encrypt, the key is empty.")
-        else:
-            blocks = ['0'+self.plain_bin[i:i+bit_length-1] for i in range(0, len(self.plain_bin), bit_length-1)]    # split the message in blocks of size bit_length with a leading zero to make sure the value of the block is smaller than the value of the key
-            blocks[-1] = blocks[-1] + '0'*(bit_length-len(blocks[-1]))    # pad the message to have only blocks of length bit_length. We need to pad to the right to keep the message contiguous
+            return
+        count = -(-8*len(self.plain_bytes)//(bit_length-1))     # number of blocks
+        RSAmetrics.increment("tinyrsa_blocks_total", count, operation="encrypt")
+        with RSAmetrics.timer("tinyrsa_encrypt_seconds", bitlength=bit_length):
+            if vector and not parallel and cipher_format=="bits" and RSAvector.usable(self.key, count):
+                self.cipher = RSAvector.encrypt_bytes(self.key, self.plain_bytes)
+                return
 
-            # this next line executes the encryption on each block in multiple steps :
-            #           convert binary to an integer
-            #           perform the modular exponentiation
-            #           format the result in binary
-            #           pad with leading zeros up to bit_length
-            self.cipher = ''.join(["{:b}".format(pow(int(blocks[i], 2), self.key.e, self.key.n)).zfill(bit_length) for i in range(len(blocks))])
+            # split the message in blocks of bit_length-1 bits, which is the same as adding a leading zero to blocks of bit_length bits
+            # this makes sure the value of the block is smaller than the value of the key
+            # the last block is padded to the right to keep the message contiguous
+            blocks = iter_blocks([self.plain_bytes], bit_length-1)
 
-    def decrypt(self):
+            # encrypt each block and pack the results in blocks of bit_length bits
+            ciphers = cached_blocks(self.key, blocks, parallel=parallel, processes=processes, cache=cache)
+            self.cipher = encode_cipher(ciphers, bit_length, cipher_format, key_id)
+
+    def decrypt(self, crt=True, parallel=False, processes=None, vector=True, cache=None):
         """
-        This method will decrypt the cipher text with the key and put the result in he plain_bin attribute then update the plain
+        This method will decrypt the cipher text with the key and put the result in he plain_bytes attribute then update the plain
+        The cipher text can be in any of the formats of encode_cipher.
+
+        If crt is True the private key operation uses the Chinese Remainder Theorem parameters of the key (faster), otherwise it does the plain pow(c, d, n).
+        Both paths give the same result.
+
+        If parallel is True the blocks are decrypted on several processes (see map_blocks), processes is the number of processes (by default the number of cores).
+        If vector is True and the key is at most 32 bits long, the blocks are decrypted all at once with numpy (see tinyRSA_vector), when it is installed.
+        If cache is a TinyRSA_cache dedicated to the key, the repeated blocks are only decrypted once, even across messages (see cached_blocks).
         """
-        bit_length = self.key.get_bitlength()   # get the bitlength of the key
+        bit_length = self.key.get_bitlength() if self.key!=None else None  # get the bitlength of the key
         if bit_length==None:                    # if it is None then the key is not set
             print("Couldn't decrypt, the key is empty.")
-        else:
-            blocks = [self.cipher[i:i+bit_length] for i in range(0, len(self.cipher), bit_length)]    # split the cipher in blocks of size bit_length
-            blocks[-1] = blocks[-1] + '0'*(bit_length-len(blocks[-1]))  # pad the cipher to have only blocks of length bit_length
-
-            # this next line executes the decryption on each block in multiple steps :
-            #           convert binary to an integer
-            #           perform the modular exponentiation
-            #           format the result in binary
-            #           pad with leading zeros up to bit_length
-            #           remove one leading zero to go back to the true plaintext (see encrypt method)
-            self.plain_bin = ''.join(["{:b}".format(pow(int(blocks[i], 2), self.key.d, self.key.n)).zfill(bit_length)[1:] for i in range(len(blocks))])
-
-            # update the value of the plain text by converting the decrypted binary back to ascii
-            #           split the binary in blocks of 8 bits (for each aschii character)
-            #           convert each 8 bits block into its corresponding ascii character
-            plains = [self.plain_bin[i:i+8] for i in range(0, len(self.plain_bin), 8)]
-            plains[-1] = plains[-1] + '0'*(8-len(plains[-1]))
-            self.plain = ''.join([chr(int(plains[i], 2)) for i in range(len(plains))])
+            return
+        with RSAmetrics.timer("tinyrsa_decrypt_seconds", bitlength=bit_length):
+            bits = RSAwire.detect_format(self.cipher)=="bits"
+            count = -(-len(self.cipher)//bit_length) if bits else None     # number of blocks
+            if vector and not parallel and bits and RSAvector.usable(self.key, count):
+                RSAmetrics.increment("tinyrsa_blocks_total", count, operation="decrypt")
+                self.plain_bytes = RSAvector.decrypt_bits(self.key, self.cipher)
+            else:
+                blocks = cipher_to_blocks(self.cipher, bit_length)    # split the cipher in blocks of bit_length bits
+                RSAmetrics.increment("tinyrsa_blocks_total", len(blocks), operation="decrypt")
+                mask = (1 << (bit_length-1)) - 1                    # remove the leading zero to go back to the true plain text (see encrypt method)
+
+                # decrypt each block and pack the results in blocks of bit_length-1 bits
+                plains = [plain & mask for plain in cached_blocks(self.key, blocks, True, crt, parallel, processes, cache)]
+                self.plain_bytes = blocks_to_bytes(plains, bit_length-1)
+
+        # update the value of the plain text by converting each byte back to its character
+        self.plain = self.plain_bytes.decode("latin-1")
 
 if __name__ == "__main__":
     # Define a message object
@@ -0,0 +1,286 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the instrumentation of TinyRSA : counters, gauges and histograms recorded by the hot paths of the library
+#       - tinyrsa_prime_candidates, tinyrsa_prime_tests, tinyrsa_prime_rounds   (per prime : numbers tried, Miller-Rabin tests and rounds, by bitlength)
+#       - tinyrsa_keygen_seconds, tinyrsa_encrypt_seconds, tinyrsa_decrypt_seconds   (durations by bitlength of the key)
+#       - tinyrsa_blocks_total                                                  (number of blocks encrypted and decrypted)
+#       - tinyrsa_block_cache_total                                             (blocks found in the cache of the blocks or computed, by result hit or miss)
+# The app adds the durations of the requests and of the database queries and exports everything on /metrics.
+#
+# The instrumentation is disabled by default (or enabled with the environment variable TINYRSA_METRICS=1) :
+# when it is disabled every call returns right after checking the enabled flag, so it is close to free.
+#
+# Library users can record the metrics of a block of code with the context manager collect :
+#       with RSAmetrics.collect() as registry:
+#           key.create_new(512)
+#       print(registry.render())
+#
+# List of functions :
+#       - enable                    (start recording)
+#       - disable                   (stop recording)
+#       - increment                 (add to a counter)
+#       - set_gauge                 (set the value of a gauge)
+#       - observe                   (add a value to a histogram)
+#       - timer                     (context manager adding its duration to a histogram)
+#       - collect                   (context manager recording into a new registry)
+#       - render                    (the metrics in the Prometheus text format)
+#
+# List of methods of TinyRSA_registry :
+#       - __init__          (constructor of the class)
+#       - increment         (add to a counter)
+#       - set_gauge         (set the value of a gauge)
+#       - observe           (add a value to a histogram)
+#       - snapshot          (copy of all the values, can be sent to another process)
+#       - merge             (add the values of a snapshot)
+#       - reset             (remove all the values)
+#       - render            (the metrics in the Prometheus text format)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+INFINITY = float("inf")
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, INFINITY)    # seconds
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, INFINITY)
+
+class TinyRSA_registry():
+    """
+    This class stores the values of the metrics, each metric being identified by its name and its labels.
+    """
+
+    def __init__(self):
+        """
+        The constructor creates an empty registry.
+        """
+        self.counters = {}      # (name, labels) -> value
+        self.gauges = {}        # (name, labels) -> value
+        self.histograms = {}    # (name, labels) -> [buckets, count of each bucket, sum, count]
+        self.lock = threading.Lock()
+
+    def increment(self, name, value=1, labels=()):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def set_gauge(self, name, value, labels=()):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, labels=()):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram==None:
+                histogram = self.histograms[(name, labels)] = [buckets, [0]*len(buckets), 0, 0]
+            for i, bound in enumerate(histogram[0]):
+                if value<=bound:
+                    histogram[1][i] += 1
+                    break
+            histogram[2] += value
+            histogram[3] += 1
+
+    def snapshot(self):
+        """
+        This method returns a copy of all the values as a dictionary of plain types (it can be pickled and sent to another process).
+        """
+        with self.lock:
+            return({"counters": dict(self.counters),
+                    "gauges": dict(self.gauges),
+                    "histograms": {key: [histogram[0], list(histogram[1]), histogram[2], histogram[3]] for key, histogram in self.histograms.items()}})
+
+    def merge(self, snapshot):
+        """
+        This method adds the values of a snapshot to the registry (the gauges are replaced), it gathers the metrics recorded by other processes.
+        """
+        with self.lock:
+            for key, value in snapshot["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.gauges.update(snapshot["gauges"])
+            for key, (buckets, counts, total, count) in snapshot["histograms"].items():
+                histogram = self.histograms.get(key)
+                if histogram==None:
+                    self.histograms[key] = [buckets, list(counts), total, count]
+                else:
+                    histogram[1] = [a+b for a, b in zip(histogram[1], counts)]
+                    histogram[2] += total
+                    histogram[3] += count
+
+    def reset(self):
+        """
+        This method removes all the values.
+        """
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """
+        This method returns the metrics in the Prometheus text format (version 0.0.4), the histograms have cumulative buckets.
+        """
+        def format_labels(labels, extra=()):
+            labels = tuple(labels) + tuple(extra)
+            if not labels:
+                return("")
+            return("{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels) + "}")
+
+        def format_value(value):
+            if value==INFINITY:
+                return("+Inf")
+            return(repr(float(value)) if isinstance(value, float) else str(value))
+
+        snapshot = self.snapshot()
+        lines = []
+        for kind, values in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            for name in sorted(set(name for name, labels in values)):
+                lines.append("# TYPE {} {}".format(name, kind))
+                for (other, labels), value in sorted(values.items(), key=lambda item: str(item[0])):
+                    if other==name:
+                        lines.append("{}{} {}".format(name, format_labels(labels), format_value(value)))
+        histograms = snapshot["histograms"]
+        for name in sorted(set(name for name, labels in histograms)):
+            lines.append("# TYPE {} histogram".format(name))
+            for (other, labels), (buckets, counts, total, count) in sorted(histograms.items(), key=lambda item: str(item[0])):
+                if other==name:
+                    cumulative = 0
+                    for bound, bucket in zip(buckets, counts):
+                        cumulative += bucket
+                        lines.append("{}_bucket{} {}".format(name, format_labels(labels, [("le", format_value(bound))]), cumulative))
+                    lines.append("{}_sum{} {}".format(name, format_labels(labels), format_value(total)))
+                    lines.append("{}_count{} {}".format(name, format_labels(labels), count))
+        return("\n".join(lines) + "\n")
+
+enabled = os.environ.get("TINYRSA_METRICS", "0") not in ("", "0")
+registry = TinyRSA_registry()       # registry used by the library
+
+# START enable FUNCTION
+
+def enable():
+    """
+    Start recording the metrics in the registry.
+    """
+    global enabled
+    enabled = True
+
+# END enable FUNCTION
+
+# START disable FUNCTION
+
+def disable():
+    """
+    Stop recording the metrics (the values already recorded are kept).
+    """
+    global enabled
+    enabled = False
+
+# END disable FUNCTION
+
+# START increment FUNCTION
+
+def increment(name, value=1, **labels):
+    """
+    Add value to the counter name with the given labels (for example increment("tinyrsa_blocks_total", 10, operation="encrypt")).
+    """
+    if enabled:
+        registry.increment(name, value, tuple(sorted(labels.items())))
+
+# END increment FUNCTION
+
+# START set_gauge FUNCTION
+
+def set_gauge(name, value, **labels):
+    """
+    Set the gauge name with the given labels to value.
+    """
+    if enabled:
+        registry.set_gauge(name, value, tuple(sorted(labels.items())))
+
+# END set_gauge FUNCTION
+
+# START observe FUNCTION
+
+def observe(name, value, buckets=TIME_BUCKETS, **labels):
+    """
+    Add value to the histogram name with the given labels, buckets are the upper bounds of the buckets (fixed by the first value observed).
+    """
+    if enabled:
+        registry.observe(name, value, buckets, tuple(sorted(labels.items())))
+
+# END observe FUNCTION
+
+# START timer FUNCTION
+
+class _Timer():
+    """
+    Context manager adding the time spent inside it to a histogram.
+    """
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return(self)
+
+    def __exit__(self, *exception):
+        registry.observe(self.name, time.perf_counter()-self.start, TIME_BUCKETS, self.labels)
+        return(False)
+
+class _NullTimer():
+    """
+    Context manager doing nothing, used when the instrumentation is disabled.
+    """
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exception):
+        return(False)
+
+NULL_TIMER = _NullTimer()
+
+def timer(name, **labels):
+    """
+    Returns a context manager adding the time spent inside it (in seconds) to the histogram name with the given labels.
+            with RSAmetrics.timer("tinyrsa_keygen_seconds", bitlength=512):
+                ...
+    """
+    if not enabled:
+        return(NULL_TIMER)
+    return(_Timer(name, tuple(sorted(labels.items()))))
+
+# END timer FUNCTION
+
+# START collect FUNCTION
+
+@contextmanager
+def collect():
+    """
+    Context manager recording the metrics into a new registry, which is returned by the with statement.
+    The instrumentation is enabled inside the block, the previous registry and state are restored at the end.
+    The registry is global, so the metrics recorded by the other threads during the block are collected as well.
+    """
+    global enabled, registry
+    previous = (enabled, registry)
+    registry = TinyRSA_registry()
+    enabled = True
+    try:
+        yield registry
+    finally:
+        enabled, registry = previous
+
+# END collect FUNCTION
+
+# START render FUNCTION
+
+def render():
+    """
+    Returns the metrics of the registry in the Prometheus text format.
+    """
+    return(registry.render())
+
+# END render FUNCTION
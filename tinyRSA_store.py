@@ -0,0 +1,246 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the storage format of the keys in the SQLite database (table RSA_scheme of rsa.db)
+# Every integer of the key is stored as a big endian BLOB, including the derived values (n, d and the CRT parameters),
+# so loading a key is a few int.from_bytes instead of parsing decimal strings and recomputing lambda(n) and d.
+# The list of the extra primes of a multi-prime key and their CRT parameters are stored as packed lists of integers (see pack_ints).
+#
+# The version of the schema is kept in PRAGMA user_version, upgrade migrates the tables of the older versions (decimal strings) in place.
+#
+# The package sqlite3 is required (it is part of the standard library)
+#
+# List of functions :
+#       - int_to_blob               (encode an integer as big endian bytes)
+#       - blob_to_int               (decode an integer stored as bytes, or as a decimal string by an older version)
+#       - pack_ints                 (encode a list of integers as one BLOB)
+#       - unpack_ints               (decode a list of integers encoded by pack_ints)
+#       - key_to_record             (get the values of the columns for a key)
+#       - record_to_key             (build a key from the values of the columns)
+#       - enable_wal                (switch a connection to the write-ahead log)
+#       - insert_keys               (insert many keys with batched commits)
+#       - upgrade                   (create the table or migrate it from an older version)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+from tinyRSA_key import TinyRSA_key as RSAkey
+
+SCHEMA_VERSION = 2      # 1 : decimal strings (p, q, e and extra_primes), 2 : BLOBs with the derived values
+COMMIT_BATCH = 1000     # number of rows inserted between two commits
+COLUMNS = ("p", "q", "n", "e", "d", "dp", "dq", "qinv", "extra_primes", "extra_crt")
+CREATE_TABLE = """CREATE TABLE IF NOT EXISTS RSA_scheme (
+    id INTEGER NOT NULL PRIMARY KEY,
+    p BLOB, q BLOB, n BLOB, e BLOB, d BLOB,
+    dp BLOB, dq BLOB, qinv BLOB,
+    extra_primes BLOB, extra_crt BLOB
+)"""
+INSERT = "INSERT INTO RSA_scheme ({}) VALUES ({})".format(", ".join(COLUMNS), ", ".join("?"*len(COLUMNS)))
+INSERT_WITH_ID = "INSERT INTO RSA_scheme (id, {}) VALUES (?, {})".format(", ".join(COLUMNS), ", ".join("?"*len(COLUMNS)))
+
+# START int_to_blob FUNCTION
+
+def int_to_blob(value):
+    """
+    Returns the positive integer value as big endian bytes (at least one byte), or None if value is None.
+    """
+    if value==None:
+        return(None)
+    return(value.to_bytes(max(1, (value.bit_length()+7)//8), "big"))
+
+# END int_to_blob FUNCTION
+
+# START blob_to_int FUNCTION
+
+def blob_to_int(data):
+    """
+    Returns the integer stored in a column, or None for an empty column.
+    data is big endian bytes (or a memoryview), a decimal string written by an older version of TinyRSA also works.
+    """
+    if data==None:
+        return(None)
+    if isinstance(data, str):
+        return(int(data))
+    if isinstance(data, int):
+        return(data)
+    return(int.from_bytes(data, "big"))
+
+# END blob_to_int FUNCTION
+
+# START pack_ints FUNCTION
+
+def pack_ints(values):
+    """
+    Returns the list of positive integers values as one BLOB (each integer is its length in bytes on 4 bytes followed by its bytes), or None if the list is empty.
+    """
+    values = list(values)
+    if not values:
+        return(None)
+    parts = []
+    for value in values:
+        blob = int_to_blob(value)
+        parts.append(len(blob).to_bytes(4, "big"))
+        parts.append(blob)
+    return(b"".join(parts))
+
+# END pack_ints FUNCTION
+
+# START unpack_ints FUNCTION
+
+def unpack_ints(data):
+    """
+    Returns the list of integers encoded by pack_ints (an empty list for an empty column).
+    """
+    if not data:
+        return([])
+    data = memoryview(data)
+    values = []
+    position = 0
+    while position<len(data):
+        length = int.from_bytes(data[position:position+4], "big")
+        position += 4
+        values.append(int.from_bytes(data[position:position+length], "big"))
+        position += length
+    return(values)
+
+# END unpack_ints FUNCTION
+
+# START key_to_record FUNCTION
+
+def key_to_record(key):
+    """
+    Returns the dictionary column -> value to store the key (see COLUMNS).
+    """
+    return({"p": int_to_blob(key.p),
+            "q": int_to_blob(key.q),
+            "n": int_to_blob(key.n),
+            "e": int_to_blob(key.e),
+            "d": int_to_blob(key.d),
+            "dp": int_to_blob(key.dp),
+            "dq": int_to_blob(key.dq),
+            "qinv": int_to_blob(key.qinv),
+            "extra_primes": pack_ints(key.extra_primes),
+            "extra_crt": pack_ints(value for parameters in key.extra_crt for value in parameters)})
+
+# END key_to_record FUNCTION
+
+# START record_to_key FUNCTION
+
+def record_to_key(record):
+    """
+    Returns the TinyRSA_key stored in record, a dictionary (or any object with the columns as attributes, like a row of the app).
+    The key is restored directly from the stored values, a record without n or d (incomplete migration) is rebuilt with create_from.
+    """
+    if isinstance(record, dict):
+        values = {column: record.get(column) for column in COLUMNS}
+    else:
+        values = {column: getattr(record, column, None) for column in COLUMNS}
+    p, q, n, e, d = [blob_to_int(values[column]) for column in ("p", "q", "n", "e", "d")]
+    extra_primes = unpack_ints(values["extra_primes"])
+    key = RSAkey()
+    if n==None or d==None:
+        key.create_from(p, q, e, extra_primes)
+        return(key)
+    extra_crt = unpack_ints(values["extra_crt"])
+    key.restore(p, q, e, n, d,
+                blob_to_int(values["dp"]), blob_to_int(values["dq"]), blob_to_int(values["qinv"]),
+                extra_primes, zip(extra_crt[0::2], extra_crt[1::2]))
+    return(key)
+
+# END record_to_key FUNCTION
+
+# START enable_wal FUNCTION
+
+def enable_wal(connection):
+    """
+    Switch the SQLite connection to the write-ahead log : the readers don't block the writer anymore and a commit is a single append to the log.
+    With synchronous=NORMAL the log is only synced at checkpoints, which is safe in WAL mode (a power loss can only lose the last commits).
+    It can't be called inside a transaction.
+    """
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+# END enable_wal FUNCTION
+
+# START insert_keys FUNCTION
+
+def insert_keys(connection, keys, batch_size=COMMIT_BATCH):
+    """
+    Insert the keys in the table with one commit every batch_size keys and return the list of their ids.
+    Committing for each key forces a write to the disk for each key, which is what makes the bulk inserts slow.
+    """
+    cursor = connection.cursor()
+    ids = []
+    try:
+        for key in keys:
+            record = key_to_record(key)
+            cursor.execute(INSERT, [record[column] for column in COLUMNS])
+            ids.append(cursor.lastrowid)
+            if len(ids)%batch_size==0:
+                connection.commit()
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    return(ids)
+
+# END insert_keys FUNCTION
+
+# START upgrade FUNCTION
+
+def upgrade(connection, batch_size=COMMIT_BATCH):
+    """
+    Create the table RSA_scheme if it doesn't exist, or migrate it in place if it has been created by an older version.
+    The rows of an older version only have p, q and e (and extra_primes) as decimal strings : each key is rebuilt once with create_from and stored with its derived values.
+    A row that isn't a valid key is kept with its primes and exponent only.
+    The migration is done in a single transaction (the rows are read batch_size at a time), so the table is either fully migrated or left unchanged.
+    Returns the number of migrated rows.
+    """
+    cursor = connection.cursor()
+    try:
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(RSA_scheme)")]
+        if columns and (version>=SCHEMA_VERSION or "dp" in columns):
+            if version<SCHEMA_VERSION:
+                cursor.execute("PRAGMA user_version={}".format(SCHEMA_VERSION))
+            return(0)
+
+        cursor.execute("BEGIN")
+        migrated = 0
+        if columns:
+            cursor.execute("ALTER TABLE RSA_scheme RENAME TO RSA_scheme_legacy")
+        cursor.execute(CREATE_TABLE)
+        if columns:
+            query = "SELECT id, p, q, e, {} FROM RSA_scheme_legacy ORDER BY id".format("extra_primes" if "extra_primes" in columns else "NULL")
+            reader = connection.cursor()
+            reader.execute(query)
+            rows = reader.fetchmany(batch_size)
+            while rows:
+                records = []
+                for id, p, q, e, extra_primes in rows:
+                    try:
+                        key = RSAkey()
+                        key.create_from(int(p), int(q), int(e), [int(prime) for prime in extra_primes.split(",")] if extra_primes else [])
+                        record = key_to_record(key)
+                    except (TypeError, ValueError):
+                        record = {"p": p, "q": q, "e": e}      # kept as they are, loading this key fails as it did before
+                    records.append([id] + [record.get(column) for column in COLUMNS])
+                cursor.executemany(INSERT_WITH_ID, records)
+                migrated += len(records)
+                rows = reader.fetchmany(batch_size)
+            reader.close()
+            cursor.execute("DROP TABLE RSA_scheme_legacy")
+        cursor.execute("PRAGMA user_version={}".format(SCHEMA_VERSION))
+        connection.commit()
+        return(migrated)
+    except:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+# END upgrade FUNCTION
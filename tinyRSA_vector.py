@@ -0,0 +1,157 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the vectorized engine for the tiny keys, it encrypts and decrypts all the blocks of a message at once with NumPy
+# When the modulus n is at most 32 bits long, every block and every product of two blocks mod n fits in an unsigned 64 bits integer :
+# the blocks are stored in a uint64 array and the modular exponentiation (square and multiply) is done on the whole array at each step.
+# The binary strings of the cipher texts are built and parsed as arrays of 0 and 1 as well.
+# The results are exactly the same as the scalar path of tinyRSA_message (same block layout, same padding).
+#
+# The package numpy is optional, it is only imported the first time the engine is used (see available).
+#
+# List of functions :
+#       - available                 (check if numpy is installed)
+#       - usable                    (check if the engine can be used with a key)
+#       - powmod_array              (modular exponentiation of every value of an array)
+#       - bits_to_array             (split an array of bits into an array of blocks)
+#       - array_to_bits             (write an array of blocks as an array of bits)
+#       - encrypt_bytes             (encrypt bytes into a binary string)
+#       - decrypt_bits              (decrypt a binary string into bytes)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+MAX_BITS = 32           # largest modulus (in bits) such that the product of two numbers mod n fits in 64 bits
+THRESHOLD = 64          # below this number of blocks the scalar path is faster
+CHUNK_BLOCKS = 65536    # number of blocks handled at once, a multiple of 8 so each chunk gives whole bytes
+
+numpy = None            # the numpy module once imported, False if it isn't installed
+
+# START available FUNCTION
+
+def available():
+    """
+    Returns True if numpy is installed, it is imported the first time this function is called.
+    """
+    global numpy
+    if numpy==None:
+        try:
+            import numpy as module
+            numpy = module
+        except ImportError:
+            numpy = False
+    return(numpy is not False)
+
+# END available FUNCTION
+
+# START usable FUNCTION
+
+def usable(key, count=None):
+    """
+    Returns True if the vectorized engine can be used with key : the modulus is at most MAX_BITS bits, numpy is installed and there are at least THRESHOLD blocks (count, if given).
+    """
+    bit_length = key.get_bitlength() if key.n!=None else None
+    if bit_length==None or bit_length>MAX_BITS:
+        return(False)
+    if count!=None and count<THRESHOLD:
+        return(False)
+    return(available())
+
+# END usable FUNCTION
+
+# START powmod_array FUNCTION
+
+def powmod_array(blocks, exponent, modulus):
+    """
+    Returns the array of block^exponent mod modulus for each block of the uint64 array blocks, modulus being at most MAX_BITS bits.
+    Right to left square and multiply : the values are always smaller than modulus so each product is smaller than 2^64 and never overflows.
+    """
+    if modulus>=1 << MAX_BITS:
+        raise ValueError("The modulus is too large for the vectorized engine")
+    modulus = numpy.uint64(modulus)
+    base = blocks % modulus
+    result = numpy.full(blocks.shape, 1 % modulus, dtype=numpy.uint64)
+    while exponent:
+        if exponent & 1:
+            result = result * base % modulus
+        exponent >>= 1
+        if exponent:
+            base = base * base % modulus
+    return(result)
+
+# END powmod_array FUNCTION
+
+# START bits_to_array FUNCTION
+
+def bits_to_array(bits, block_bits):
+    """
+    Returns the uint64 array of the blocks of block_bits bits read from bits, an array of 0 and 1 (uint8), the last block is padded with zeros to the right.
+    """
+    padding = -len(bits) % block_bits
+    if padding:
+        bits = numpy.concatenate((bits, numpy.zeros(padding, dtype=numpy.uint8)))
+    weights = numpy.uint64(1) << numpy.arange(block_bits-1, -1, -1, dtype=numpy.uint64)     # big endian
+    return(bits.reshape(-1, block_bits).astype(numpy.uint64) @ weights)
+
+# END bits_to_array FUNCTION
+
+# START array_to_bits FUNCTION
+
+def array_to_bits(blocks, block_bits):
+    """
+    Returns the array of 0 and 1 (uint8) of the blocks written on block_bits bits each, big endian.
+    """
+    shifts = numpy.arange(block_bits-1, -1, -1, dtype=numpy.uint64)
+    return(((blocks[:, None] >> shifts) & numpy.uint64(1)).astype(numpy.uint8).ravel())
+
+# END array_to_bits FUNCTION
+
+# START encrypt_bytes FUNCTION
+
+def encrypt_bytes(key, data):
+    """
+    Encrypt data (bytes) with key and return the cipher text as a binary string, exactly as TinyRSA_message.encrypt.
+    The data is handled CHUNK_BLOCKS blocks at a time to bound the memory used.
+    """
+    bit_length = key.get_bitlength()
+    if not available():
+        raise ValueError("The vectorized engine needs numpy")
+    step = (bit_length-1)*CHUNK_BLOCKS//8   # number of bytes of CHUNK_BLOCKS plain blocks
+    pieces = []
+    for start in range(0, len(data), step):
+        bits = numpy.unpackbits(numpy.frombuffer(data[start:start+step], dtype=numpy.uint8))
+        ciphers = powmod_array(bits_to_array(bits, bit_length-1), key.e, key.n)
+        pieces.append((array_to_bits(ciphers, bit_length) + ord("0")).tobytes().decode("ascii"))
+    return("".join(pieces))
+
+# END encrypt_bytes FUNCTION
+
+# START decrypt_bits FUNCTION
+
+def decrypt_bits(key, cipher):
+    """
+    Decrypt the binary string cipher with key and return the plain text as bytes, exactly as TinyRSA_message.decrypt.
+    Raises ValueError if cipher isn't a string of 0 and 1.
+    """
+    bit_length = key.get_bitlength()
+    if not available():
+        raise ValueError("The vectorized engine needs numpy")
+    try:
+        characters = numpy.frombuffer(cipher.encode("ascii"), dtype=numpy.uint8)
+    except (AttributeError, UnicodeEncodeError):
+        raise ValueError("Invalid cipher text, expected a string of 0 and 1.")
+    if len(characters)==0:
+        return(b"")
+    bits = characters - numpy.uint8(ord("0"))
+    if bits.max()>1:
+        raise ValueError("Invalid cipher text, expected a string of 0 and 1.")
+
+    mask = numpy.uint64((1 << (bit_length-1)) - 1)      # remove the leading zero of each block
+    step = bit_length*CHUNK_BLOCKS
+    pieces = []
+    for start in range(0, len(bits), step):
+        plains = powmod_array(bits_to_array(bits[start:start+step], bit_length), key.d, key.n) & mask
+        pieces.append(numpy.packbits(array_to_bits(plains, bit_length-1)).tobytes())
+    return(b"".join(pieces))
+
+# END decrypt_bits FUNCTION
@@ -0,0 +1,145 @@
+# This file is part of the TinyRSA project.
+# This project is about implementing a very simple (and insecure) RSA cryptosystem to play around
+# The main goal is to be able to change the length of the key for hacking purposes
+#
+# This file contains the binary container of the cipher texts, 8 times smaller than the binary strings of 0 and 1
+# The layout is a header of 13 bytes followed by the cipher blocks, each one on a fixed number of bytes (big endian) :
+#       - magic         2 bytes     b"TR"
+#       - version       1 byte      VERSION
+#       - key id        4 bytes     id of the key in the database of the app (0 if unknown)
+#       - width         2 bytes     length of the modulus in bytes, which is the length of each block
+#       - count         4 bytes     number of blocks
+# The container can be written as text for the HTML forms and the JSON API, in hexadecimal or in base64.
+#
+# The blocks are read from slices of a memoryview of the container, the buffer is never copied.
+#
+# List of functions :
+#       - encode_blocks             (write cipher blocks into a container)
+#       - read_header               (read and check the header of a container)
+#       - iter_blocks               (generator returning the blocks of a container)
+#       - to_text                   (write a container as hexadecimal or base64 text)
+#       - from_text                 (read a container written as text)
+#       - detect_format             (find the format of a cipher text)
+#
+# The beginning of each function can be easily reached by searching for the string "START function name"
+
+import base64
+import binascii
+import struct
+
+MAGIC = b"TR"
+VERSION = 1
+HEADER = struct.Struct(">2sBIHI")   # magic, version, key id, width, count
+FORMATS = ("bits", "binary", "hex", "base64")
+HEX_PREFIX = binascii.hexlify(MAGIC).decode("ascii")    # a hexadecimal container always starts with these characters
+
+# START encode_blocks FUNCTION
+
+def encode_blocks(blocks, bit_length, key_id=0):
+    """
+    Returns the container (bytes) of the cipher blocks of a key whose modulus is bit_length bits long.
+    key_id is the id of the key, it is only kept as information for the receiver (0 if unknown).
+    """
+    width = (bit_length+7)//8
+    blocks = list(blocks)
+    if not (0<=key_id<2**32):
+        raise ValueError("Invalid key id for the cipher container, it should fit on 4 bytes")
+    if width>=2**16:
+        raise ValueError("The modulus is too long for the cipher container")
+    data = bytearray(HEADER.size + width*len(blocks))
+    HEADER.pack_into(data, 0, MAGIC, VERSION, key_id, width, len(blocks))
+    offset = HEADER.size
+    for block in blocks:
+        data[offset:offset+width] = block.to_bytes(width, "big")
+        offset += width
+    return(bytes(data))
+
+# END encode_blocks FUNCTION
+
+# START read_header FUNCTION
+
+def read_header(data):
+    """
+    Returns (key id, width, count, view) for the container data (bytes, bytearray or memoryview), view being a memoryview on the blocks.
+    Raises ValueError if data isn't a valid container.
+    """
+    view = memoryview(data)
+    if len(view)<HEADER.size:
+        raise ValueError("Invalid cipher container, the header is incomplete")
+    magic, version, key_id, width, count = HEADER.unpack_from(view)
+    if magic!=MAGIC:
+        raise ValueError("Invalid cipher container, wrong magic number")
+    if version!=VERSION:
+        raise ValueError("Unsupported version {} of the cipher container".format(version))
+    if width==0 or len(view)!=HEADER.size + width*count:
+        raise ValueError("Invalid cipher container, the length doesn't match the header")
+    return(key_id, width, count, view[HEADER.size:])
+
+# END read_header FUNCTION
+
+# START iter_blocks FUNCTION
+
+def iter_blocks(data):
+    """
+    Generator returning the integer blocks of the container data, each one read from a slice of a memoryview (no copy of the buffer).
+    """
+    key_id, width, count, view = read_header(data)
+    for offset in range(0, width*count, width):
+        yield int.from_bytes(view[offset:offset+width], "big")
+
+# END iter_blocks FUNCTION
+
+# START to_text FUNCTION
+
+def to_text(data, encoding="base64"):
+    """
+    Returns the container data as text, encoding being "hex" or "base64".
+    """
+    if encoding=="hex":
+        return(binascii.hexlify(data).decode("ascii"))
+    if encoding=="base64":
+        return(base64.b64encode(data).decode("ascii"))
+    raise ValueError("Unknown text encoding {}, choose hex or base64".format(encoding))
+
+# END to_text FUNCTION
+
+# START from_text FUNCTION
+
+def from_text(text):
+    """
+    Returns the container written as text by to_text, the encoding (hexadecimal or base64) is detected.
+    Raises ValueError if the text isn't a container.
+    """
+    text = text.strip()
+    try:
+        if text.startswith(HEX_PREFIX):
+            data = binascii.unhexlify(text)
+        else:
+            data = base64.b64decode(text, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("Invalid cipher text, expected a hexadecimal or base64 container")
+    read_header(data)
+    return(data)
+
+# END from_text FUNCTION
+
+# START detect_format FUNCTION
+
+def detect_format(cipher):
+    """
+    Returns the format of a cipher text : "bits" (string of 0 and 1), "binary" (container as bytes), "hex" or "base64" (container as text).
+    A string of 0 and 1 is never a container as text : the hexadecimal form starts with HEX_PREFIX and the base64 form with the letters of the magic number.
+    The spaces and end of lines around the text are ignored (the cipher texts often come from a text area).
+    """
+    if isinstance(cipher, (bytes, bytearray, memoryview)):
+        return("binary")
+    if not isinstance(cipher, str):
+        raise ValueError("Invalid cipher text, expected a string or bytes")
+    cipher = cipher.strip()
+    if cipher.strip("01")=="":
+        return("bits")
+    if cipher.startswith(HEX_PREFIX):
+        return("hex")
+    return("base64")
+
+# END detect_format FUNCTION